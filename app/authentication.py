@@ -1,25 +1,36 @@
 from jose import JWTError, jwt, ExpiredSignatureError
-import bcrypt
-from passlib.context import CryptContext
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from app.config import *
+from app.config import (
+    JWT_ALGORITHM, JWT_AUTH_SECRET_KEY, JWT_ACCESS_TOKEN_EXPIRE_MINUTES, JWT_EMAIL_VERIFY_SECRET_KEY,
+    JWT_EMAIL_VERIFY_EXPIRE_MINUTES, JWT_PASSWORD_RESET_SECRET_KEY, JWT_PASSWORD_RESET_EXPIRE_MINUTES
+)
 from app.errors.auth import TokenInvalidError, TokenNullError, AccessTokenExpiredError
 from app.models.token import *
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_pwd_context = None
+
+
+def get_pwd_context():
+    # Passlib and bcrypt are needed only to register, log in and change a password, the first of these loads them
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 
 def generate_salt() -> str:
+    import bcrypt
     return bcrypt.gensalt().decode()
 
 
 def hash_password(password: str, salt: str) -> str:
-    return pwd_context.hash(password + salt)
+    return get_pwd_context().hash(password + salt)
 
 
 def verify_password(password: str, salt: str, hashed_pw: str) -> bool:
-    return pwd_context.verify(password + salt, hashed_pw)
+    return get_pwd_context().verify(password + salt, hashed_pw)
 
 
 def create_access_token(data: AccessToken):
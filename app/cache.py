@@ -1,10 +1,654 @@
+import asyncio
+import glob
+import hashlib
+import inspect
+import secrets
+import time
+from collections import OrderedDict, Counter
+from decimal import Decimal
+from fnmatch import fnmatch
+from functools import wraps
+from typing import Optional, Dict, List, NamedTuple, Set, Tuple
+
+import orjson
 import redis
+from redis import asyncio as aioredis
+from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.config import (
+    REDIS_URL, RESPONSE_CACHE_ENABLED, CACHE_STALE_TTL, CACHE_LOCK_TIMEOUT, CACHE_LOCAL_TTL, CACHE_LOCAL_SIZE,
+    COMPRESSION_ENABLED, COMPRESSION_MINIMUM_SIZE, CACHE_COMPRESSION_LEVELS, CACHE_WARM_KEYS, CACHE_WARM_INTERVAL,
+    CACHE_WARM_DELAY, CACHE_WARM_MAX_DELAY, CACHE_WARM_HALF_LIFE
+)
+from app.compression import ENCODINGS, PREFERENCE, compress, choose_encoding
+from app.categories import normalize_category
+from app.database import read_from_primary
+from app.metrics import CACHE_WARMED
+
+ACCOUNT_KEY = "cc-account:{user_id}"
+IDEA_VERSION_KEY = "cc-idea-version:{idea_id}"
+# Seconds a version of an idea is remembered, afterwards clients get the full idea once more
+IDEA_VERSION_TTL = 24 * 3600
+# Pages cached by fastapi-redis-cache used cc-cache, they are plain strings and simply expire
+CACHE_PREFIX = "cc-page"
+CACHE_LOCK_KEY = "cc-lock:{key}"
+CACHE_HEADER = "X-MyAPI-Cache"
+# Seconds between checks for the result of a listing another worker is computing
+CACHE_LOCK_POLL = 0.02
+# Seconds Redis is left alone after a failed call, so requests do not each wait for it to time out
+REDIS_RETRY_AFTER = 5
+# Seconds to connect to Redis and to wait for an answer, a slow Redis counts as failed
+REDIS_CONNECT_TIMEOUT = 0.5
+REDIS_TIMEOUT = 1.0
+# Patterns of invalidated keys are published here, every worker drops the matching pages it keeps in memory
+INVALIDATE_CHANNEL = "cc-cache-invalidate"
+# Requests of every cached page, members are the calls as JSON and scores the decayed number of requests
+HITS_KEY = "cc-cache-hits"
+# Exists for CACHE_WARM_HALF_LIFE seconds after the counts were halved, so that happens once whatever the workers
+HITS_DECAY_KEY = "cc-cache-hits-decay"
+# HITS_KEY keeps this many times CACHE_WARM_KEYS calls when the counts are halved, so pages that become popular can
+# climb into the warmed ones
+HITS_KEPT = 10
+WARM_LOCK_KEY = "cc-lock:cache-warmer"
+# Seconds one worker may take to warm the cache before another one starts to
+WARM_LOCK_TIMEOUT = 60
+
+# Keys of the cached public listings
+LISTING_KEYS = [
+    f"{CACHE_PREFIX}:app.routers.ideas.get_ideas(*",
+    f"{CACHE_PREFIX}:app.routers.ideas.get_hottest_ideas(*",
+    f"{CACHE_PREFIX}:app.routers.ideas.get_categories(*"
+]
+
+# Marks cached pages stale. A page that expired since its key was found is not written again, it would have no TTL.
+MARK_STALE_SCRIPT = """
+for index = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[index]) == 1 then
+        redis.call('HSET', KEYS[index], 'fresh', 0)
+    end
+end
+return 0
+"""
+# Keys marked stale by one call of MARK_STALE_SCRIPT
+MARK_STALE_BATCH = 500
+
+# Lock is only deleted by the worker that holds it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class CachedPage(NamedTuple):
+    # JSON of the page exactly as it is sent, with its ETag, the time it stops being fresh and the same JSON
+    # compressed with every encoding, so hits never compress it again
+    body: bytes
+    etag: str
+    fresh: float
+    encoded: Dict[str, bytes]
+
+
+class LocalCache:
+    # Small LRU of fresh pages in front of Redis, hot pages are served without a network hop. It is only used while
+    # the worker listens for invalidations, otherwise a page changed by another worker could be served.
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.active = False
+        self.entries = OrderedDict()
+
+    def get(self, key: str, now: float) -> Optional[CachedPage]:
+        entry = self.entries.get(key)
+        if not self.active or entry is None:
+            return None
+        page, expires = entry
+        if expires <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return page
+
+    def set(self, key: str, page: CachedPage, expires: float):
+        if not self.active:
+            return
+        self.entries[key] = (page, expires)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, pattern: str):
+        for key in [key for key in self.entries if fnmatch(key, pattern)]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Async clients by their connect and read timeouts, each keeps a pool of connections
+_async_redis: Dict[Tuple, aioredis.Redis] = {}
+# Computations of cached responses running in this process, concurrent misses of a key wait for the same one
+_inflight: Dict[str, asyncio.Task] = {}
+_listener: Optional[asyncio.Task] = None
+_redis_failed_at = 0.0
+local_cache = LocalCache(CACHE_LOCAL_SIZE)
+# Functions cached with cached_response by module and name, with the seconds their pages are fresh
+_cached_functions: Dict[str, Tuple] = {}
+# Requests of cached pages since the counts were last added to HITS_KEY, with the call of each page
+_hits: Counter = Counter()
+_calls: Dict[str, Tuple] = {}
+_warmer: Optional[asyncio.Task] = None
+# Set by every invalidation, created with the warmer so it belongs to the loop of the server
+_warm_requested: Optional[asyncio.Event] = None
+
+
+def redis_unavailable() -> bool:
+    return time.time() - _redis_failed_at < REDIS_RETRY_AFTER
+
+
+def redis_failed():
+    global _redis_failed_at
+    _redis_failed_at = time.time()
+
+
+def get_async_redis(
+        connect_timeout: float = REDIS_CONNECT_TIMEOUT, timeout: Optional[float] = REDIS_TIMEOUT
+) -> aioredis.Redis:
+    # Callers that must not wait long, like the rate limiter, get a client with shorter timeouts, subscriptions one
+    # without a read timeout. All of them share redis_unavailable, so one outage is noticed once.
+    client = _async_redis.get((connect_timeout, timeout))
+    if client is None:
+        client = _async_redis[(connect_timeout, timeout)] = aioredis.Redis.from_url(
+            REDIS_URL, socket_connect_timeout=connect_timeout, socket_timeout=timeout
+        )
+    return client
+
+
+async def invalidate_ideas(*idea_ids: str):
+    # Listings are the only cached responses that show ideas, changed ideas get a new version for their ETags
+    await invalidate_listings()
+    await drop_idea_versions(list(idea_ids))
+
+
+async def drop_idea_versions(idea_ids: List[str]):
+    if len(idea_ids) == 0 or redis_unavailable():
+        return
+    try:
+        await get_async_redis().delete(*[IDEA_VERSION_KEY.format(idea_id=idea_id) for idea_id in idea_ids])
+    except redis.RedisError:
+        redis_failed()
+
+
+async def get_idea_version(idea_id: str) -> Optional[str]:
+    # Version is a random value instead of a counter, so a dropped or expired key never brings back an old version.
+    # It has to be read before the idea, then a change made in between only leads to one more full response.
+    if redis_unavailable():
+        return None
+    r = get_async_redis()
+    key = IDEA_VERSION_KEY.format(idea_id=idea_id)
+    try:
+        version = await r.get(key)
+        if version is None:
+            await r.set(key, secrets.token_hex(8), nx=True, ex=IDEA_VERSION_TTL)
+            version = await r.get(key)
+    except redis.RedisError:
+        redis_failed()
+        return None
+    return version.decode() if version is not None else None
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    tags = [tag.strip().replace("W/", "", 1) for tag in header.split(",")]
+    return "*" in tags or etag.replace("W/", "", 1) in tags
+
+
+def not_modified(etag: str, headers: Optional[dict] = None) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, **(headers or {})})
+
+
+async def mark_stale(r: aioredis.Redis, keys: list, patterns: List[str]):
+    # Marks the pages stale and tells every worker to drop the pages matching the patterns from memory
+    pipe = r.pipeline(transaction=False)
+    for start in range(0, len(keys), MARK_STALE_BATCH):
+        batch = keys[start:start + MARK_STALE_BATCH]
+        pipe.eval(MARK_STALE_SCRIPT, len(batch), *batch)
+    for pattern in patterns:
+        pipe.publish(INVALIDATE_CHANNEL, pattern)
+    await pipe.execute()
+
+
+async def invalidate_listings():
+    # Cached pages are marked stale instead of being deleted. The next request of a page still gets the old one while
+    # a single refresh runs, so a write does not send every client to the database at once.
+    for pattern in LISTING_KEYS:
+        local_cache.invalidate(pattern)
+    if redis_unavailable():
+        return
+    try:
+        r = get_async_redis()
+        keys = [key for pattern in LISTING_KEYS async for key in r.scan_iter(match=pattern, count=500)]
+        await mark_stale(r, keys, LISTING_KEYS)
+    except redis.RedisError:
+        redis_failed()
+
+
+async def invalidate_listings_of(idea_ids: List[str], categories: Set[str]):
+    # Marks stale only the cached listings that can show the ideas: the pages without a filter and those of the
+    # categories of the ideas, which all shift, the category counts, and the hottest ideas when the ideas are among
+    # them. Pages of other categories stay fresh.
+    if len(idea_ids) == 0 or redis_unavailable():
+        return
+    try:
+        r = get_async_redis()
+        keys = []
+        async for key in r.scan_iter(match=f"{CACHE_PREFIX}:app.routers.ideas.get_ideas(*", count=500):
+            # Keys of the listings end with ",cat=<category>)", see get_cache_key
+            category = key.decode().rpartition(",cat=")[2][:-1]
+            if category == "None" or normalize_category(category) in categories:
+                keys.append(key)
+        if len(categories) > 0:
+            keys.extend([
+                key async for key in r.scan_iter(match=f"{CACHE_PREFIX}:app.routers.ideas.get_categories(*", count=500)
+            ])
+        hottest = [
+            key async for key in r.scan_iter(match=f"{CACHE_PREFIX}:app.routers.ideas.get_hottest_ideas(*", count=500)
+        ]
+        if len(hottest) > 0:
+            # Bodies of all the hottest pages in one round trip
+            pipe = r.pipeline(transaction=False)
+            for key in hottest:
+                pipe.hget(key, "body")
+            for key, body in zip(hottest, await pipe.execute()):
+                if any(idea_id.encode() in (body or b"") for idea_id in idea_ids):
+                    keys.append(key)
+        # Workers match the published patterns, an escaped key matches only itself
+        patterns = [glob.escape(key.decode()) for key in keys]
+        for pattern in patterns:
+            local_cache.invalidate(pattern)
+        await mark_stale(r, keys, patterns)
+    except redis.RedisError:
+        redis_failed()
+
+
+async def listen_for_invalidations():
+    while True:
+        pubsub = get_async_redis(timeout=None).pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            # Invalidations sent while the worker was not listening are lost, so it starts empty
+            local_cache.clear()
+            local_cache.active = True
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    local_cache.invalidate(message["data"].decode())
+                    if _warm_requested is not None:
+                        _warm_requested.set()
+        except (redis.RedisError, OSError):
+            local_cache.active = False
+            await asyncio.sleep(1)
+        finally:
+            local_cache.active = False
+            await pubsub.reset()
+
+
+def start_cache_listener():
+    global _listener
+    # Warmer learns about invalidations of every worker through the listener as well
+    if RESPONSE_CACHE_ENABLED and (CACHE_LOCAL_SIZE > 0 or CACHE_WARM_KEYS > 0):
+        _listener = asyncio.ensure_future(listen_for_invalidations())
+
+
+async def stop_cache_listener():
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+
+
+def get_cache_key(func, *args, **kwargs) -> str:
+    arguments = inspect.signature(func).bind(*args, **kwargs)
+    arguments.apply_defaults()
+    args_str = ",".join(f"{name}={value}" for name, value in arguments.arguments.items())
+    return f"{CACHE_PREFIX}:{func.__module__}.{func.__name__}({args_str})"
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def encode_page(data) -> CachedPage:
+    # Page is serialized once with orjson, which handles dates itself. Hits send these bytes as they are, without
+    # validating them against the response model or encoding them again.
+    if isinstance(data, BaseModel):
+        data = data.dict()
+    body = orjson.dumps(data, default=encode_default)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    return CachedPage(body=body, etag=etag, fresh=0, encoded={})
+
+
+def compress_page(page: CachedPage) -> CachedPage:
+    # Done once when the page is stored, with higher levels than responses that are compressed on every request
+    if not COMPRESSION_ENABLED or len(page.body) < COMPRESSION_MINIMUM_SIZE:
+        return page
+    return page._replace(encoded={
+        encoding: compress(page.body, encoding, CACHE_COMPRESSION_LEVELS[encoding]) for encoding in ENCODINGS
+    })
+
+
+def page_response(request: Request, page: CachedPage, result: str) -> Response:
+    headers = {CACHE_HEADER: result, "Vary": "Accept-Encoding"}
+    # Encodings the page was stored with, another worker may have brotli or zstd installed when this one does not
+    encoding = choose_encoding(
+        request.headers.get("accept-encoding", ""), [encoding for encoding in PREFERENCE if encoding in page.encoded]
+    )
+    body, etag = page.body, page.etag
+    if encoding is not None:
+        # Compressed bytes are another representation of the page, so they get their own strong ETag
+        body, etag = page.encoded[encoding], f'{page.etag[:-1]}-{encoding}"'
+        headers["Content-Encoding"] = encoding
+    # Client that already has the page gets 304 without a body
+    if etag_matches(request, etag):
+        return not_modified(etag, headers)
+    return Response(content=body, media_type="application/json", headers={**headers, "ETag": etag})
+
+
+async def read_cache(key: str) -> Optional[CachedPage]:
+    entry = await get_async_redis().hgetall(key)
+    # Entry without a body is left behind when a page expires while it is being marked stale, one without an ETag
+    # was written before ETags were stored
+    if b"body" not in entry or b"etag" not in entry:
+        return None
+    return CachedPage(
+        body=entry[b"body"],
+        etag=entry[b"etag"].decode(),
+        fresh=float(entry[b"fresh"]),
+        encoded={name[5:].decode(): value for name, value in entry.items() if name.startswith(b"body:")}
+    )
+
+
+async def write_cache(key: str, page: CachedPage, expire: int) -> CachedPage:
+    page = page._replace(fresh=time.time() + expire)
+    pipe = get_async_redis().pipeline(transaction=True)
+    # Entry is replaced as a whole, so no encoding of an older page is left in it
+    pipe.delete(key)
+    pipe.hset(key, mapping={
+        "body": page.body,
+        "etag": page.etag,
+        "fresh": page.fresh,
+        **{f"body:{encoding}": body for encoding, body in page.encoded.items()}
+    })
+    # Stale pages are kept a bit longer than they are fresh, so they can be served during a refresh
+    pipe.expire(key, expire + CACHE_STALE_TTL)
+    await pipe.execute()
+    return page
+
+
+async def compute_response(key: str, func, args, kwargs, expire: int, wait: bool) -> Optional[CachedPage]:
+    # Runs in its own task, for a request of a read-only route, a refresh or the warmer
+    read_from_primary()
+    r = get_async_redis()
+    lock_key = CACHE_LOCK_KEY.format(key=key)
+    token = secrets.token_hex(8)
+    locked = await r.set(lock_key, token, nx=True, px=CACHE_LOCK_TIMEOUT * 1000)
+    if not locked:
+        # Another worker is computing the page, a background refresh leaves it to them
+        if not wait:
+            return None
+        deadline = time.time() + CACHE_LOCK_TIMEOUT
+        while time.time() < deadline:
+            await asyncio.sleep(CACHE_LOCK_POLL)
+            page = await read_cache(key)
+            if page is not None and page.fresh > time.time():
+                return page
+        # Worker holding the lock is too slow or gone, the page is computed here as well
+    try:
+        page = encode_page(await func(*args, **kwargs))
+        # Brotli at a high level takes a few milliseconds, the other requests are not held up meanwhile
+        return await write_cache(key, await run_in_threadpool(compress_page, page), expire)
+    finally:
+        if locked:
+            await r.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def report_refresh_error(task: asyncio.Task):
+    # Nobody awaits a background refresh, its errors would not be seen otherwise
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Refreshing a cached page failed: {task.exception()!r}")
+
+
+def single_flight(key: str, func, args, kwargs, expire: int, wait: bool) -> asyncio.Task:
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute_response(key, func, args, kwargs, expire, wait))
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _inflight.pop(key, None))
+    return task
+
+
+def cached_response(expire: int):
+    # Caches the JSON of a public route in Redis. A stale page is served while one background task refreshes it,
+    # and concurrent misses of a page share one computation, in this process and across workers.
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, cache_request: Request, **kwargs):
+            if not RESPONSE_CACHE_ENABLED or redis_unavailable():
+                return await func(*args, **kwargs)
+            key = get_cache_key(func, *args, **kwargs)
+            _hits[key] += 1
+            if key not in _calls:
+                _calls[key] = (func, args, kwargs)
+            now = time.time()
+            page = local_cache.get(key, now)
+            if page is not None:
+                return page_response(cache_request, page, "Hit")
+            try:
+                page = await read_cache(key)
+                if page is not None:
+                    if page.fresh > now:
+                        local_cache.set(key, page, min(page.fresh, now + CACHE_LOCAL_TTL))
+                        return page_response(cache_request, page, "Hit")
+                    single_flight(key, func, args, kwargs, expire, wait=False).add_done_callback(report_refresh_error)
+                    return page_response(cache_request, page, "Stale")
+                # Shielded, so a client that disconnects does not cancel the page other requests are waiting for
+                page = await asyncio.shield(single_flight(key, func, args, kwargs, expire, wait=True))
+            except redis.RedisError:
+                # Without Redis every request is computed
+                redis_failed()
+                return await func(*args, **kwargs)
+            if page is None:
+                # Page expired while a background refresh of it was waiting for another worker
+                return await func(*args, **kwargs)
+            local_cache.set(key, page, min(page.fresh, now + CACHE_LOCAL_TTL))
+            return page_response(cache_request, page, "Miss")
+
+        # Request is needed for If-None-Match, FastAPI passes it to the wrapper without the route declaring it
+        signature = inspect.signature(func)
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("cache_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+        ])
+        _cached_functions[f"{func.__module__}.{func.__name__}"] = (func, expire)
+        return wrapper
+    return decorator
+
+
+def encode_call(func, args, kwargs) -> Optional[bytes]:
+    # Arguments with their defaults and sorted, so the same page is always the same member of HITS_KEY
+    try:
+        arguments = inspect.signature(func).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        return orjson.dumps(
+            {"func": f"{func.__module__}.{func.__name__}", "kwargs": dict(arguments.arguments)},
+            option=orjson.OPT_SORT_KEYS
+        )
+    except TypeError:
+        return None
+
+
+def decode_call(member: bytes) -> Optional[Tuple]:
+    # Key, function, arguments and expiry of a counted call. Routes renamed or changed since it was counted are
+    # skipped, their counts decay.
+    call = orjson.loads(member)
+    cached = _cached_functions.get(call["func"])
+    if cached is None:
+        return None
+    func, expire = cached
+    try:
+        return get_cache_key(func, **call["kwargs"]), func, call["kwargs"], expire
+    except TypeError:
+        return None
+
+
+async def flush_hits():
+    # Counts of this worker are added to those of all workers
+    global _hits, _calls
+    hits, calls = _hits, _calls
+    _hits, _calls = Counter(), {}
+    members = {}
+    for key, count in hits.items():
+        member = encode_call(*calls[key])
+        if member is not None:
+            members[member] = count
+    r = get_async_redis()
+    if len(members) != 0:
+        pipe = r.pipeline(transaction=False)
+        for member, count in members.items():
+            pipe.zincrby(HITS_KEY, count, member)
+        await pipe.execute()
+    if await r.set(HITS_DECAY_KEY, 1, nx=True, ex=CACHE_WARM_HALF_LIFE):
+        pipe = r.pipeline(transaction=True)
+        pipe.zunionstore(HITS_KEY, {HITS_KEY: 0.5})
+        pipe.zremrangebyrank(HITS_KEY, 0, -CACHE_WARM_KEYS * HITS_KEPT - 1)
+        await pipe.execute()
+
+
+async def warm_cache() -> int:
+    # Computes the most requested pages that are missing, stale or stop being fresh before the next run, so their
+    # visitors get hits. One worker warms at a time, pages it refreshed are fresh for the others.
+    r = get_async_redis()
+    token = secrets.token_hex(8)
+    if not await r.set(WARM_LOCK_KEY, token, nx=True, px=WARM_LOCK_TIMEOUT * 1000):
+        return 0
+    try:
+        members = await r.zrevrange(HITS_KEY, 0, CACHE_WARM_KEYS - 1)
+        # Until pages were counted, e.g. on a new installation, the first page of every listing is warmed
+        for func, _ in _cached_functions.values():
+            member = encode_call(func, (), {})
+            if member is not None and member not in members:
+                members.append(member)
+        warmed = 0
+        for member in members:
+            call = decode_call(member)
+            if call is None:
+                continue
+            key, func, kwargs, expire = call
+            fresh = await r.hget(key, "fresh")
+            if fresh is not None and float(fresh) > time.time() + CACHE_WARM_INTERVAL:
+                continue
+            try:
+                if await single_flight(key, func, (), kwargs, expire, wait=False) is not None:
+                    warmed += 1
+            except redis.RedisError:
+                raise
+            except Exception as error:
+                print(f"Warming {key} failed: {error!r}")
+        CACHE_WARMED.inc(warmed)
+        return warmed
+    finally:
+        await r.eval(RELEASE_LOCK_SCRIPT, 1, WARM_LOCK_KEY, token)
+
+
+async def wait_for_invalidations():
+    # Returns after CACHE_WARM_INTERVAL seconds, or once a burst of invalidations is over, e.g. a batch of likes or
+    # archived ideas, so the pages are computed once after it instead of once per invalidation
+    try:
+        await asyncio.wait_for(_warm_requested.wait(), CACHE_WARM_INTERVAL)
+    except asyncio.TimeoutError:
+        return
+    deadline = time.time() + CACHE_WARM_MAX_DELAY
+    while True:
+        _warm_requested.clear()
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        try:
+            await asyncio.wait_for(_warm_requested.wait(), min(CACHE_WARM_DELAY, remaining))
+        except asyncio.TimeoutError:
+            return
+
+
+async def run_cache_warmer():
+    # First run is at startup, pages expired while the server was down are computed before visitors ask for them
+    while True:
+        if not redis_unavailable():
+            try:
+                await flush_hits()
+                await warm_cache()
+            except redis.RedisError:
+                redis_failed()
+            except Exception as error:
+                print(f"Warming the cache failed: {error!r}")
+        await wait_for_invalidations()
+
+
+def start_cache_warmer():
+    global _warmer, _warm_requested
+    if RESPONSE_CACHE_ENABLED and CACHE_WARM_KEYS > 0:
+        _warm_requested = asyncio.Event()
+        _warmer = asyncio.ensure_future(run_cache_warmer())
+
+
+async def stop_cache_warmer():
+    if _warmer is None:
+        return
+    _warmer.cancel()
+    try:
+        await _warmer
+    except asyncio.CancelledError:
+        pass
+    # Counts of the last interval are kept for the workers that keep running
+    if not redis_unavailable():
+        try:
+            await flush_hits()
+        except redis.RedisError:
+            redis_failed()
+
+
+async def get_cached_account(user_id: int) -> Optional[bytes]:
+    # Cache is optional, the account is loaded from the database when Redis is not available
+    if redis_unavailable():
+        return None
+    try:
+        return await get_async_redis().get(ACCOUNT_KEY.format(user_id=user_id))
+    except redis.RedisError:
+        redis_failed()
+        return None
+
 
-from app.config import REDIS_PASS
+async def cache_account(user_id: int, data: str, ttl: int):
+    if redis_unavailable():
+        return
+    try:
+        await get_async_redis().set(ACCOUNT_KEY.format(user_id=user_id), data, ex=ttl)
+    except redis.RedisError:
+        redis_failed()
 
 
-def invalidate_ideas():
-    r = redis.Redis(host='localhost', password=REDIS_PASS, port=6379, db=0)
-    r.flushall()
-    # r.delete("cc-cache:app.routers.ideas.get_ideas*")
-    r.close()
+async def invalidate_account(user_id: int):
+    if redis_unavailable():
+        return
+    try:
+        await get_async_redis().delete(ACCOUNT_KEY.format(user_id=user_id))
+    except redis.RedisError:
+        redis_failed()
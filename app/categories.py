@@ -0,0 +1,61 @@
+from typing import List, Optional
+
+from app.database import database, in_values
+from app.errors.ideas import CategoryInvalidError
+
+# Length of categories.name
+MAX_CATEGORY_LENGTH = 100
+
+# Ideas for sale in every category, counted from scratch. Used by the migration, the benchmark seed and to repair
+# counts that drifted, the application keeps them up to date with change_category_counts.
+RECOUNT_CATEGORIES_QUERY = "UPDATE categories SET ideas_count = (" \
+                           "SELECT COUNT(*) FROM ideas_categories JOIN ideas ON ideas.id = ideas_categories.idea_id " \
+                           "WHERE ideas_categories.category_id = categories.id AND ideas.buyer_id IS NULL " \
+                           "AND ideas.date_archived IS NULL)"
+
+
+def normalize_category(name: str) -> str:
+    return name.strip().lower()
+
+
+async def get_category_ids(names: List[str]) -> List[int]:
+    # Ids of the named categories, missing ones are created
+    category_ids = []
+    for name in dict.fromkeys(map(normalize_category, names)):
+        if name == "":
+            continue
+        if len(name) > MAX_CATEGORY_LENGTH:
+            raise CategoryInvalidError(MAX_CATEGORY_LENGTH)
+        # LAST_INSERT_ID(id) makes an existing category return its id as if it was inserted
+        category_ids.append(await database.execute(
+            query="INSERT INTO categories(name) VALUES(:name) ON DUPLICATE KEY UPDATE id=LAST_INSERT_ID(id)",
+            values={"name": name}
+        ))
+    return category_ids
+
+
+async def get_category(name: str) -> Optional[dict]:
+    return await database.fetch_one(
+        query="SELECT id, name, ideas_count FROM categories WHERE name=:name",
+        values={"name": normalize_category(name)}
+    )
+
+
+async def change_category_counts(idea_ids: List[str], delta: int):
+    # Called when ideas enter the listings (delta 1) or leave them (delta -1), for every category of the ideas.
+    # Expired ideas are counted until the worker archives them.
+    if len(idea_ids) == 0:
+        return
+    placeholders, values = in_values("idea_id", idea_ids)
+    await database.execute(
+        query="UPDATE categories JOIN ("
+              "SELECT category_id, COUNT(*) AS ideas FROM ideas_categories "
+              f"WHERE idea_id IN ({placeholders}) GROUP BY category_id"
+              ") AS changed ON categories.id = changed.category_id "
+              "SET categories.ideas_count = categories.ideas_count + :delta * changed.ideas",
+        values={"delta": delta, **values}
+    )
+
+
+async def recount_categories():
+    await database.execute(query=RECOUNT_CATEGORIES_QUERY)
@@ -0,0 +1,146 @@
+import zlib
+from typing import Optional, Dict, List
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+from app.config import COMPRESSION_MINIMUM_SIZE, COMPRESSION_LEVELS
+
+# Brotli and zstd are optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Order of preference when the client accepts several encodings with the same weight
+PREFERENCE = ["br", "zstd", "gzip"]
+ENCODINGS: List[str] = [
+    encoding for encoding, module in zip(PREFERENCE, [brotli, zstandard, zlib]) if module is not None
+]
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+class Compressor:
+    # Streaming compressor with the same two calls for every encoding
+    def __init__(self, encoding: str, level: int) -> None:
+        if encoding == "gzip":
+            # wbits of 31 writes the gzip header and trailer around the deflate stream
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self.compressor = brotli.Compressor(quality=level)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        self.encoding = encoding
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "zstd":
+        # One shot frames carry their size, which lets the client allocate the output at once
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def choose_encoding(accept_encoding: str, available: Optional[List[str]] = None) -> Optional[str]:
+    # Encoding with the highest weight in Accept-Encoding, None when the response should be sent as it is
+    available = ENCODINGS if available is None else available
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip()] = weight
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    # Compressor would hold back server-sent events until enough of them arrived
+    if content_type.startswith("text/event-stream"):
+        return False
+    return "content-encoding" not in headers and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    # Compresses JSON and text responses above COMPRESSION_MINIMUM_SIZE. Responses that already have a
+    # Content-Encoding, like the cached listings that are stored compressed, are sent as they are.
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = None
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body shows whether the response is compressed
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not is_compressible(headers) or (len(body) < self.minimum_size and not more_body):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # Strong ETags belong to the uncompressed bytes
+                etag = headers.get("etag")
+                if etag is not None and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if not more_body:
+                    body = compress(body, encoding, COMPRESSION_LEVELS[encoding])
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                # Streamed responses are sent in chunks, their length is not known
+                del headers["Content-Length"]
+                compressor = Compressor(encoding, COMPRESSION_LEVELS[encoding])
+                await send(start)
+            body = compressor.compress(body)
+            if not more_body:
+                body += compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
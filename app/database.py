@@ -1,7 +1,283 @@
+import asyncio
+import hashlib
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Tuple, Optional, List, Dict
 from databases import Database
+from databases.core import Transaction
+from asyncmy.pool import Pool
+from asyncmy.errors import OperationalError
+from starlette.datastructures import CommaSeparatedStrings, Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+import redis
 
-from app.config import DB_NAME, DB_PASS, DB_USER, DB_HOST
+from app.config import (
+    config, DB_NAME, DB_PASS, DB_USER, DB_HOST, DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL, READ_YOUR_WRITES_WINDOW
+)
+from app.metrics import observe_query, DB_POOL_CONNECTIONS, DB_READS, DB_REPLICA_LAG
 
-DB_URL = f'mysql+asyncmy://{DB_USER}:{DB_PASS}@{DB_HOST}:3306/{DB_NAME}'
+# DB_URL environment variable points the app to another database, e.g. the one seeded for benchmarks
+DB_URL = config("DB_URL", default=f'mysql+asyncmy://{DB_USER}:{DB_PASS}@{DB_HOST}:3306/{DB_NAME}')
+# Read-only copies of the database, none by default
+DB_REPLICA_URLS = config("DB_REPLICA_URLS", cast=CommaSeparatedStrings, default="")
 
-database = Database(DB_URL)
+# Clients that wrote something read from the primary until this key expires, in every worker
+PINNED_KEY = "cc-pinned:{client}"
+
+# Set by read_from_replica for the routes that only read
+_read_only: ContextVar[bool] = ContextVar("read_only", default=False)
+# Hash of the token of the request, see ReadYourWritesMiddleware
+_client: ContextVar[Optional[str]] = ContextVar("client", default=None)
+# Whether the client of the request is pinned to the primary, looked up once per request
+_pinned: ContextVar[Optional[bool]] = ContextVar("pinned", default=None)
+_wrote: ContextVar[bool] = ContextVar("wrote", default=False)
+# Set while a transaction is open, its reads have to see its own writes
+_in_transaction: ContextVar[bool] = ContextVar("in_transaction", default=False)
+# Pins made by this worker, they still apply while Redis is not available
+_local_pins: Dict[str, float] = {}
+_monitor: Optional[asyncio.Task] = None
+
+
+class Replica:
+    # Read-only copy of the database and its replication lag in seconds, None while it cannot be used
+    def __init__(self, url: str) -> None:
+        # Timed by the database that routes the reads to it
+        self.database = Database(url)
+        self.lag: Optional[float] = None
+
+    def is_usable(self) -> bool:
+        return self.lag is not None and self.lag <= DB_REPLICA_MAX_LAG
+
+
+class PrimaryTransaction:
+    # Transaction that keeps the reads made inside it on the primary, a replica does not see what it wrote
+    def __init__(self, transaction: Transaction) -> None:
+        self.transaction = transaction
+        self.token = None
+
+    async def __aenter__(self) -> Transaction:
+        self.token = _in_transaction.set(True)
+        try:
+            return await self.transaction.__aenter__()
+        except BaseException:
+            _in_transaction.reset(self.token)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            await self.transaction.__aexit__(*exc_info)
+        finally:
+            _in_transaction.reset(self.token)
+
+
+class TimedDatabase(Database):
+    # Every call is timed from asking the pool for a connection until the result is read, so a busy pool shows up too.
+    # Reads of read-only routes go to a replica that keeps up, writes and every other read go to the primary.
+    def __init__(self, url: str, replica_urls: List[str] = ()) -> None:
+        super().__init__(url)
+        self.replicas = [Replica(replica_url) for replica_url in replica_urls]
+        self.rotation = itertools.count()
+
+    async def execute(self, query, values: Optional[dict] = None):
+        with observe_query("execute"):
+            result = await super().execute(query=query, values=values)
+        await pin_client(self)
+        return result
+
+    async def execute_many(self, query, values: List[dict]):
+        with observe_query("execute_many"):
+            result = await super().execute_many(query=query, values=values)
+        await pin_client(self)
+        return result
+
+    async def fetch_all(self, query, values: Optional[dict] = None):
+        replica = await self.choose_replica()
+        if replica is not None:
+            try:
+                with observe_query("fetch_all", "replica"):
+                    return await replica.database.fetch_all(query=query, values=values)
+            except (OperationalError, OSError):
+                self.replica_failed(replica)
+        with observe_query("fetch_all"):
+            return await super().fetch_all(query=query, values=values)
+
+    async def fetch_one(self, query, values: Optional[dict] = None):
+        replica = await self.choose_replica()
+        if replica is not None:
+            try:
+                with observe_query("fetch_one", "replica"):
+                    return await replica.database.fetch_one(query=query, values=values)
+            except (OperationalError, OSError):
+                self.replica_failed(replica)
+        with observe_query("fetch_one"):
+            return await super().fetch_one(query=query, values=values)
+
+    async def fetch_val(self, query, values: Optional[dict] = None, column=0):
+        replica = await self.choose_replica()
+        if replica is not None:
+            try:
+                with observe_query("fetch_val", "replica"):
+                    return await replica.database.fetch_val(query=query, values=values, column=column)
+            except (OperationalError, OSError):
+                self.replica_failed(replica)
+        with observe_query("fetch_val"):
+            return await super().fetch_val(query=query, values=values, column=column)
+
+    def transaction(self, *, force_rollback: bool = False, **kwargs) -> PrimaryTransaction:
+        return PrimaryTransaction(super().transaction(force_rollback=force_rollback, **kwargs))
+
+    async def choose_replica(self) -> Optional[Replica]:
+        if not _read_only.get() or _in_transaction.get() or len(self.replicas) == 0:
+            return None
+        usable = [replica for replica in self.replicas if replica.is_usable()]
+        if len(usable) == 0:
+            DB_READS.labels("primary_lagging").inc()
+            return None
+        if await is_pinned():
+            DB_READS.labels("primary_pinned").inc()
+            return None
+        DB_READS.labels("replica").inc()
+        return usable[next(self.rotation) % len(usable)]
+
+    def replica_failed(self, replica: Replica):
+        # Read is repeated on the primary, the monitor takes the replica back once it answers again
+        replica.lag = None
+        DB_REPLICA_LAG.labels(str(self.replicas.index(replica))).set(-1)
+        DB_READS.labels("primary_failover").inc()
+
+
+database = TimedDatabase(DB_URL, DB_REPLICA_URLS)
+
+
+async def read_from_replica():
+    # Dependency of the routes that only read, their queries may be answered by a replica that is a bit behind
+    _read_only.set(True)
+
+
+def read_from_primary():
+    # Cached pages are served for hours, a page computed from a replica that is behind would keep an idea that was
+    # just sold or archived listed. Only affects the current task.
+    _read_only.set(False)
+
+
+class ReadYourWritesMiddleware:
+    # Remembers who sent the request, so a write can pin them to the primary. The token stands for the client, a hash
+    # of it is enough and cheaper than verifying it.
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            token = Headers(scope=scope).get("token")
+            if token:
+                _client.set(hashlib.blake2b(token.encode(), digest_size=16).hexdigest())
+        await self.app(scope, receive, send)
+
+
+async def pin_client(db: TimedDatabase):
+    # Client reads from the primary for READ_YOUR_WRITES_WINDOW seconds after its first write in a request
+    client = _client.get()
+    if len(db.replicas) == 0 or client is None or _wrote.get():
+        return
+    _wrote.set(True)
+    _pinned.set(True)
+    now = time.time()
+    _local_pins[client] = now + READ_YOUR_WRITES_WINDOW
+    if len(_local_pins) > 10000:
+        for key in [key for key, until in _local_pins.items() if until <= now]:
+            del _local_pins[key]
+    # Imported here, app.cache needs this module while it is imported
+    from app.cache import get_async_redis, redis_unavailable, redis_failed
+    if redis_unavailable():
+        return
+    try:
+        await get_async_redis().set(PINNED_KEY.format(client=client), 1, px=int(READ_YOUR_WRITES_WINDOW * 1000))
+    except redis.RedisError:
+        redis_failed()
+
+
+async def is_pinned() -> bool:
+    client = _client.get()
+    if client is None:
+        return False
+    pinned = _pinned.get()
+    if pinned is None:
+        from app.cache import get_async_redis, redis_unavailable, redis_failed
+        pinned = _local_pins.get(client, 0) > time.time()
+        if not pinned and not redis_unavailable():
+            try:
+                pinned = await get_async_redis().exists(PINNED_KEY.format(client=client)) == 1
+            except redis.RedisError:
+                redis_failed()
+        _pinned.set(pinned)
+    return pinned
+
+
+async def measure_lag(replica: Replica) -> Optional[float]:
+    if not replica.database.is_connected:
+        await replica.database.connect()
+    # SQLite copies used to try the routing do not replicate
+    if replica.database.url.dialect != "mysql":
+        return 0.0
+    status = await replica.database.fetch_one(query="SHOW SLAVE STATUS")
+    # Server that does not replicate, or replication that stopped, would serve data of unknown age
+    if status is None or status["Seconds_Behind_Master"] is None:
+        return None
+    return float(status["Seconds_Behind_Master"])
+
+
+async def monitor_replicas():
+    while True:
+        for index, replica in enumerate(database.replicas):
+            try:
+                replica.lag = await measure_lag(replica)
+            except (OperationalError, OSError):
+                replica.lag = None
+            DB_REPLICA_LAG.labels(str(index)).set(-1 if replica.lag is None else replica.lag)
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+
+def start_replica_monitor():
+    # Replicas are connected by the monitor, one that is down does not stop the app from starting
+    global _monitor
+    if len(database.replicas) > 0:
+        _monitor = asyncio.ensure_future(monitor_replicas())
+
+
+async def stop_replica_monitor():
+    if _monitor is not None:
+        _monitor.cancel()
+        try:
+            await _monitor
+        except asyncio.CancelledError:
+            pass
+    for replica in database.replicas:
+        if replica.database.is_connected:
+            await replica.database.disconnect()
+
+
+def record_pool_metrics():
+    # Only the MySQL pool can be inspected, the SQLite one used by the benchmarks is skipped
+    pool = getattr(database._backend, "_pool", None)
+    if not isinstance(pool, Pool):
+        return
+    DB_POOL_CONNECTIONS.labels("in_use").set(pool.size - pool.freesize)
+    DB_POOL_CONNECTIONS.labels("idle").set(pool.freesize)
+
+
+def in_values(name: str, values: list) -> Tuple[str, dict]:
+    # Raw queries cannot bind a list, so IN (...) gets one named parameter per value
+    params = {f"{name}{index}": value for index, value in enumerate(values)}
+    return ", ".join(f":{key}" for key in params), params
+
+
+def row_values(names: Tuple[str, ...], rows: List[tuple]) -> Tuple[str, dict]:
+    # Same for multi-row VALUES and (a, b) IN (...) lists, every row gets one parameter per column
+    params = {}
+    placeholders = []
+    for index, row in enumerate(rows):
+        keys = [f"{name}{index}" for name in names]
+        params.update(zip(keys, row))
+        placeholders.append("(" + ", ".join(f":{key}" for key in keys) + ")")
+    return ", ".join(placeholders), params
@@ -0,0 +1,11 @@
+from fastapi import HTTPException
+from starlette import status
+
+
+class TooManySubscribersError(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail={
+            "title": "Too many subscribers",
+            "msg": "Live updates are not available right now, try again later",
+            "errno": 801
+        }, headers={"Retry-After": "30"})
@@ -45,3 +45,21 @@ class IdeaLikeDenied(HTTPException):
             "msg": "This idea is no longer for sale, you cannot like it",
             "errno": 205
         })
+
+
+class TooManyIdeasError(HTTPException):
+    def __init__(self, limit: int) -> None:
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail={
+            "title": "Too Many Ideas",
+            "msg": f"At most {limit} ideas can be asked for at once",
+            "errno": 206
+        })
+
+
+class CategoryInvalidError(HTTPException):
+    def __init__(self, limit: int) -> None:
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail={
+            "title": "Category Invalid",
+            "msg": f"Category names can have at most {limit} characters",
+            "errno": 207
+        })
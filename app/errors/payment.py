@@ -45,3 +45,12 @@ class PaymentCannotBeCanceledError(HTTPException):
             "msg": "This payment is successful and cannot be canceled",
             "errno": 405
         })
+
+
+class IdeaExpiredError(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(status_code=status.HTTP_403_FORBIDDEN, detail={
+            "title": "Idea Expired",
+            "msg": "The idea is not for sale anymore",
+            "errno": 406
+        })
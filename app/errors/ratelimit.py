@@ -0,0 +1,11 @@
+from fastapi import HTTPException
+from starlette import status
+
+
+class RateLimitExceededError(HTTPException):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail={
+            "title": "Too Many Requests",
+            "msg": f"You have sent too many requests, try again in {retry_after} seconds",
+            "errno": 701
+        }, headers={"Retry-After": str(retry_after)})
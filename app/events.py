@@ -0,0 +1,154 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Optional, Set, Dict
+
+import orjson
+import redis
+
+from app.cache import get_async_redis, redis_unavailable, redis_failed, encode_default
+from app.config import EVENTS_QUEUE_SIZE, EVENTS_MAX_SUBSCRIBERS
+from app.metrics import EVENT_SUBSCRIBERS, EVENT_OVERFLOWS
+
+# Changes of the public listings are published here, every worker passes them on to its own clients
+EVENTS_CHANNEL = "cc-events"
+# Webhook publishes the new status of a payment intent here, requests waiting for it are answered at once
+PAYMENT_CHANNEL = "cc-payment:{payment_id}"
+
+IDEA_POSTED = "idea-posted"
+IDEA_LIKED = "idea-liked"
+# Payment was started, the idea is not for sale while it runs
+IDEA_RESERVED = "idea-reserved"
+# Payment was canceled, the idea is for sale again
+IDEA_RELEASED = "idea-released"
+IDEA_SOLD = "idea-sold"
+# Sent to clients that may have missed events, they load the listings again
+RESYNC = orjson.dumps({"type": "resync"})
+
+
+class Subscriber:
+    # Events waiting to be sent to one client. The queue is bounded, a client that does not keep up loses its backlog
+    # and gets a single resync, so it cannot hold more memory or slow down the others.
+    def __init__(self, size: int) -> None:
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def put(self, event: bytes):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            EVENT_OVERFLOWS.inc()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self) -> bytes:
+        return await self.queue.get()
+
+
+class EventBroker:
+    # Clients of this worker, every event read from Redis is put in each of their queues
+    def __init__(self, max_subscribers: int) -> None:
+        self.max_subscribers = max_subscribers
+        self.subscribers: Set[Subscriber] = set()
+
+    def is_full(self) -> bool:
+        return len(self.subscribers) >= self.max_subscribers
+
+    def subscribe(self, transport: str) -> Subscriber:
+        subscriber = Subscriber(EVENTS_QUEUE_SIZE)
+        self.subscribers.add(subscriber)
+        EVENT_SUBSCRIBERS.labels(transport).inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber, transport: str):
+        self.subscribers.discard(subscriber)
+        EVENT_SUBSCRIBERS.labels(transport).dec()
+
+    def dispatch(self, event: bytes):
+        for subscriber in self.subscribers:
+            subscriber.put(event)
+
+
+broker = EventBroker(EVENTS_MAX_SUBSCRIBERS)
+# Requests of this worker waiting for the status of a payment, by payment intent id
+_payment_waiters: Dict[str, Set[asyncio.Future]] = {}
+_listener: Optional[asyncio.Task] = None
+
+
+async def publish_event(event_type: str, idea_id: str, **data):
+    # Events are small deltas, clients apply them to the listings they show instead of loading them again
+    event = orjson.dumps({"type": event_type, "id": idea_id, **data}, default=encode_default)
+    if redis_unavailable():
+        # Clients of this worker still get the event
+        broker.dispatch(event)
+        return
+    try:
+        await get_async_redis().publish(EVENTS_CHANNEL, event)
+    except redis.RedisError:
+        redis_failed()
+        broker.dispatch(event)
+
+
+def notify_payment(payment_id: str, status: str):
+    for waiter in _payment_waiters.get(payment_id, ()):
+        if not waiter.done():
+            waiter.set_result(status)
+
+
+async def publish_payment_status(payment_id: str, status: str):
+    if redis_unavailable():
+        notify_payment(payment_id, status)
+        return
+    try:
+        await get_async_redis().publish(PAYMENT_CHANNEL.format(payment_id=payment_id), status)
+    except redis.RedisError:
+        redis_failed()
+        notify_payment(payment_id, status)
+
+
+@contextmanager
+def watch_payment(payment_id: str):
+    # Future gets the next status of the payment. It is registered before the payment is read from the database, so
+    # a status published in between is not missed.
+    waiter = asyncio.get_running_loop().create_future()
+    waiters = _payment_waiters.setdefault(payment_id, set())
+    waiters.add(waiter)
+    try:
+        yield waiter
+    finally:
+        waiters.discard(waiter)
+        if len(waiters) == 0:
+            _payment_waiters.pop(payment_id, None)
+
+
+async def listen_for_events():
+    while True:
+        # Waits for messages as long as it takes, no read timeout
+        pubsub = get_async_redis(timeout=None).pubsub()
+        try:
+            await pubsub.subscribe(EVENTS_CHANNEL)
+            await pubsub.psubscribe(PAYMENT_CHANNEL.format(payment_id="*"))
+            # Events published while the worker was not listening are lost
+            broker.dispatch(RESYNC)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    broker.dispatch(message["data"])
+                elif message["type"] == "pmessage":
+                    notify_payment(message["channel"].decode().split(":", 1)[1], message["data"].decode())
+        except (redis.RedisError, OSError):
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.reset()
+
+
+def start_event_listener():
+    global _listener
+    _listener = asyncio.ensure_future(listen_for_events())
+
+
+async def stop_event_listener():
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
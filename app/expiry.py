@@ -0,0 +1,48 @@
+from datetime import datetime
+from typing import Optional
+
+from app.config import IDEA_ARCHIVE_BATCH
+from app.database import database, in_values
+from app.cache import invalidate_listings_of, drop_idea_versions
+from app.categories import change_category_counts
+from app.prefetch import prefetch_categories
+
+# Ideas shown in the public listings. An expired idea leaves them at once, before the worker archives it.
+LISTED_IDEAS = "ideas.buyer_id IS NULL AND ideas.date_archived IS NULL AND ideas.date_expiry > :now"
+
+
+async def archive_expired_ideas(batch_size: int = IDEA_ARCHIVE_BATCH, now: Optional[datetime] = None) -> int:
+    # Expired ideas for sale are archived in batches, each batch leaves the category counts and refreshes only the
+    # cached listings that can show its ideas and the versions of its ideas
+    now = now or datetime.now()
+    archived = 0
+    while True:
+        rows = await database.fetch_all(
+            query="SELECT id FROM ideas "
+                  "WHERE buyer_id IS NULL AND date_archived IS NULL AND date_expiry <= :now "
+                  "ORDER BY date_expiry LIMIT :limit",
+            values={"now": now, "limit": batch_size}
+        )
+        if len(rows) == 0:
+            break
+        placeholders, values = in_values("idea_id", [row["id"] for row in rows])
+        async with database.transaction():
+            # Conditions are checked again, an idea reserved meanwhile already left the counts when it was reserved
+            await database.execute(
+                query=f"UPDATE ideas SET date_archived=:now WHERE id IN ({placeholders}) "
+                      "AND buyer_id IS NULL AND date_archived IS NULL",
+                values={"now": now, **values}
+            )
+            idea_ids = [row["id"] for row in await database.fetch_all(
+                query=f"SELECT id FROM ideas WHERE id IN ({placeholders}) AND date_archived=:now",
+                values={"now": now, **values}
+            )]
+            await change_category_counts(idea_ids, -1)
+        categories = await prefetch_categories(idea_ids)
+        await invalidate_listings_of(idea_ids, {name for names in categories.values() for name in names})
+        # Pages of the archived ideas change too, their ETags must not match anymore
+        await drop_idea_versions(idea_ids)
+        archived += len(idea_ids)
+        if len(rows) < batch_size:
+            break
+    return archived
@@ -1,13 +1,12 @@
-from fastapi import UploadFile
+from fastapi import UploadFile, BackgroundTasks
 from starlette import status
 from typing import Optional
-import aiofiles as aiofiles
 import hashlib
-import urllib
-import os
 
-from app.config import *
+from app.config import CDN_ALLOWED_CONTENT_TYPES, CDN_DOCS_TYPES, CDN_IMAGE_TYPES, CDN_MEDIA_TYPES
 from app.database import database
+from app.storage import acquire_blob, release_blob
+from app.images import create_image_derivatives
 from app.errors.ideas import IdeaIDInvalidError
 from app.errors.files import FiletypeNotAllowedError
 
@@ -32,9 +31,12 @@ def get_folder_for_file(filetype):
         raise FiletypeNotAllowedError
 
 
-async def save_file(file: UploadFile, kind: str, uid: Optional[str] = None):
+async def save_file(
+        file: UploadFile, kind: str, uid: Optional[str] = None, background_tasks: Optional[BackgroundTasks] = None
+):
     # Open file for reading
     temp = await file.read()
+    blob_hash = hashlib.sha256(temp).hexdigest()
 
     # There are three file types:
     #  - avatar -> uid is user id
@@ -45,48 +47,53 @@ async def save_file(file: UploadFile, kind: str, uid: Optional[str] = None):
         if file.content_type not in CDN_IMAGE_TYPES:
             raise FiletypeNotAllowedError
         file_id = hashlib.sha256(
-            str(hashlib.sha256(temp).hexdigest() + "#USER" + uid.__str__()).encode('utf-8')
+            str(blob_hash + "#USER" + uid.__str__()).encode('utf-8')
         ).hexdigest()
         idea_id = None
-        filepath = f'avatars/user{uid}-{file.filename}'.replace(' ', '')
     elif kind == 'idea-title':
         if file.content_type not in CDN_IMAGE_TYPES:
             raise FiletypeNotAllowedError
         file_id = uid
         idea_id = uid
-        filepath = f'ideas-titles/{uid}-{file.filename}'.replace(' ', '')
     elif kind == 'idea-file':
+        if file.content_type not in CDN_ALLOWED_CONTENT_TYPES:
+            raise FiletypeNotAllowedError
         file_id = hashlib.sha256(
-            str(hashlib.sha256(temp).hexdigest() + "#IDEA" + uid).encode('utf-8')
+            str(blob_hash + "#IDEA" + uid).encode('utf-8')
         ).hexdigest()
         idea_id = uid
-        filepath = f'ideas-files/{uid}/{get_folder_for_file(file.content_type)}/{file.filename}'.replace(' ', '')
     else:
         if file.content_type not in CDN_ALLOWED_CONTENT_TYPES:
             raise FiletypeNotAllowedError
-        file_id = hashlib.sha256(temp).hexdigest()
+        file_id = blob_hash
         idea_id = None
-        filepath = f'others/{uid}_{file.filename}'.replace(' ', '')
 
-    # Create needed dirs if they don't exist
-    os.makedirs(os.path.dirname(CDN_FILES_PATH + filepath), exist_ok=True)
+    async with database.transaction():
+        # The file row may already exist (e.g. title image uploaded again), then the old blob is released
+        previous_hash = await database.fetch_val(
+            query="SELECT blob_hash FROM files WHERE id=:id", values={"id": file_id}, column="blob_hash"
+        )
+        # Bytes are written only if no other file has the same contents
+        blob = await acquire_blob(blob_hash, temp, file.content_type, file.filename)
+        await release_blob(previous_hash)
 
-    async with aiofiles.open(CDN_FILES_PATH + filepath, "wb") as directory:
-        await directory.write(temp)
+        # Save info about file to database
+        await database.execute(
+            query="REPLACE INTO files(id, idea_id, blob_hash, name, size, absolute_path, public_path, content_type) "
+                  "VALUES(:id, :idea_id, :blob_hash, :name, :size, :absolute_path, :public_path, :content_type)",
+            values={
+                "id": file_id,
+                "idea_id": idea_id,
+                "blob_hash": blob_hash,
+                "name": file.filename,
+                "size": len(temp),
+                "absolute_path": blob["absolute_path"],
+                "public_path": blob["public_path"],
+                "content_type": file.content_type
+            }
+        )
 
-    # Save info about file to database
-    # TODO: if duplication error on id then file probably exists, contact security lol
-    await database.execute(
-        query="REPLACE INTO files(id, idea_id, name, size, absolute_path, public_path, content_type) "
-              "VALUES(:id, :idea_id, :name, :size, :absolute_path, :public_path, :content_type)",
-        values={
-            "id": file_id,
-            "idea_id": idea_id,
-            "name": file.filename,
-            "size": file.spool_max_size,
-            "absolute_path": CDN_FILES_PATH + filepath,
-            "public_path": CDN_URL + filepath,
-            "content_type": file.content_type
-        }
-    )
+    # Thumbnails and WebP variants are rendered after the response is sent
+    if kind in ('avatar', 'idea-title') and background_tasks is not None:
+        background_tasks.add_task(create_image_derivatives, blob_hash, file.content_type)
     return file_id
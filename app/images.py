@@ -0,0 +1,88 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict
+
+from PIL import Image, ImageOps
+
+from app.config import CDN_FILES_PATH, CDN_URL, CDN_IMAGE_DERIVATIVES, CDN_WEBP_QUALITY, IMAGE_WORKERS
+from app.cache import invalidate_ideas
+from app.database import database
+from app.storage import get_derivative_paths
+
+# Vector images are served as they are, only raster images get smaller variants
+RASTER_IMAGE_TYPES = [
+    "image/jpeg",
+    "image/png"
+]
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned processes do not inherit the event loop and the database connections of the worker
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def render_derivatives(absolute_path: str) -> Dict[str, str]:
+    # Runs in the process pool, so it only works with paths and returns paths
+    rendered = {}
+    with Image.open(absolute_path) as original:
+        # Respect the orientation set by cameras, otherwise thumbnails can end up rotated
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+        for (name, size), derivative_path in zip(CDN_IMAGE_DERIVATIVES.items(), get_derivative_paths(absolute_path)):
+            image = original.copy()
+            image.thumbnail(size, Image.LANCZOS)
+            temp_path = f'{derivative_path}.{os.getpid()}.tmp'
+            image.save(temp_path, format="WEBP", quality=CDN_WEBP_QUALITY, method=6)
+            os.replace(temp_path, derivative_path)
+            rendered[name] = derivative_path
+    return rendered
+
+
+async def create_image_derivatives(blob_hash: str, content_type: str):
+    if content_type not in RASTER_IMAGE_TYPES:
+        return
+    blob = await database.fetch_one(
+        query="SELECT absolute_path, thumbnail_url FROM blobs WHERE hash=:hash",
+        values={"hash": blob_hash}
+    )
+    # Same image was uploaded before, its derivatives are already there
+    if blob is None or blob["thumbnail_url"] is not None:
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        rendered = await loop.run_in_executor(get_pool(), render_derivatives, blob["absolute_path"])
+    except (OSError, Image.DecompressionBombError) as ex:
+        print(f"Image derivatives for blob {blob_hash} failed: {ex}")
+        return
+
+    await database.execute(
+        query="UPDATE blobs SET thumbnail_url=:thumbnail_url, webp_url=:webp_url WHERE hash=:hash",
+        values={
+            "thumbnail_url": CDN_URL + rendered["thumbnail"][len(CDN_FILES_PATH):],
+            "webp_url": CDN_URL + rendered["webp"][len(CDN_FILES_PATH):],
+            "hash": blob_hash
+        }
+    )
+    # Listings cached while the image was rendered were stored without its variants
+    idea_ids = [row["idea_id"] for row in await database.fetch_all(
+        query="SELECT DISTINCT idea_id FROM files WHERE blob_hash=:hash AND idea_id IS NOT NULL",
+        values={"hash": blob_hash}
+    )]
+    if len(idea_ids) > 0:
+        await invalidate_ideas(*idea_ids)
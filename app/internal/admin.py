@@ -8,7 +8,7 @@ from app.authentication import verify_access_token
 from app.models.token import AccessToken
 from app.errors.auth import TokenInvalidError, TokenNullError, AccessTokenExpiredError
 
-from app.internal.routers import ideas, users, payouts
+from app.internal.routers import ideas, users, payouts, profiles
 
 
 router = APIRouter(
@@ -21,6 +21,7 @@ router = APIRouter(
 router.include_router(ideas.router)
 router.include_router(users.router)
 router.include_router(payouts.router)
+router.include_router(profiles.router)
 
 
 # TODO: add authentication and maybe query for customizing the refresh period :)
@@ -0,0 +1,58 @@
+import os
+from typing import List
+
+from app.database import database, in_values
+from app.cache import invalidate_ideas
+from app.categories import change_category_counts
+from app.storage import release_idea_blobs, collect_unreferenced_blobs
+
+# Tables with rows that belong to an idea, they are deleted before the idea itself
+IDEA_CHILD_TABLES = [
+    "ideas_categories",
+    "ideas_likes",
+    "payments",
+    "payouts"
+]
+
+
+async def delete_ideas(idea_ids: List[str]) -> int:
+    idea_ids = list(set(idea_ids))
+    if len(idea_ids) == 0:
+        return 0
+    placeholders, values = in_values("idea_id", idea_ids)
+
+    # Everything is deleted in one transaction, so no request sees a half deleted idea
+    async with database.transaction():
+        files = await database.fetch_all(
+            query=f"SELECT blob_hash, absolute_path FROM files WHERE idea_id IN ({placeholders})",
+            values=values
+        )
+        # Ideas for sale leave the counts of their categories, while their categories are still there
+        listed = await database.fetch_all(
+            query=f"SELECT id FROM ideas WHERE id IN ({placeholders}) AND buyer_id IS NULL AND date_archived IS NULL",
+            values=values
+        )
+        await change_category_counts([idea["id"] for idea in listed], -1)
+        for table in IDEA_CHILD_TABLES:
+            await database.execute(query=f"DELETE FROM {table} WHERE idea_id IN ({placeholders})", values=values)
+        await release_idea_blobs(idea_ids)
+        await database.execute(query=f"DELETE FROM files WHERE idea_id IN ({placeholders})", values=values)
+        deleted = await database.fetch_val(
+            query=f"SELECT COUNT(*) AS count FROM ideas WHERE id IN ({placeholders})", values=values, column="count"
+        )
+        await database.execute(query=f"DELETE FROM ideas WHERE id IN ({placeholders})", values=values)
+
+    # Bytes are removed only after commit, a rolled back delete keeps its files
+    blob_hashes = list(set(file["blob_hash"] for file in files if file["blob_hash"] is not None))
+    await collect_unreferenced_blobs(limit=len(blob_hashes), hashes=blob_hashes)
+    # Files saved before the blob store was introduced are not shared, so they can go right away
+    for file in files:
+        if file["blob_hash"] is None:
+            try:
+                os.remove(file["absolute_path"])
+            except FileNotFoundError:
+                pass
+
+    # Cache is cleared after commit, so a concurrent request cannot cache the ideas again before they are gone
+    await invalidate_ideas(*idea_ids)
+    return deleted
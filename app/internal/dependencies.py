@@ -1,9 +1,10 @@
 from fastapi import Header
+import hmac
 
-from app.config import SUPER_USERS
+from app.config import SUPER_USERS, METRICS_TOKEN
 from app.models.token import AccessToken
 from app.dependencies import get_token_data
-from app.internal.errors.admin import UserNotAdminError
+from app.internal.errors.admin import UserNotAdminError, MetricsAccessDeniedError
 
 
 def verify_admin_user(token: str = Header(None, convert_underscores=False)) -> AccessToken:
@@ -11,3 +12,9 @@ def verify_admin_user(token: str = Header(None, convert_underscores=False)) -> A
     if token_data.user not in SUPER_USERS:
         raise UserNotAdminError
     return token_data
+
+
+def verify_metrics_token(authorization: str = Header(None)):
+    token = str(METRICS_TOKEN)
+    if token == "" or authorization is None or not hmac.compare_digest(authorization, f"Bearer {token}"):
+        raise MetricsAccessDeniedError
@@ -9,3 +9,21 @@ class UserNotAdminError(HTTPException):
             "msg": "You cannot access this resource",
             "errno": 601
         })
+
+
+class MetricsAccessDeniedError(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(status_code=status.HTTP_403_FORBIDDEN, detail={
+            "title": "Metrics are not available",
+            "msg": "The metrics token is missing or invalid",
+            "errno": 602
+        })
+
+
+class ProfileNotFoundError(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail={
+            "title": "Profile not found",
+            "msg": "There is no saved profile with this id",
+            "errno": 603
+        })
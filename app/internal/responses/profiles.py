@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import List
+from datetime import datetime
+
+
+class Profile(BaseModel):
+    id: str
+    size: int
+    date: datetime
+
+
+class ProfilesList(BaseModel):
+    profiles: List[Profile]
@@ -1,17 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 import redis
 
-from app.database import database
+from app.database import database, read_from_replica
 from app.config import REDIS_PASS
 from app.internal.responses.ideas import Idea, Category, IdeasList
-from app.cache import invalidate_ideas
+from app.internal.models.ideas import IdeasDelete
+from app.internal.cascade import delete_ideas
 
 router = APIRouter(
     prefix="/ideas",
 )
 
 
-@router.get("", response_model=IdeasList)
+@router.get("", response_model=IdeasList, dependencies=[Depends(read_from_replica)])
 async def get_ideas():
     ideas = await database.fetch_all(
         query="SELECT ideas.id, seller_id, buyer_id, title, short_desc, date_publish, date_expiry, date_bought, price, "
@@ -24,7 +25,9 @@ async def get_ideas():
 
     for idea in ideas:
         idea["categories"] = await database.fetch_all(
-            query="SELECT category FROM ideas_categories WHERE idea_id = :idea_id",
+            query="SELECT categories.name AS category FROM ideas_categories "
+                  "JOIN categories ON categories.id = ideas_categories.category_id "
+                  "WHERE ideas_categories.idea_id = :idea_id",
             values={"idea_id": idea["id"]}
         )
 
@@ -50,32 +53,11 @@ async def get_ideas():
 
 @router.delete("/{idea_id}")
 async def delete_idea(idea_id: str):
-    # Delete cache when deleting an idea
-    invalidate_ideas()
-
-    # Delete all idea entries
-    await database.execute(
-        query="DELETE FROM ideas WHERE id = :idea_id",
-        values={"idea_id": idea_id}
-    )
-    await database.execute(
-        query="DELETE FROM ideas_categories WHERE idea_id = :idea_id",
-        values={"idea_id": idea_id}
-    )
-    await database.execute(
-        query="DELETE FROM ideas_likes WHERE idea_id = :idea_id",
-        values={"idea_id": idea_id}
-    )
-    await database.execute(
-        query="DELETE FROM payments WHERE idea_id = :idea_id",
-        values={"idea_id": idea_id}
-    )
-    await database.execute(
-        query="DELETE FROM payouts WHERE idea_id = :idea_id",
-        values={"idea_id": idea_id}
-    )
-    await database.execute(
-        query="DELETE FROM files WHERE idea_id = :idea_id",
-        values={"idea_id": idea_id}
-    )
+    await delete_ideas([idea_id])
     return {"status": "success"}
+
+
+@router.post("/delete")
+async def delete_many_ideas(ideas: IdeasDelete):
+    deleted = await delete_ideas(ideas.ids)
+    return {"status": "success", "deleted": deleted}
@@ -1,9 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
 from io import StringIO
 import csv
 
-from app.database import database
+from app.database import database, read_from_replica
 from app.internal.responses.payouts import Payout, PayoutsList
 
 router = APIRouter(
@@ -11,7 +11,7 @@ router = APIRouter(
 )
 
 
-@router.get("", response_model=PayoutsList)
+@router.get("", response_model=PayoutsList, dependencies=[Depends(read_from_replica)])
 async def get_payouts():
     payouts = await database.fetch_all(
         query="SELECT payouts.*, users.first_name, users.last_name, users.iban, payments.amount "
@@ -59,7 +59,7 @@ async def complete_payout(idea_id: str):
 
 
 # Route to export payouts to csv file
-@router.get("/export", dependencies=None)
+@router.get("/export", dependencies=[Depends(read_from_replica)])
 async def export_payouts():
     payouts = await database.fetch_all(
         query="SELECT payouts.*, users.first_name, users.last_name, users.iban, payments.amount "
@@ -0,0 +1,38 @@
+from fastapi import APIRouter
+from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from datetime import datetime
+import os
+
+from app.profiling import list_profiles, get_profile_path, is_profile_id, PROFILE_SUFFIX
+from app.internal.errors.admin import ProfileNotFoundError
+from app.internal.responses.profiles import Profile, ProfilesList
+
+router = APIRouter(
+    prefix="/profiles",
+)
+
+
+@router.get("", response_model=ProfilesList)
+async def get_profiles():
+    profiles = await run_in_threadpool(list_profiles)
+
+    return ProfilesList(
+        profiles=list(map(lambda profile: Profile(
+            id=profile["id"],
+            size=profile["size"],
+            date=datetime.fromtimestamp(profile["date"])
+        ), profiles))
+    )
+
+
+# Profiles are in the speedscope format, they can be opened as a flame graph on https://www.speedscope.app
+@router.get("/{profile_id}")
+async def download_profile(profile_id: str):
+    if not is_profile_id(profile_id) or not os.path.isfile(get_profile_path(profile_id)):
+        raise ProfileNotFoundError
+    return FileResponse(
+        path=get_profile_path(profile_id),
+        media_type="application/json",
+        filename=profile_id + PROFILE_SUFFIX
+    )
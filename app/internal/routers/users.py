@@ -1,16 +1,14 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
 
 from io import StringIO
 import csv
-import json
-import requests
-from datetime import datetime
 
-from app.config import MAILGUN_API_KEY
-from app.database import database
+from app.database import database, read_from_replica
+from app.mail import send_mail
 from app import authentication as auth
 from app.internal.models.users import PasswordUpdate
+from app.storage import delete_file
 from app.internal.responses.users import User, UsersList
 
 router = APIRouter(
@@ -18,7 +16,7 @@ router = APIRouter(
 )
 
 
-@router.get("", response_model=UsersList)
+@router.get("", response_model=UsersList, dependencies=[Depends(read_from_replica)])
 async def get_users():
     users = await database.fetch_all(
         query="SELECT users.id, verified, first_name, last_name, email, username, iban, date_register, date_login, "
@@ -46,27 +44,20 @@ async def get_users():
 @router.delete("/{user_id}")
 async def delete_user(user_id: int):
     user = await database.fetch_one(
-        query="SELECT email, first_name FROM users WHERE id=:user_id",
+        query="SELECT email, first_name, avatar_id FROM users WHERE id=:user_id",
         values={"user_id": user_id},
     )
-    requests.post(
-        "https://api.eu.mailgun.net/v3/app.creativitycrop.tech/messages",
-        auth=("api", str(MAILGUN_API_KEY)),
-        data={
-            "from": "Friendly Bot from CreativityCrop <no-reply@app.creativitycrop.tech>",
-            "to": user["email"],
-            "subject": "CreativityCrop - Account Deleted",
-            "template": "delete-user",
-            'h:X-Mailgun-Variables': json.dumps({
-                "user_name": user["first_name"],
-                "current_year": datetime.now().year
-            })
-        }
+    send_mail(
+        to=user["email"],
+        subject="CreativityCrop - Account Deleted",
+        template="delete-user",
+        variables={"user_name": user["first_name"]}
     )
     await database.execute(
         query="DELETE FROM users WHERE id=:user_id",
         values={"user_id": user_id}
     )
+    await delete_file(user["avatar_id"])
 
 
 # Route to update user password
@@ -103,7 +94,7 @@ async def deactivate_user(user_id: int):
 
 
 # Route to export users to csv file
-@router.get("/export", dependencies=None)
+@router.get("/export", dependencies=[Depends(read_from_replica)])
 async def export_users():
     users = await database.fetch_all(
         query="SELECT users.id, verified, first_name, last_name, email, username, iban, date_register, date_login, "
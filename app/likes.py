@@ -0,0 +1,358 @@
+import asyncio
+import secrets
+from typing import List, Optional, Tuple, Dict, Set
+
+import redis
+
+from app.cache import get_async_redis, redis_unavailable, redis_failed, invalidate_ideas, RELEASE_LOCK_SCRIPT
+from app.config import LIKES_WRITE_BEHIND, LIKES_FLUSH_INTERVAL, LIKES_FLUSH_BATCH
+from app.database import database, in_values, row_values
+
+# Ideas a user liked, for showing the like state of a whole page with one set lookup
+LIKED_KEY = "cc-liked:{user_id}"
+# Seconds a loaded set is kept after it was last loaded
+LIKED_TTL = 24 * 3600
+
+# Users who like an idea and their number, the state likes are toggled against while they are written behind
+LIKERS_KEY = "cc-likers:{idea_id}"
+LIKE_COUNT_KEY = "cc-like-count:{idea_id}"
+# Seconds the likes of an idea stay in Redis after it was last liked
+LIKERS_TTL = 24 * 3600
+# Changes not written to the database yet, "idea_id:user_id" -> 1 for a like and 0 for a removed one. Toggles of the
+# same like before a flush leave only the last state.
+PENDING_LIKES_KEY = "cc-likes-pending"
+# Changes being written, a batch left here by a worker that stopped while writing it is written again
+FLUSHING_LIKES_KEY = "cc-likes-flushing"
+FLUSH_LOCK_KEY = "cc-lock:likes-flush"
+# Seconds one worker may take to write a batch, before another one writes it again
+FLUSH_LOCK_TIMEOUT = 30
+
+# Set is only changed when it is loaded, a partial set would make missing likes look like unliked ideas
+UPDATE_LIKED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call(ARGV[1], KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Toggles the like of a user, keeps the count, the pending change and the user's liked set in step.
+# KEYS: likers, count, pending, liked. ARGV: user id, idea id, ttl.
+# Returns nil when the likes of the idea are not loaded, otherwise the new state and count.
+TOGGLE_LIKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+local liked = 1
+local count
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    liked = 0
+    redis.call('SREM', KEYS[1], ARGV[1])
+    count = redis.call('DECR', KEYS[2])
+else
+    redis.call('SADD', KEYS[1], ARGV[1])
+    count = redis.call('INCR', KEYS[2])
+end
+redis.call('HSET', KEYS[3], ARGV[2] .. ':' .. ARGV[1], liked)
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    redis.call(liked == 1 and 'SADD' or 'SREM', KEYS[4], ARGV[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return {liked, count}
+"""
+
+# Loads the likes of an idea read from the database, unless another request loaded them first. Changes not written
+# yet are applied again here, as in LOAD_LIKED_SCRIPT.
+# KEYS: likers, count, flushing, pending. ARGV: ttl, idea id, user ids.
+LOAD_LIKERS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    local likers = {}
+    for index = 3, #ARGV do
+        likers[ARGV[index]] = true
+    end
+    for index = 3, 4 do
+        local cursor = '0'
+        repeat
+            local result = redis.call('HSCAN', KEYS[index], cursor, 'MATCH', ARGV[2] .. ':*', 'COUNT', 1000)
+            cursor = result[1]
+            for field = 1, #result[2], 2 do
+                likers[string.match(result[2][field], ':(.*)$')] = result[2][field + 1] == '1'
+            end
+        until tonumber(cursor) == 0
+    end
+    redis.call('SADD', KEYS[1], '')
+    for user_id, state in pairs(likers) do
+        if state then
+            redis.call('SADD', KEYS[1], user_id)
+        end
+    end
+    redis.call('SET', KEYS[2], redis.call('SCARD', KEYS[1]) - 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 0
+"""
+
+# Loads the liked set of a user, unless another request loaded it first. Changes not written yet are applied again
+# here, a like toggled while the database was read is skipped by TOGGLE_LIKE_SCRIPT but is in the pending hash.
+# Every loaded set has the member '', so the set of a user without likes is told apart from one that is not loaded.
+# KEYS: liked, flushing, pending. ARGV: ttl, user id, liked idea ids.
+LOAD_LIKED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local liked = {}
+for index = 3, #ARGV do
+    liked[ARGV[index]] = true
+end
+for index = 2, 3 do
+    local cursor = '0'
+    repeat
+        local result = redis.call('HSCAN', KEYS[index], cursor, 'MATCH', '*:' .. ARGV[2], 'COUNT', 1000)
+        cursor = result[1]
+        for field = 1, #result[2], 2 do
+            liked[string.match(result[2][field], '^(.*):')] = result[2][field + 1] == '1'
+        end
+    until tonumber(cursor) == 0
+end
+redis.call('SADD', KEYS[1], '')
+for idea_id, state in pairs(liked) do
+    if state then
+        redis.call('SADD', KEYS[1], idea_id)
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+_flusher: Optional[asyncio.Task] = None
+# Likes this worker wrote to the database while it could not reach Redis, as (idea id, user id)
+_written_directly: Set[Tuple[str, int]] = set()
+
+
+async def record_like(user_id: int, idea_id: str, is_liked: bool):
+    if redis_unavailable():
+        return
+    try:
+        await get_async_redis().eval(
+            UPDATE_LIKED_SCRIPT, 1, LIKED_KEY.format(user_id=user_id), "SADD" if is_liked else "SREM", idea_id
+        )
+    except redis.RedisError:
+        redis_failed()
+
+
+async def load_liked(user_id: int, idea_ids: List[str]) -> List[str]:
+    # Database fallback, only for the asked ideas
+    placeholders, values = in_values("idea_id", idea_ids)
+    rows = await database.fetch_all(
+        query=f"SELECT idea_id FROM ideas_likes WHERE user_id=:user_id AND idea_id IN ({placeholders})",
+        values={"user_id": user_id, **values}
+    )
+    liked = {row["idea_id"] for row in rows}
+    return [idea_id for idea_id in idea_ids if idea_id in liked]
+
+
+async def read_liked(key: str, idea_ids: List[str]) -> Optional[List[str]]:
+    # None when the set of the user is not loaded
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.smismember(key, idea_ids)
+    loaded, members = await pipe.execute()
+    if not loaded:
+        return None
+    return [idea_id for idea_id, member in zip(idea_ids, members) if member]
+
+
+async def read_changes(match: str, part: int) -> Dict[str, bool]:
+    # Changes not written yet with fields matching e.g. "*:<user id>", by the given part of their fields
+    changes = {}
+    for changes_key in (FLUSHING_LIKES_KEY, PENDING_LIKES_KEY):
+        async for field, state in get_async_redis().hscan_iter(changes_key, match=match):
+            changes[field.decode().split(":")[part]] = state == b"1"
+    return changes
+
+
+def apply_changes(loaded: Set[str], changes: Dict[str, bool]) -> Set[str]:
+    loaded.update(key for key, state in changes.items() if state)
+    loaded.difference_update(key for key, state in changes.items() if not state)
+    return loaded
+
+
+async def get_liked(user_id: int, idea_ids: List[str]) -> List[str]:
+    # Ideas of the list the user liked, in the same order
+    if len(idea_ids) == 0:
+        return []
+    if redis_unavailable():
+        return await load_liked(user_id, idea_ids)
+    key = LIKED_KEY.format(user_id=user_id)
+    r = get_async_redis()
+    try:
+        result = await read_liked(key, idea_ids)
+        if result is not None:
+            return result
+    except redis.RedisError:
+        redis_failed()
+        return await load_liked(user_id, idea_ids)
+
+    # First page the user looks at loads all their likes, the following ones are answered by Redis. Likes that are
+    # not written yet are read first, a batch written in the meantime is then in the database. The script reads them
+    # once more, for likes toggled while the database was read.
+    try:
+        changes = await read_changes(f"*:{user_id}", 0)
+    except redis.RedisError:
+        redis_failed()
+        return await load_liked(user_id, idea_ids)
+    rows = await database.fetch_all(
+        query="SELECT idea_id FROM ideas_likes WHERE user_id=:user_id", values={"user_id": user_id}
+    )
+    liked = apply_changes({row["idea_id"] for row in rows}, changes)
+    try:
+        await r.eval(
+            LOAD_LIKED_SCRIPT, 3, key, FLUSHING_LIKES_KEY, PENDING_LIKES_KEY, LIKED_TTL, user_id, *liked
+        )
+        # Set as loaded, by this request or one that was faster
+        result = await read_liked(key, idea_ids)
+        if result is not None:
+            return result
+    except redis.RedisError:
+        redis_failed()
+    return [idea_id for idea_id in idea_ids if idea_id in liked]
+
+
+async def toggle_like(idea_id: str, user_id: int) -> Optional[Tuple[bool, int]]:
+    # Like is answered from Redis and written to the database by the flusher. None when Redis is not available, the
+    # like is then written directly.
+    if redis_unavailable():
+        return None
+    await drop_likes_written_directly()
+    r = get_async_redis()
+    keys = [
+        LIKERS_KEY.format(idea_id=idea_id),
+        LIKE_COUNT_KEY.format(idea_id=idea_id),
+        PENDING_LIKES_KEY,
+        LIKED_KEY.format(user_id=user_id)
+    ]
+    try:
+        result = await r.eval(TOGGLE_LIKE_SCRIPT, len(keys), *keys, user_id, idea_id, LIKERS_TTL)
+        if result is None:
+            # Changes not written yet are read before the database, like in get_liked
+            changes = await read_changes(f"{idea_id}:*", 1)
+            rows = await database.fetch_all(
+                query="SELECT user_id FROM ideas_likes WHERE idea_id=:idea_id", values={"idea_id": idea_id}
+            )
+            likers = apply_changes({str(row["user_id"]) for row in rows}, changes)
+            await r.eval(
+                LOAD_LIKERS_SCRIPT, 4, *keys[:2], FLUSHING_LIKES_KEY, PENDING_LIKES_KEY, LIKERS_TTL, idea_id, *likers
+            )
+            result = await r.eval(TOGGLE_LIKE_SCRIPT, len(keys), *keys, user_id, idea_id, LIKERS_TTL)
+    except redis.RedisError:
+        redis_failed()
+        return None
+    return result[0] == 1, result[1]
+
+
+async def like_written_directly(idea_id: str, user_id: int):
+    # Other workers still toggle likes of the idea against Redis, and a pending change of the same like would undo
+    # this one when it is written. Once Redis is back, the change is dropped and the likes are loaded again.
+    _written_directly.add((idea_id, user_id))
+    await drop_likes_written_directly()
+
+
+async def drop_likes_written_directly():
+    if len(_written_directly) == 0 or redis_unavailable():
+        return
+    written = list(_written_directly)
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for idea_id, user_id in written:
+            pipe.hdel(PENDING_LIKES_KEY, f"{idea_id}:{user_id}")
+            pipe.hdel(FLUSHING_LIKES_KEY, f"{idea_id}:{user_id}")
+            pipe.delete(
+                LIKERS_KEY.format(idea_id=idea_id), LIKE_COUNT_KEY.format(idea_id=idea_id),
+                LIKED_KEY.format(user_id=user_id)
+            )
+        await pipe.execute()
+    except redis.RedisError:
+        redis_failed()
+        return
+    _written_directly.difference_update(written)
+
+
+async def write_likes(changes: Dict[bytes, bytes]) -> List[str]:
+    liked, unliked = [], []
+    for field, state in changes.items():
+        idea_id, user_id = field.decode().split(":")
+        (liked if state == b"1" else unliked).append((idea_id, int(user_id)))
+
+    # Rows are written in their final state, so writing a batch twice changes nothing. IGNORE skips likes that are
+    # in the table already and likes of ideas deleted in the meantime.
+    async with database.transaction():
+        for start in range(0, len(liked), LIKES_FLUSH_BATCH):
+            rows, values = row_values(("idea_id", "user_id"), liked[start:start + LIKES_FLUSH_BATCH])
+            await database.execute(
+                query=f"INSERT IGNORE INTO ideas_likes(idea_id, user_id) VALUES {rows}", values=values
+            )
+        for start in range(0, len(unliked), LIKES_FLUSH_BATCH):
+            rows, values = row_values(("idea_id", "user_id"), unliked[start:start + LIKES_FLUSH_BATCH])
+            await database.execute(
+                query=f"DELETE FROM ideas_likes WHERE (idea_id, user_id) IN ({rows})", values=values
+            )
+    return list({idea_id for idea_id, _ in liked + unliked})
+
+
+async def flush_likes() -> int:
+    # One worker at a time writes the pending likes, it returns how many it wrote
+    r = get_async_redis()
+    token = secrets.token_hex(8)
+    if not await r.set(FLUSH_LOCK_KEY, token, nx=True, px=FLUSH_LOCK_TIMEOUT * 1000):
+        return 0
+    try:
+        if not await r.exists(FLUSHING_LIKES_KEY):
+            if not await r.exists(PENDING_LIKES_KEY):
+                return 0
+            # Likes toggled from now on go to a new pending hash
+            await r.rename(PENDING_LIKES_KEY, FLUSHING_LIKES_KEY)
+        changes = await r.hgetall(FLUSHING_LIKES_KEY)
+        idea_ids = await write_likes(changes)
+        await r.delete(FLUSHING_LIKES_KEY)
+    finally:
+        await r.eval(RELEASE_LOCK_SCRIPT, 1, FLUSH_LOCK_KEY, token)
+    # Listings show the counts of the database, they are refreshed once per batch instead of once per like
+    await invalidate_ideas(*idea_ids)
+    return len(changes)
+
+
+async def run_like_flusher():
+    while True:
+        await asyncio.sleep(LIKES_FLUSH_INTERVAL)
+        if redis_unavailable():
+            continue
+        try:
+            await drop_likes_written_directly()
+            await flush_likes()
+        except redis.RedisError:
+            redis_failed()
+        except Exception as error:
+            # Batch stays in Redis and is written on the next run
+            print(f"Writing likes failed: {error!r}")
+
+
+def start_like_flusher():
+    global _flusher
+    if LIKES_WRITE_BEHIND:
+        _flusher = asyncio.ensure_future(run_like_flusher())
+
+
+async def stop_like_flusher():
+    if _flusher is None:
+        return
+    _flusher.cancel()
+    try:
+        await _flusher
+    except asyncio.CancelledError:
+        pass
+    # Likes of the last interval are written before the worker exits, whatever is left is written by another worker
+    try:
+        await flush_likes()
+    except Exception as error:
+        print(f"Writing likes failed: {error!r}")
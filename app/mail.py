@@ -0,0 +1,29 @@
+import json
+from datetime import datetime
+
+from app.config import MAILGUN_API_KEY
+from app.metrics import observe_external, EXTERNAL_CALL_ERRORS
+
+MAILGUN_URL = "https://api.eu.mailgun.net/v3/app.creativitycrop.tech/messages"
+MAIL_FROM = "Friendly Bot from CreativityCrop <no-reply@app.creativitycrop.tech>"
+
+
+def send_mail(to: str, subject: str, template: str, variables: dict):
+    # All emails use a Mailgun template, current year is needed by the footer of every one of them. Requests is loaded
+    # by the first email, most requests send none.
+    import requests
+    with observe_external("mailgun"):
+        response = requests.post(
+            MAILGUN_URL,
+            auth=("api", str(MAILGUN_API_KEY)),
+            data={
+                "from": MAIL_FROM,
+                "to": to,
+                "subject": subject,
+                "template": template,
+                'h:X-Mailgun-Variables': json.dumps({**variables, "current_year": datetime.now().year})
+            }
+        )
+    if response.status_code >= 500:
+        EXTERNAL_CALL_ERRORS.labels("mailgun").inc()
+    return response
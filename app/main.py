@@ -1,13 +1,22 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import RedirectResponse
-from fastapi_redis_cache import FastApiRedisCache, cache
+from starlette.responses import RedirectResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST
 
-from app.routers import auth, account, ideas, files, payment
+from app.routers import auth, account, ideas, files, payment, events
 from app.internal import admin
-from app.database import database
-from app.config import REDIS_URL
-from app.models.token import AccessToken
+from app.internal.dependencies import verify_metrics_token
+from app.database import (
+    database, record_pool_metrics, ReadYourWritesMiddleware, start_replica_monitor, stop_replica_monitor
+)
+from app.cache import start_cache_listener, stop_cache_listener, start_cache_warmer, stop_cache_warmer
+from app.events import start_event_listener, stop_event_listener
+from app.likes import start_like_flusher, stop_like_flusher
+from app.images import shutdown_pool
+from app.metrics import MetricsMiddleware, render_metrics, shutdown_metrics
+from app.profiling import ProfilingMiddleware
+from app.compression import CompressionMiddleware
+from app.config import PROFILING, COMPRESSION_ENABLED
 
 app = FastAPI(
     title="CreativityCrop API",
@@ -32,6 +41,7 @@ app.include_router(account.router)
 app.include_router(ideas.router)
 app.include_router(files.router)
 app.include_router(payment.router)
+app.include_router(events.router)
 app.include_router(admin.router)
 
 # Origins for CORS
@@ -49,26 +59,48 @@ app.add_middleware(
     allow_headers=["*"]
 
 )
+# Writes pin their client to the primary, only needed when reads can go to replicas
+if len(database.replicas) > 0:
+    app.add_middleware(ReadYourWritesMiddleware)
+# Cached listings are stored compressed and pass through it, other responses are compressed on the way out
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+# Profiler is not installed at all when it is turned off
+if PROFILING:
+    app.add_middleware(ProfilingMiddleware)
+# Added last, so it is the outermost middleware and the timings include the others
+app.add_middleware(MetricsMiddleware, on_response=record_pool_metrics)
 
 
 @app.on_event("startup")
 async def app_startup():
     await database.connect()
-    redis_cache = FastApiRedisCache()
-    redis_cache.init(
-        host_url=REDIS_URL,
-        prefix="cc-cache",
-        response_header="X-MyAPI-Cache",
-        ignore_arg_types=[AccessToken]
-    )
+    start_replica_monitor()
+    start_cache_listener()
+    start_cache_warmer()
+    start_event_listener()
+    start_like_flusher()
 
 
 @app.on_event("shutdown")
 async def app_shutdown():
+    await stop_cache_warmer()
+    await stop_cache_listener()
+    await stop_event_listener()
+    await stop_like_flusher()
+    await stop_replica_monitor()
     await database.disconnect()
+    shutdown_pool()
+    shutdown_metrics()
 
 
 # Root route redirects to main page
 @app.get("/", response_class=RedirectResponse)
 async def read_root():
     return "https://creativitycrop.tech"
+
+
+# Scraped by Prometheus, it only reads counters kept in memory
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_token)])
+async def get_metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,142 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+from starlette.routing import Route
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+# Every worker process keeps its own metrics, when PROMETHEUS_MULTIPROC_DIR is set they are written there instead and
+# /metrics adds up the values of all workers. The folder has to be emptied before the server starts.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Header set by app.cache on cached routes, its value is Hit, Stale or Miss
+CACHE_HEADER = b"x-myapi-cache"
+# Requests that matched no route share one label, so random paths cannot create new series
+UNMATCHED_ROUTE = "unmatched"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter("http_requests_total", "Handled requests", ["method", "route", "status"])
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled right now", ["method"], multiprocess_mode="livesum"
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "Lookups in the response cache", ["route", "result"])
+CACHE_WARMED = Counter("cache_warmed_pages_total", "Cached pages refreshed by the cache warmer")
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time spent on a database call, including waiting for a connection",
+    ["operation", "target"], buckets=LATENCY_BUCKETS
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Connections in the database pool", ["state"], multiprocess_mode="livesum"
+)
+EXTERNAL_CALL_DURATION = Histogram(
+    "external_call_duration_seconds", "Time spent on calls to external services", ["service"],
+    buckets=LATENCY_BUCKETS
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "external_call_errors_total", "Calls to external services that failed or got a server error", ["service"]
+)
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests refused by the rate limiter", ["policy"])
+EVENT_SUBSCRIBERS = Gauge(
+    "event_subscribers", "Clients connected to the live event stream", ["transport"], multiprocess_mode="livesum"
+)
+EVENT_OVERFLOWS = Counter("event_overflows_total", "Times a slow client missed events and was told to resync")
+DB_READS = Counter("db_reads_total", "Reads of read-only routes by the database that answered them", ["target"])
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds", "Replication lag last measured on a replica, -1 while it cannot be used", ["replica"],
+    multiprocess_mode="max"
+)
+
+
+@contextmanager
+def observe_query(operation: str, target: str = "primary"):
+    # Target is the database that answered, the primary or a replica
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_QUERY_DURATION.labels(operation, target).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def observe_external(service: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_CALL_ERRORS.labels(service).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_DURATION.labels(service).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, on_response=None) -> None:
+        self.app = app
+        # Called after every request, e.g. to record the state of the database pool
+        self.on_response = on_response
+        self.routes = None
+
+    def get_route(self, scope: Scope) -> str:
+        # Router puts the matched endpoint in the scope, its path template keeps the label count small
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if self.routes is None:
+            self.routes = {route.endpoint: route.path for route in scope["app"].routes if isinstance(route, Route)}
+        return self.routes.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        cache_result = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, cache_result
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                for name, value in message.get("headers", []):
+                    if name == CACHE_HEADER:
+                        cache_result = value.decode("latin-1").lower()
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            route = self.get_route(scope)
+            REQUEST_DURATION.labels(method, route).observe(elapsed)
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            if cache_result is not None:
+                CACHE_REQUESTS.labels(route, cache_result).inc()
+            if self.on_response is not None:
+                self.on_response()
+
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def shutdown_metrics():
+    # Gauges of a stopped worker are dropped from the sums
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
@@ -18,6 +18,8 @@ class IdeaSmall(BaseModel):
     id: str
     title: str
     imageURL: Optional[str]
+    thumbnailURL: Optional[str]
+    imageWebpURL: Optional[str]
     likes: int
 
 
@@ -0,0 +1,26 @@
+from app.config import STRIPE_API_KEY
+from app.metrics import observe_external, EXTERNAL_CALL_ERRORS
+
+_stripe = None
+
+
+def get_stripe():
+    # Stripe SDK takes long to import and only payments need it, so the first payment loads it instead of every
+    # worker at startup
+    global _stripe
+    if _stripe is None:
+        import stripe
+
+        class TimedStripeClient(stripe.http_client.RequestsClient):
+            # Stripe SDK sends every API call through its http client, retries included
+            def request(self, method, url, headers, post_data=None):
+                with observe_external("stripe"):
+                    content, status_code, response_headers = super().request(method, url, headers, post_data)
+                if status_code >= 500:
+                    EXTERNAL_CALL_ERRORS.labels("stripe").inc()
+                return content, status_code, response_headers
+
+        stripe.api_key = str(STRIPE_API_KEY)
+        stripe.default_http_client = TimedStripeClient()
+        _stripe = stripe
+    return _stripe
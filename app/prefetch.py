@@ -0,0 +1,50 @@
+from typing import List, Dict
+
+from app.database import database, in_values
+
+# Loads the related rows for a whole page of ideas with one query per relation, instead of one query per idea
+
+
+async def prefetch_categories(idea_ids: List[str]) -> Dict[str, List[str]]:
+    categories = {idea_id: [] for idea_id in idea_ids}
+    if len(idea_ids) == 0:
+        return categories
+    placeholders, values = in_values("idea_id", idea_ids)
+    rows = await database.fetch_all(
+        query="SELECT ideas_categories.idea_id, categories.name FROM ideas_categories "
+              "JOIN categories ON categories.id = ideas_categories.category_id "
+              f"WHERE ideas_categories.idea_id IN ({placeholders}) ORDER BY categories.name",
+        values=values
+    )
+    for row in rows:
+        categories[row["idea_id"]].append(row["name"])
+    return categories
+
+
+async def prefetch_files(idea_ids: List[str]) -> Dict[str, list]:
+    files = {idea_id: [] for idea_id in idea_ids}
+    if len(idea_ids) == 0:
+        return files
+    placeholders, values = in_values("idea_id", idea_ids)
+    # Title image has the same id as the idea, it is not one of the idea files
+    rows = await database.fetch_all(
+        query=f"SELECT * FROM files WHERE idea_id IN ({placeholders}) AND idea_id!=id ORDER BY upload_date",
+        values=values
+    )
+    for row in rows:
+        files[row["idea_id"]].append(row)
+    return files
+
+
+async def prefetch_likes(idea_ids: List[str]) -> Dict[str, int]:
+    likes = {idea_id: 0 for idea_id in idea_ids}
+    if len(idea_ids) == 0:
+        return likes
+    placeholders, values = in_values("idea_id", idea_ids)
+    rows = await database.fetch_all(
+        query=f"SELECT idea_id, COUNT(*) AS likes FROM ideas_likes WHERE idea_id IN ({placeholders}) GROUP BY idea_id",
+        values=values
+    )
+    for row in rows:
+        likes[row["idea_id"]] = row["likes"]
+    return likes
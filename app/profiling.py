@@ -0,0 +1,101 @@
+import os
+import re
+import time
+import random
+import secrets
+from typing import List
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+from app.config import PROFILES_PATH, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILES_KEEP, SUPER_USERS
+from app.authentication import verify_access_token
+
+# Admins ask for a profile of one request with this header, next to their usual token header
+PROFILE_HEADER = b"x-profile"
+TOKEN_HEADER = b"token"
+PROFILE_ID_HEADER = b"x-profile-id"
+PROFILE_SUFFIX = ".speedscope.json"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]+-[a-z]+-[a-z0-9_]+-[0-9a-f]{8}$")
+
+
+def is_admin(token: bytes) -> bool:
+    try:
+        return verify_access_token(token.decode("latin-1")).user in SUPER_USERS
+    except Exception:
+        return False
+
+
+def is_profile_id(profile_id: str) -> bool:
+    return PROFILE_ID_PATTERN.match(profile_id) is not None
+
+
+def get_profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILES_PATH, profile_id + PROFILE_SUFFIX)
+
+
+def list_profiles() -> List[dict]:
+    if not os.path.isdir(PROFILES_PATH):
+        return []
+    profiles = []
+    with os.scandir(PROFILES_PATH) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(PROFILE_SUFFIX):
+                stat = entry.stat()
+                profiles.append({
+                    "id": entry.name[:-len(PROFILE_SUFFIX)],
+                    "size": stat.st_size,
+                    "date": stat.st_mtime
+                })
+    return sorted(profiles, key=lambda profile: profile["date"], reverse=True)
+
+
+def save_profile(profile_id: str, output: str):
+    os.makedirs(PROFILES_PATH, exist_ok=True)
+    path = get_profile_path(profile_id)
+    with open(path + ".tmp", "w") as file:
+        file.write(output)
+    os.replace(path + ".tmp", path)
+    # Only the newest profiles are kept
+    for profile in list_profiles()[PROFILES_KEEP:]:
+        os.remove(get_profile_path(profile["id"]))
+
+
+class ProfilingMiddleware:
+    # Installed only when PROFILING is on, requests that are not profiled just look at their headers
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def should_profile(self, scope: Scope) -> bool:
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return True
+        headers = dict(scope["headers"])
+        return PROFILE_HEADER in headers and is_admin(headers.get(TOKEN_HEADER, b""))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        # Imported here, so the profiler is not loaded at all while nothing is profiled
+        from pyinstrument import Profiler
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        path = re.sub(r"[^a-z0-9]+", "_", scope["path"].lower()).strip("_") or "root"
+        profile_id = f'{int(time.time())}-{scope["method"].lower()}-{path[:64]}-{secrets.token_hex(4)}'
+
+        async def send_wrapper(message: Message) -> None:
+            # Profile id is returned with the response, so the admin knows which file to download
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        # Async mode follows the request task through awaits, time spent waiting for the database is shown too
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            output = profiler.output(SpeedscopeRenderer())
+            await run_in_threadpool(save_profile, profile_id, output)
@@ -0,0 +1,123 @@
+import math
+import time
+import secrets
+from collections import OrderedDict, deque
+
+import redis
+from fastapi import Request, Depends
+
+from app.cache import get_async_redis, redis_unavailable, redis_failed
+from app.config import RATE_LIMITS, RATE_LIMIT_ENABLED
+from app.dependencies import get_token_data
+from app.errors.ratelimit import RateLimitExceededError
+from app.metrics import RATE_LIMITED
+from app.models.token import AccessToken
+
+RATE_LIMIT_KEY = "cc-ratelimit:{policy}:{identity}"
+# Most identities the in-process limiter remembers, the least recently seen ones are dropped first
+LOCAL_MAX_KEYS = 10000
+
+# Sliding window log, the sorted set holds the time of every allowed request in the window. Old entries are
+# removed and the new one is added in one atomic step, so workers cannot race past the limit.
+# Returns 0 when the request is allowed, otherwise the milliseconds until the oldest request leaves the window.
+# With ARGV[5] set to 0 the limit is only checked and the request is not counted.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) < limit then
+    if ARGV[5] == '1' then
+        redis.call('ZADD', KEYS[1], now, ARGV[4])
+        redis.call('PEXPIRE', KEYS[1], window)
+    end
+    return 0
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return tonumber(oldest[2]) + window - now
+"""
+
+
+class LocalSlidingWindow:
+    # Same algorithm in memory, limits are per process while Redis is not available
+    def __init__(self, max_keys: int = LOCAL_MAX_KEYS) -> None:
+        self.max_keys = max_keys
+        self.hits = OrderedDict()
+
+    def hit(self, key: str, limit: int, window: float, now: float, count: bool = True) -> float:
+        hits = self.hits.get(key)
+        if hits is None:
+            hits = self.hits[key] = deque()
+            if len(self.hits) > self.max_keys:
+                self.hits.popitem(last=False)
+        else:
+            self.hits.move_to_end(key)
+        while len(hits) != 0 and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) < limit:
+            if count:
+                hits.append(now)
+            return 0
+        return hits[0] + window - now
+
+
+_script = None
+local_window = LocalSlidingWindow()
+
+
+def get_script():
+    global _script
+    if _script is None:
+        # Short timeouts, a slow Redis should not hold up every limited request
+        _script = get_async_redis(connect_timeout=0.1, timeout=0.25).register_script(SLIDING_WINDOW_SCRIPT)
+    return _script
+
+
+async def hit(policy: str, identity: str, count: bool = True) -> float:
+    # Counts one request of the identity and returns the seconds it has to wait, 0 when it is allowed. Without count
+    # the limit is only checked. While Redis is not available, the in-process limiter is used.
+    limit, window = RATE_LIMITS[policy]
+    key = RATE_LIMIT_KEY.format(policy=policy, identity=identity)
+    now = time.time()
+    if not redis_unavailable():
+        try:
+            wait = await get_script()(
+                keys=[key],
+                args=[int(now * 1000), window * 1000, limit, f"{now}-{secrets.token_hex(4)}", int(count)]
+            )
+            return wait / 1000
+        except (redis.RedisError, OSError):
+            redis_failed()
+    return local_window.hit(key, limit, window, now, count)
+
+
+async def check_rate_limit(policy: str, identity: str, count: bool = True):
+    if not RATE_LIMIT_ENABLED:
+        return
+    wait = await hit(policy, identity, count)
+    if wait > 0:
+        RATE_LIMITED.labels(policy).inc()
+        raise RateLimitExceededError(retry_after=max(1, math.ceil(wait)))
+
+
+async def count_failure(policy: str, identity: str):
+    # Attempt that failed, e.g. a wrong password. Policies counting only failures are checked with count=False.
+    if RATE_LIMIT_ENABLED:
+        await hit(policy, identity)
+
+
+def client_address(request: Request) -> str:
+    # Client address is the one uvicorn takes from X-Forwarded-For when the proxy is trusted
+    return request.client.host if request.client is not None else "unknown"
+
+
+def limit_by_ip(policy: str):
+    async def dependency(request: Request):
+        await check_rate_limit(policy, client_address(request))
+    return dependency
+
+
+def limit_by_user(policy: str):
+    async def dependency(token_data: AccessToken = Depends(get_token_data)):
+        await check_rate_limit(policy, str(token_data.user_id))
+    return dependency
@@ -16,6 +16,7 @@ class AccountData(BaseModel):
     dateRegister: datetime
     dateLogin: datetime
     avatarURL: Optional[str]
+    avatarThumbnailURL: Optional[str]
     unfinishedPaymentIntent: Optional[str]
     unfinishedPaymentIntentSecret: Optional[str]
     unfinishedPaymentIdea: Optional[IdeaPartial]
@@ -16,3 +16,17 @@ class IdeasHottest(BaseModel):
 class Like(BaseModel):
     isLiked: bool
     count: int
+
+
+class LikedIdeas(BaseModel):
+    liked: List[str]
+
+
+class CategoryFacet(BaseModel):
+    id: int
+    name: str
+    count: int
+
+
+class CategoriesList(BaseModel):
+    categories: List[CategoryFacet]
@@ -1,75 +1,59 @@
-from fastapi import APIRouter, File, UploadFile, Form, Depends, HTTPException
+from fastapi import APIRouter, File, UploadFile, Form, Depends, HTTPException, BackgroundTasks
 from starlette import status
-import stripe
+from datetime import datetime, timedelta
 import aiofiles as aiofiles
 import hashlib
 from asyncmy.errors import IntegrityError
 
-from app.config import *
+from app.config import ACCOUNT_CACHE_TTL
 from app.database import database
+from app.cache import get_cached_account, cache_account, invalidate_account
 import app.authentication as auth
 from app.dependencies import get_token_data
 from app.errors.account import InvoiceUnavailableYetError, InvoiceAccessUnauthorizedError, InvoiceNotFoundError
 from app.errors.auth import EmailDuplicateError, UsernameDuplicateError
 from app.errors.files import FiletypeNotAllowedError
 from app.functions import verify_idea_id, save_file
+from app.routers.payment import get_client_secret
+from app.storage import delete_file
+from app.prefetch import prefetch_categories, prefetch_files, prefetch_likes
 from app.models.idea import IdeaFile
 from app.models.token import AccessToken
 from app.responses.account import *
 
+# Optional fields of bought ideas, that cost an extra column or query to load
+BOUGHT_IDEA_FIELDS = {"longDesc", "files", "categories"}
+
 router = APIRouter(
     prefix="/account",
     tags=["account"]
 )
 
-stripe.api_key = str(STRIPE_API_KEY)
-
 
 @router.get("", response_model=AccountData)
 async def get_account(token_data: AccessToken = Depends(get_token_data)):
-    query = "SELECT users.*, " \
-            "files.public_path AS avatar_url, " \
-            "payments.id AS unfinished_intent, payments.idea_id AS unfinished_payment_idea, " \
+    # Account page is opened on every login, so it is cached for a short time per user
+    cached = await get_cached_account(token_data.user_id)
+    if cached is not None:
+        return AccountData.parse_raw(cached)
+
+    query = "SELECT users.id, users.first_name, users.last_name, users.email, users.iban, users.username, " \
+            "users.date_register, users.date_login, " \
+            "avatar_files.public_path AS avatar_url, avatar_blobs.thumbnail_url AS avatar_thumbnail_url, " \
+            "payments.id AS unfinished_intent, payments.client_secret, payments.date AS payment_date, " \
             "ideas.id AS idea_id, ideas.seller_id, ideas.title, ideas.short_desc, ideas.date_publish, " \
-            "ideas.date_expiry, ideas.price, " \
-            "(SELECT files.public_path FROM files WHERE files.id=payments.idea_id ) AS idea_img, " \
-            "(SELECT COUNT(*) FROM ideas_likes WHERE idea_id=ideas.id) AS likes " \
+            "ideas.date_expiry, ideas.price, idea_files.public_path AS idea_img " \
             "FROM users " \
-            "LEFT JOIN files ON users.avatar_id=files.id " \
+            "LEFT JOIN files AS avatar_files ON users.avatar_id=avatar_files.id " \
+            "LEFT JOIN blobs AS avatar_blobs ON avatar_files.blob_hash=avatar_blobs.hash " \
             "LEFT JOIN payments ON users.id=payments.user_id AND payments.status = 'requires_payment_method' " \
             "AND payments.date > DATE_SUB(CURRENT_TIMESTAMP, INTERVAL 10 MINUTE) " \
-            "LEFT JOIN ideas ON ideas.id=payments.idea_Id " \
+            "LEFT JOIN ideas ON ideas.id=payments.idea_id " \
+            "LEFT JOIN files AS idea_files ON idea_files.id=payments.idea_id " \
             "WHERE users.id=:user_id"
     result = await database.fetch_one(query=query, values={"user_id": token_data.user_id})
-    # Checks for unfinished payment
-    if result["unfinished_intent"] is not None:
-        intent = stripe.PaymentIntent.retrieve(result["unfinished_intent"], )
-        return AccountData(
-            id=result["id"],
-            firstName=result["first_name"],
-            lastName=result["last_name"],
-            email=result["email"],
-            iban=result["iban"],
-            username=result["username"],
-            dateRegister=result["date_register"],
-            dateLogin=result["date_login"],
-            avatarURL=result["avatar_url"],
-            unfinishedPaymentIntent=result["unfinished_intent"],
-            unfinishedPaymentIntentSecret=intent["client_secret"],
-            unfinishedPaymentIdea=IdeaPartial(
-                id=result["idea_id"],
-                sellerID=result["seller_id"],
-                title=result["title"],
-                imageURL=result["idea_img"],
-                shortDesc=result["short_desc"],
-                price=result["price"],
-                datePublish=result["date_publish"],
-                dateExpiry=result["date_expiry"],
-                likes=result["likes"]
-            )
-        )
 
-    return AccountData(
+    account = AccountData(
         id=result["id"],
         firstName=result["first_name"],
         lastName=result["last_name"],
@@ -78,23 +62,67 @@ async def get_account(token_data: AccessToken = Depends(get_token_data)):
         username=result["username"],
         dateRegister=result["date_register"],
         dateLogin=result["date_login"],
-        avatarURL=result["avatar_url"]
+        avatarURL=result["avatar_url"],
+        avatarThumbnailURL=result["avatar_thumbnail_url"]
     )
+    ttl = ACCOUNT_CACHE_TTL
+    # Checks for unfinished payment
+    if result["unfinished_intent"] is not None:
+        likes = await database.fetch_val(
+            query="SELECT COUNT(*) AS likes FROM ideas_likes WHERE idea_id=:idea_id",
+            values={"idea_id": result["idea_id"]},
+            column="likes"
+        )
+        account.unfinishedPaymentIntent = result["unfinished_intent"]
+        account.unfinishedPaymentIntentSecret = await get_client_secret(
+            result["unfinished_intent"], result["client_secret"]
+        )
+        account.unfinishedPaymentIdea = IdeaPartial(
+            id=result["idea_id"],
+            sellerID=result["seller_id"],
+            title=result["title"],
+            imageURL=result["idea_img"],
+            shortDesc=result["short_desc"],
+            price=result["price"],
+            datePublish=result["date_publish"],
+            dateExpiry=result["date_expiry"],
+            likes=likes
+        )
+        # Unfinished payment is shown only for 10 minutes, the cached page must not outlive it
+        payment_left = result["payment_date"] + timedelta(minutes=10) - datetime.now()
+        ttl = max(1, min(ttl, int(payment_left.total_seconds())))
+
+    await cache_account(token_data.user_id, account.json(), ttl)
+    return account
 
 
 @router.put("", response_model=AccountUpdate)
 async def update_account(
+        background_tasks: BackgroundTasks,
         avatar: Optional[UploadFile] = File(None),
         username: str = Form(None), email: str = Form(None), iban: str = Form(None),
         pass_hash: str = Form(None), token_data: AccessToken = Depends(get_token_data)
 ):
     result = AccountUpdate(status="none changed")
+    # Every change is visible on the account page, cached page is dropped before and after the changes, so a failed
+    # change halfway through or a concurrent request cannot leave an outdated page cached
+    await invalidate_account(token_data.user_id)
     if avatar is not None:
-        file_id = await save_file(file=avatar, kind="avatar", uid=token_data.user_id)
+        previous_avatar = await database.fetch_val(
+            query="SELECT avatar_id FROM users WHERE id=:user_id",
+            values={"user_id": token_data.user_id},
+            column="avatar_id"
+        )
+        file_id = await save_file(
+            file=avatar, kind="avatar", uid=token_data.user_id, background_tasks=background_tasks
+        )
         await database.execute(
             query="UPDATE users SET avatar_id=:file_id WHERE id=:user_id",
             values={"file_id": file_id, "user_id": token_data.user_id}
         )
+        # Old avatar is not used anymore, the same picture uploaded again has the same file id
+        if previous_avatar != file_id:
+            await delete_file(previous_avatar)
         result = AccountUpdate(status="success")
     if username is not None:
         try:
@@ -146,15 +174,25 @@ async def update_account(
                 accessToken=auth.create_access_token(AccessToken(user_id=token_data.user_id, user=token_data.user))
             )
         )
+    await invalidate_account(token_data.user_id)
     return result
 
 
 @router.get("/ideas/bought")
-async def get_ideas_bought_by_user(page: Optional[int] = 0, token_data: AccessToken = Depends(get_token_data)):
+async def get_ideas_bought_by_user(
+        page: Optional[int] = 0, fields: Optional[str] = None, token_data: AccessToken = Depends(get_token_data)
+):
     load_count = 5
-    query = "SELECT ideas.*, " \
+    # Heavy fields are loaded only when they are asked for, e.g. fields=longDesc,files, all of them by default
+    requested = BOUGHT_IDEA_FIELDS if fields is None else set(fields.split(",")) & BOUGHT_IDEA_FIELDS
+    long_desc_column = "ideas.long_desc, " if "longDesc" in requested else ""
+
+    # Total count is calculated by the same query, before the limit is applied
+    query = "SELECT ideas.id, ideas.seller_id, ideas.buyer_id, ideas.title, ideas.short_desc, ideas.date_publish, " \
+            "ideas.date_expiry, ideas.date_bought, ideas.price, " \
+            f"{long_desc_column}" \
             "files.public_path AS image_url, " \
-            "( SELECT COUNT(*) FROM ideas_likes WHERE idea_id=ideas.id ) AS likes " \
+            "COUNT(*) OVER () AS ideas_count " \
             "FROM ideas " \
             "LEFT JOIN files ON ideas.id=files.id " \
             "WHERE buyer_id=:buyer_id ORDER BY date_bought DESC LIMIT :start, :end"
@@ -162,33 +200,17 @@ async def get_ideas_bought_by_user(page: Optional[int] = 0, token_data: AccessTo
         query=query, values={"buyer_id": token_data.user_id, "start": page * load_count, "end": (page + 1) * load_count}
     )
 
-    # Convert list of sqlalchemy rows to dict, so it is possible to add new keys
-    results = list(map(lambda item: dict(item), results))
-
-    for result in results:
-        # cursor.execute("SELECT category FROM ideas_categories WHERE idea_id=%s", (result["id"],))
-        # result["categories"] = list(map(lambda x: x["category"], cursor.fetchall()))
-        result["categories"] = list(map(lambda x: x["category"], await database.fetch_all(
-            query="SELECT category FROM ideas_categories WHERE idea_id=:idea_id", values={"idea_id": result["id"]}
-        )))
-        # cursor.execute("SELECT * FROM files WHERE idea_id=%s AND idea_id!=id", (result["id"],))
-        result["files"] = list(await database.fetch_all(
-            query="SELECT * FROM files WHERE idea_id=:idea_id AND idea_id!=id", values={"idea_id": result["id"]}
-        ))
-
-    # Find the number of ideas matching the criteria
-    query = "SELECT COUNT(*) AS ideas_count " \
-            "FROM ideas " \
-            "WHERE buyer_id=:buyer_id"
-    ideas_count = await database.fetch_val(
-        query=query, values={"buyer_id": token_data.user_id}, column="ideas_count"
-    )
+    # Related rows are loaded for the whole page at once
+    idea_ids = [result["id"] for result in results]
+    likes = await prefetch_likes(idea_ids)
+    categories = await prefetch_categories(idea_ids) if "categories" in requested else {}
+    files = await prefetch_files(idea_ids) if "files" in requested else {}
 
     # Calculate remaining ideas for endless scrolling feature
-    if page == 0:
-        ideas_left = ideas_count - len(results)
+    if len(results) == 0:
+        ideas_left = 0
     else:
-        ideas_left = ideas_count - (page * load_count + len(results))
+        ideas_left = results[0]["ideas_count"] - (page * load_count + len(results))
 
     return BoughtIdeas(
         countLeft=ideas_left,
@@ -197,14 +219,14 @@ async def get_ideas_bought_by_user(page: Optional[int] = 0, token_data: AccessTo
             sellerID=idea["seller_id"],
             buyerID=idea["buyer_id"],
             title=idea["title"],
-            likes=idea["likes"],
+            likes=likes[idea["id"]],
             imageURL=idea["image_url"],
             shortDesc=idea["short_desc"],
-            longDesc=idea["long_desc"],
+            longDesc=idea["long_desc"] if "longDesc" in requested else None,
             datePublish=idea["date_publish"],
             dateExpiry=idea["date_expiry"],
             dateBought=idea["date_bought"],
-            categories=idea["categories"],
+            categories=categories.get(idea["id"]),
             files=list(map(lambda temp_file: IdeaFile(
                 id=temp_file["id"],
                 ideaID=temp_file["idea_id"],
@@ -214,7 +236,7 @@ async def get_ideas_bought_by_user(page: Optional[int] = 0, token_data: AccessTo
                 publicPath=temp_file["public_path"],
                 contentType=temp_file["content_type"],
                 uploadDate=temp_file["upload_date"]
-            ), idea["files"])),
+            ), files[idea["id"]])) if "files" in requested else None,
             price=idea["price"]
         ), results))
     )
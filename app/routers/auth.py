@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Header, Depends, Request
 from fastapi.responses import RedirectResponse
-import requests
-import json
 from datetime import datetime
 
-from app.config import DB_USER, DB_PASS, DB_NAME, DB_HOST, MAILGUN_API_KEY
+from app.config import DB_USER, DB_PASS, DB_NAME, DB_HOST
 from app.database import database
+from app.mail import send_mail
+from app.cache import invalidate_account
+from app.ratelimit import limit_by_ip, check_rate_limit, count_failure, client_address
 from app import authentication as auth
 from app.models.user import UserRegister, UserLogin, UserPasswordReset, UserPasswordUpdate
 from app.models.token import AccessToken, EmailVerifyToken, PasswordResetToken
@@ -19,7 +20,7 @@ router = APIRouter(
 )
 
 
-@router.post("/register")
+@router.post("/register", dependencies=[Depends(limit_by_ip("register"))])
 async def register_user(user: UserRegister):
     query = "INSERT INTO users(first_name, last_name, email, iban, username, salt, pass_hash, date_register) " \
             "VALUES(:first_name, :last_name, :email, :iban, :username, :salt, :pass_hash, :date_register)"
@@ -54,44 +55,43 @@ async def register_user(user: UserRegister):
         EmailVerifyToken(user_id=user_id, user=user.username, email=user.email)
     )
 
-    requests.post(
-        "https://api.eu.mailgun.net/v3/app.creativitycrop.tech/messages",
-        auth=("api", str(MAILGUN_API_KEY)),
-        data={
-            "from": "Friendly Bot from CreativityCrop <no-reply@app.creativitycrop.tech>",
-            "to": user.email,
-            "subject": "CreativityCrop - Account Verification",
-            "template": "confirm-email",
-            'h:X-Mailgun-Variables': json.dumps({
-                "user_name": user.first_name,
-                "email_token": email_token,
-                "current_year": datetime.now().year
-            })
-        }
+    send_mail(
+        to=user.email,
+        subject="CreativityCrop - Account Verification",
+        template="confirm-email",
+        variables={"user_name": user.first_name, "email_token": email_token}
     )
 
     return {"status": "success"}
 
 
-@router.post("/login", response_model=TokenResponse)
-async def login_user(user: UserLogin):
+@router.post("/login", response_model=TokenResponse, dependencies=[Depends(limit_by_ip("login"))])
+async def login_user(user: UserLogin, request: Request):
+    # Only failed logins of an account from the same address are limited, so nobody can lock others out of their
+    # accounts. Guessing across accounts is limited per address.
+    identity = f"{client_address(request)}:{user.username.lower()}"
+    await check_rate_limit("login-user", identity, count=False)
     result = await database.fetch_one(
         query='SELECT * FROM users WHERE username = :username',
         values={"username": user.username}
     )
 
     if result is None:
+        await count_failure("login-user", identity)
         raise UserNotFoundError
     # User need to verify the account to login
     if result["verified"] == 0:
         raise UserNotVerifiedError
     if not auth.verify_password(user.pass_hash, result["salt"], result["pass_hash"]):
+        await count_failure("login-user", identity)
         raise PasswordIncorrectError
 
     await database.execute(
         query="UPDATE users SET date_login = :date_login WHERE users.username = :username",
         values={"date_login": datetime.now().isoformat(), "username": user.username}
     )
+    # Account page shows the last login date
+    await invalidate_account(result["id"])
     access_token = auth.create_access_token(
         AccessToken(user_id=result["id"], user=user.username)
     )
@@ -117,8 +117,14 @@ async def verify_email_account(token: str):
     return RedirectResponse("https://creativitycrop.tech/login?email_verified=true")
 
 
-@router.post("/request-password-reset", response_model=PasswordResetResponse)
+@router.post(
+    "/request-password-reset",
+    response_model=PasswordResetResponse,
+    dependencies=[Depends(limit_by_ip("password-reset"))]
+)
 async def request_password_reset(email: UserPasswordReset):
+    # Every request sends an email, one address cannot be flooded with them
+    await check_rate_limit("password-reset-email", email.email.lower())
     user = await database.fetch_one(
         query="SELECT id, first_name, username, email FROM users WHERE email=:email",
         values={"email": email.email}
@@ -128,20 +134,11 @@ async def request_password_reset(email: UserPasswordReset):
     password_reset_token = auth.create_password_reset_token(
         PasswordResetToken(user_id=user["id"], user=user["username"], email=user["email"])
     )
-    requests.post(
-        "https://api.eu.mailgun.net/v3/app.creativitycrop.tech/messages",
-        auth=("api", str(MAILGUN_API_KEY)),
-        data={
-            "from": "Friendly Bot from CreativityCrop <no-reply@app.creativitycrop.tech>",
-            "to": user["email"],
-            "subject": "CreativityCrop - Account Password Recovery",
-            "template": "password-recovery",
-            'h:X-Mailgun-Variables': json.dumps({
-                "user_name": user["first_name"],
-                "password_token": password_reset_token,
-                "current_year": datetime.now().year
-            })
-        }
+    send_mail(
+        to=user["email"],
+        subject="CreativityCrop - Account Password Recovery",
+        template="password-recovery",
+        variables={"user_name": user["first_name"], "password_token": password_reset_token}
     )
 
     return PasswordResetResponse(status="success")
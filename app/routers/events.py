@@ -0,0 +1,70 @@
+from fastapi import APIRouter, WebSocket
+from fastapi.responses import StreamingResponse
+import asyncio
+
+from app.config import EVENTS_HEARTBEAT
+from app.events import broker, Subscriber
+from app.errors.events import TooManySubscribersError
+
+router = APIRouter(
+    prefix="/events",
+    tags=["events"]
+)
+
+
+# Server-sent events with the changes of the public listings, see app.events for the event types
+@router.get("")
+async def stream_events():
+    if broker.is_full():
+        raise TooManySubscribersError
+
+    async def stream():
+        # Subscribed in the stream, its end is the only place where the client is known to be gone
+        subscriber = broker.subscribe("sse")
+        try:
+            # Browsers reconnect after this many milliseconds when the connection is lost
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Comment line, it keeps proxies from closing an idle connection
+                    yield b": keep-alive\n\n"
+                    continue
+                # Waits while the client reads slowly, meanwhile new events pile up in its bounded queue
+                yield b"data: " + event + b"\n\n"
+        finally:
+            broker.unsubscribe(subscriber, "sse")
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Nginx would otherwise buffer the stream
+        "X-Accel-Buffering": "no"
+    })
+
+
+async def send_events(websocket: WebSocket, subscriber: Subscriber):
+    while True:
+        await websocket.send_text((await subscriber.get()).decode())
+
+
+# Same events over a WebSocket, for clients that already keep one open
+@router.websocket("/ws")
+async def websocket_events(websocket: WebSocket):
+    if broker.is_full():
+        # 1013 asks the client to try again later
+        await websocket.close(code=1013)
+        return
+    subscriber = broker.subscribe("websocket")
+    try:
+        await websocket.accept()
+        sender = asyncio.ensure_future(send_events(websocket, subscriber))
+        try:
+            # Clients only listen, anything they send is ignored until they close the connection
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+    finally:
+        broker.unsubscribe(subscriber, "websocket")
@@ -7,7 +7,6 @@ import hashlib
 
 from starlette import status
 
-from app.config import *
 from app.database import database
 import app.authentication as auth
 from app.dependencies import get_token_data
@@ -1,44 +1,58 @@
-from fastapi import APIRouter, Depends, Form, UploadFile, File
+from fastapi import APIRouter, Depends, Form, UploadFile, File, BackgroundTasks, Request, Response, Query
 from datetime import datetime
 from typing import Optional, List
-from fastapi_redis_cache import FastApiRedisCache, cache, cache_one_hour, cache_one_day
 
-from app.config import DB_HOST, DB_USER, DB_PASS, DB_NAME, IDEA_EXPIRES_AFTER
-from app.database import database
+from app.config import DB_HOST, DB_USER, DB_PASS, DB_NAME, IDEA_EXPIRES_AFTER, LIKES_WRITE_BEHIND
+from app.database import database, read_from_replica
 from app.dependencies import get_token_data
 from app.functions import verify_idea_id, calculate_idea_id, save_file
-from app.cache import invalidate_ideas
+from app.cache import invalidate_ideas, cached_response, get_idea_version, etag_matches, not_modified
+from app.ratelimit import limit_by_user
+from app.events import publish_event, IDEA_POSTED, IDEA_LIKED
+from app.likes import get_liked, record_like, toggle_like, like_written_directly
+from app.categories import get_category, get_category_ids, change_category_counts
+from app.prefetch import prefetch_categories
+from app.expiry import LISTED_IDEAS
 from app.models.idea import IdeaPost, IdeaPartial, IdeaFile, IdeaFull, IdeaSmall
 from app.models.token import AccessToken
 from app.errors.ideas import *
 from asyncmy.errors import IntegrityError
-from app.responses.ideas import IdeasList, IdeasHottest, Like
+from app.responses.ideas import IdeasList, IdeasHottest, Like, LikedIdeas, CategoryFacet, CategoriesList
 
 router = APIRouter(
     prefix="/ideas",
     tags=["ideas"]
 )
 
+ONE_HOUR = 3600
+ONE_DAY = 24 * ONE_HOUR
+# Most ideas /ideas/liked answers for at once, a few pages of the listing
+MAX_LIKED_IDEAS = 50
 
-@router.get("/get", response_model=IdeasList)
-@cache_one_day()
+
+@router.get("/get", response_model=IdeasList, dependencies=[Depends(read_from_replica)])
+@cached_response(expire=ONE_DAY)
 async def get_ideas(page: Optional[int] = 0, cat: Optional[str] = None):
+    values = {"start": page * 10, "end": ((page + 1) * 10), "now": datetime.now()}
+    category_filter = ""
+    if cat is not None:
+        category = await get_category(cat)
+        if category is None:
+            return IdeasList(countLeft=0, ideas=list())
+        # Exact match on the indexed category id, the index alone gives the ideas of the category
+        category_filter = "AND ideas.id IN (SELECT idea_id FROM ideas_categories WHERE category_id=:category_id) "
+        values["category_id"] = category["id"]
+
     query = "SELECT " \
             "ideas.id, seller_id, title, short_desc, date_publish, date_expiry, price, " \
-            "files.public_path AS image_url," \
+            "files.public_path AS image_url, blobs.thumbnail_url, blobs.webp_url, " \
             "(SELECT COUNT(*) FROM ideas_likes WHERE idea_id=ideas.id) AS likes " \
             "FROM ideas LEFT JOIN files ON ideas.id=files.id " \
-            "WHERE buyer_id IS NULL AND " \
-            "(:cat IS NULL OR ideas.id IN (SELECT idea_id FROM ideas_categories WHERE category LIKE :cat))" \
+            "LEFT JOIN blobs ON files.blob_hash=blobs.hash " \
+            f"WHERE {LISTED_IDEAS} " \
+            f"{category_filter}" \
             "ORDER BY date_publish DESC LIMIT :start, :end"
-    results = await database.fetch_all(
-        query=query,
-        values={
-            "cat": cat,
-            "start": page * 10,
-            "end": ((page + 1) * 10)
-        }
-    )
+    results = await database.fetch_all(query=query, values=values)
 
     # Convert list of sqlalchemy rows to dict, so it is possible to add new keys
     results = list(map(lambda item: dict(item), results))
@@ -48,19 +62,17 @@ async def get_ideas(page: Optional[int] = 0, cat: Optional[str] = None):
         return IdeasList(countLeft=0, ideas=list())
 
     # Get categories
+    categories = await prefetch_categories([result["id"] for result in results])
     for result in results:
-        categories = await database.fetch_all(
-            query="SELECT category FROM ideas_categories WHERE idea_id=:idea_id",
-            values={"idea_id": result["id"]}
-        )
-        result["categories"] = list(map(lambda x: x["category"], categories))
-
-    # Find the number of ideas matching the criteria
-    query = "SELECT COUNT(*) AS ideas_count " \
-            "FROM ideas " \
-            "WHERE ideas.buyer_id IS NULL AND " \
-            "(:cat IS NULL OR ideas.id IN (SELECT idea_id FROM ideas_categories WHERE category LIKE :cat))"
-    ideas_count = await database.fetch_val(query=query, values={"cat": cat}, column="ideas_count")
+        result["categories"] = categories[result["id"]]
+
+    # Find the number of ideas matching the criteria. Counted with the same filter as the page, the count kept with
+    # the category includes expired ideas until the worker archives them.
+    ideas_count = await database.fetch_val(
+        query=f"SELECT COUNT(*) AS ideas_count FROM ideas WHERE {LISTED_IDEAS} {category_filter}",
+        values={name: value for name, value in values.items() if name not in ("start", "end")},
+        column="ideas_count"
+    )
 
     # Calculate remaining ideas for endless scrolling feature
     if page == 0:
@@ -76,6 +88,8 @@ async def get_ideas(page: Optional[int] = 0, cat: Optional[str] = None):
             title=idea["title"],
             likes=idea["likes"],
             imageURL=idea["image_url"],
+            thumbnailURL=idea["thumbnail_url"],
+            imageWebpURL=idea["webp_url"],
             shortDesc=idea["short_desc"],
             datePublish=idea["date_publish"],
             dateExpiry=idea["date_expiry"],
@@ -85,10 +99,21 @@ async def get_ideas(page: Optional[int] = 0, cat: Optional[str] = None):
     ).dict()
 
 
+# Read from the primary, a replica that is behind could answer with an idea older than the version in its ETag
 @router.get("/get/{idea_id}", response_model=IdeaFull)
-async def get_idea_by_id(idea_id: str, token_data: AccessToken = Depends(get_token_data)):
+async def get_idea_by_id(
+        idea_id: str, request: Request, response: Response, token_data: AccessToken = Depends(get_token_data)
+):
     verify_idea_id(idea_id)
 
+    # What a user sees depends on whether they bought the idea, so the ETag is per user too
+    version = await get_idea_version(idea_id)
+    if version is not None:
+        etag = f'W/"{version}-{token_data.user_id}"'
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+
     query = "SELECT ideas.*, " \
             "(SELECT COUNT(*) FROM ideas_likes WHERE idea_id=ideas.id) AS likes, " \
             "files.public_path AS image_url, " \
@@ -108,9 +133,7 @@ async def get_idea_by_id(idea_id: str, token_data: AccessToken = Depends(get_tok
             raise IdeaAccessDeniedError
 
     # Get categories
-    result["categories"] = list(map(lambda x: x["category"], await database.fetch_all(
-        query="SELECT category FROM ideas_categories WHERE idea_id=:idea_id", values={"idea_id": result["id"]}
-    )))
+    result["categories"] = (await prefetch_categories([result["id"]]))[result["id"]]
 
     # Check if the user is the owner of the idea, if so fetch the files, else remove long description
     if result["buyer_id"] != token_data.user_id:
@@ -147,20 +170,49 @@ async def get_idea_by_id(idea_id: str, token_data: AccessToken = Depends(get_tok
     ).dict()
 
 
-@router.get("/get-hottest", response_model=IdeasHottest)
-@cache_one_hour()
+# Categories that have ideas for sale with their number, for the filters of the listings
+@router.get("/categories", response_model=CategoriesList, dependencies=[Depends(read_from_replica)])
+@cached_response(expire=ONE_DAY)
+async def get_categories():
+    categories = await database.fetch_all(
+        query="SELECT id, name, ideas_count FROM categories WHERE ideas_count > 0 ORDER BY ideas_count DESC, name"
+    )
+
+    return CategoriesList(categories=list(map(lambda category: CategoryFacet(
+        id=category["id"],
+        name=category["name"],
+        count=category["ideas_count"]
+    ), categories))).dict()
+
+
+# Which ideas of a page the user liked, the cached listings are the same for everyone and cannot show it
+@router.get("/liked", response_model=LikedIdeas)
+async def get_liked_ideas(ids: List[str] = Query(...), token_data: AccessToken = Depends(get_token_data)):
+    if len(ids) > MAX_LIKED_IDEAS:
+        raise TooManyIdeasError(MAX_LIKED_IDEAS)
+    for idea_id in ids:
+        verify_idea_id(idea_id)
+
+    return LikedIdeas(liked=await get_liked(token_data.user_id, ids))
+
+
+@router.get("/get-hottest", response_model=IdeasHottest, dependencies=[Depends(read_from_replica)])
+@cached_response(expire=ONE_HOUR)
 async def get_hottest_ideas():
-    query = "SELECT ideas.id, ideas.title, files.public_path AS image_url, " \
+    query = "SELECT ideas.id, ideas.title, files.public_path AS image_url, blobs.thumbnail_url, blobs.webp_url, " \
             "(SELECT COUNT(*) FROM ideas_likes WHERE idea_id=ideas.id) AS likes " \
             "FROM ideas LEFT JOIN files ON ideas.id=files.id " \
-            "WHERE buyer_id IS NULL ORDER BY likes DESC LIMIT 5"
-    results = await database.fetch_all(query)
+            "LEFT JOIN blobs ON files.blob_hash=blobs.hash " \
+            f"WHERE {LISTED_IDEAS} ORDER BY likes DESC LIMIT 5"
+    results = await database.fetch_all(query, values={"now": datetime.now()})
 
     return IdeasHottest(
         ideas=list(map(lambda idea: IdeaSmall(
             id=idea["id"],
             title=idea["title"],
             imageURL=idea["image_url"],
+            thumbnailURL=idea["thumbnail_url"],
+            imageWebpURL=idea["webp_url"],
             likes=idea["likes"]
         ), results))
     ).dict()
@@ -202,6 +254,7 @@ async def get_hottest_ideas():
 
 @router.post("/post2")
 async def post_idea_dos(
+        background_tasks: BackgroundTasks,
         files: List[UploadFile] = File(None),
         title: str = Form(...),
         image: UploadFile = File(...),
@@ -227,13 +280,16 @@ async def post_idea_dos(
         "price": price
     }
     try:
-        await database.execute(query=query, values=data)
-        if categories is not None:
-            for category in categories:
-                await database.execute(
-                    query="INSERT INTO ideas_categories(idea_id, category) VALUES(:idea_id, :category)",
-                    values={"idea_id": idea_id, "category": category}
+        # Idea is saved with its categories and counted in them, or not at all
+        async with database.transaction():
+            category_ids = await get_category_ids(categories) if categories is not None else []
+            await database.execute(query=query, values=data)
+            if len(category_ids) > 0:
+                await database.execute_many(
+                    query="INSERT INTO ideas_categories(idea_id, category_id) VALUES(:idea_id, :category_id)",
+                    values=[{"idea_id": idea_id, "category_id": category_id} for category_id in category_ids]
                 )
+                await change_category_counts([idea_id], 1)
     except IntegrityError as ex:
         field = ex.args[1].split()[5]
         if field == "'id'":
@@ -242,7 +298,7 @@ async def post_idea_dos(
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=ex.__dict__)
 
     # Saving title image
-    await save_file(file=image, kind="idea-title", uid=idea_id)
+    await save_file(file=image, kind="idea-title", uid=idea_id, background_tasks=background_tasks)
 
     # Saving each file
     if files is not None:
@@ -250,21 +306,31 @@ async def post_idea_dos(
             await save_file(file=file, kind="idea-file", uid=idea_id)
 
     # Delete cache
-    invalidate_ideas()
+    await invalidate_ideas(idea_id)
+    await publish_event(
+        IDEA_POSTED, idea_id, title=title, price=price, sellerID=token_data.user_id, categories=categories or []
+    )
 
     return idea_id
 
 
-@router.put("/like", response_model=Like)
+@router.put("/like", response_model=Like, dependencies=[Depends(limit_by_user("like-user"))])
 async def like_idea(idea_id: str, token_data: AccessToken = Depends(get_token_data)):
     verify_idea_id(idea_id)
 
-    buyer_id = await database.fetch_val(
-        query="SELECT buyer_id FROM ideas WHERE id=:idea_id", values={"idea_id": idea_id}, column="buyer_id"
-    )
-    if buyer_id is not None:
+    idea = await database.fetch_one(query="SELECT buyer_id FROM ideas WHERE id=:idea_id", values={"idea_id": idea_id})
+    if idea is None:
+        raise IdeaNotFoundError
+    if idea["buyer_id"] is not None:
         raise IdeaLikeDenied
 
+    # Answered from Redis, the like is written to the database with the next batch, which also refreshes the listings
+    toggled = await toggle_like(idea_id, token_data.user_id) if LIKES_WRITE_BEHIND else None
+    if toggled is not None:
+        is_liked, count = toggled
+        await publish_event(IDEA_LIKED, idea_id, likes=count)
+        return Like(isLiked=is_liked, count=count)
+
     # Try to insert a like row in the table, if a duplication error is thrown, delete the like
     try:
         await database.execute(
@@ -278,6 +344,8 @@ async def like_idea(idea_id: str, token_data: AccessToken = Depends(get_token_da
             values={"idea_id": idea_id, "user_id": token_data.user_id}
         )
         is_liked = False
+    if LIKES_WRITE_BEHIND:
+        await like_written_directly(idea_id, token_data.user_id)
 
     # Get the number of likes
     query = "SELECT " \
@@ -289,8 +357,10 @@ async def like_idea(idea_id: str, token_data: AccessToken = Depends(get_token_da
     if result is None:
         raise IdeaNotFoundError
 
+    await record_like(token_data.user_id, idea_id, is_liked)
     # Delete cache
-    invalidate_ideas()
+    await invalidate_ideas(idea_id)
+    await publish_event(IDEA_LIKED, idea_id, likes=result["likes_count"])
 
     return Like(
         isLiked=is_liked,
@@ -1,11 +1,19 @@
 from fastapi import APIRouter, Request, Depends
-import stripe
+import asyncio
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
 
-from app.config import DB_HOST, DB_NAME, DB_PASS, DB_USER, STRIPE_API_KEY, STRIPE_WEBHOOK_SECRET
+from app.config import (
+    DB_HOST, DB_NAME, DB_PASS, DB_USER, STRIPE_WEBHOOK_SECRET, PAYMENT_STATUS_MAX_WAIT
+)
 from app.database import database
+from app.payments import get_stripe
 from app.dependencies import get_token_data
 from app.functions import verify_idea_id
-from app.cache import invalidate_ideas
+from app.cache import invalidate_ideas, invalidate_account
+from app.categories import change_category_counts
+from app.events import publish_event, publish_payment_status, watch_payment, IDEA_RESERVED, IDEA_RELEASED, IDEA_SOLD
 from app.errors.payment import *
 from app.errors.ideas import IdeaNotFoundError
 from app.models.token import AccessToken
@@ -16,7 +24,17 @@ router = APIRouter(
     tags=["payment"],
 )
 
-stripe.api_key = str(STRIPE_API_KEY)
+
+async def get_client_secret(payment_id: str, client_secret: Optional[str]) -> str:
+    # Payments created before the secret was saved with them still need to ask Stripe once
+    if client_secret is None:
+        intent = await run_in_threadpool(get_stripe().PaymentIntent.retrieve, payment_id)
+        client_secret = intent["client_secret"]
+        await database.execute(
+            query="UPDATE payments SET client_secret=:client_secret WHERE id=:id",
+            values={"client_secret": client_secret, "id": payment_id}
+        )
+    return client_secret
 
 
 @router.get("/create", response_model=ClientSecret)
@@ -27,7 +45,8 @@ async def create_payment(idea_id: str, token_data: AccessToken = Depends(get_tok
             "(SELECT COUNT(*) FROM payments WHERE idea_id=:idea_id) AS idea_count, " \
             "(SELECT COUNT(*) FROM payments WHERE user_id=:user_id AND status != 'succeeded') AS user_count, " \
             "(SELECT user_id FROM payments WHERE idea_id=:idea_id AND status != 'succeeded') AS buyer_id, " \
-            "(SELECT id FROM payments WHERE idea_id=:idea_id AND status != 'succeeded') AS payment_id "
+            "(SELECT id FROM payments WHERE idea_id=:idea_id AND status != 'succeeded') AS payment_id, " \
+            "(SELECT client_secret FROM payments WHERE idea_id=:idea_id AND status != 'succeeded') AS client_secret "
     check = await database.fetch_one(query=query, values={"idea_id": idea_id, "user_id": token_data.user_id})
 
     # Payment already exists for that idea
@@ -35,9 +54,8 @@ async def create_payment(idea_id: str, token_data: AccessToken = Depends(get_tok
         # Check if user is the initiator of the payment
         if check["buyer_id"] == token_data.user_id:
             # If yes, give them the payment
-            intent = stripe.PaymentIntent.retrieve(check["payment_id"], )
             return ClientSecret(
-                clientSecret=intent["client_secret"]
+                clientSecret=await get_client_secret(check["payment_id"], check["client_secret"])
             )
         else:
             raise IdeaBusyError
@@ -45,7 +63,8 @@ async def create_payment(idea_id: str, token_data: AccessToken = Depends(get_tok
     if check["user_count"] != 0:
         raise UnresolvedPaymentExistsError
 
-    query = "SELECT ideas.price, ideas.title, ideas.seller_id, ideas.buyer_id, users.id AS user_id, users.email " \
+    query = "SELECT ideas.price, ideas.title, ideas.seller_id, ideas.buyer_id, ideas.date_expiry, " \
+            "ideas.date_archived, users.id AS user_id, users.email " \
             "FROM ideas, users " \
             "WHERE ideas.id=:idea_id AND users.id=:user_id"
     idea = await database.fetch_one(query=query, values={"idea_id": idea_id, "user_id": token_data.user_id})
@@ -55,8 +74,10 @@ async def create_payment(idea_id: str, token_data: AccessToken = Depends(get_tok
     # Checks if idea is for sale
     if idea["buyer_id"] is not None:
         raise IdeaAlreadySoldError
+    if idea["date_archived"] is not None or idea["date_expiry"] <= datetime.now():
+        raise IdeaExpiredError
 
-    intent = stripe.PaymentIntent.create(
+    intent = get_stripe().PaymentIntent.create(
         amount=int(idea["price"] * 100),
         receipt_email=idea["email"],
         currency="usd",
@@ -68,8 +89,9 @@ async def create_payment(idea_id: str, token_data: AccessToken = Depends(get_tok
         }
 
     )
-    query = "INSERT INTO payments(id, amount, currency, idea_id, user_id, status) " \
-            "VALUES(:id, :amount, :currency, :idea_id, :user_id, :status)"
+    # Client secret is saved with the payment, so the account page does not have to ask Stripe for it
+    query = "INSERT INTO payments(id, amount, currency, idea_id, user_id, status, client_secret) " \
+            "VALUES(:id, :amount, :currency, :idea_id, :user_id, :status, :client_secret)"
     await database.execute(
         query=query,
         values={
@@ -78,15 +100,19 @@ async def create_payment(idea_id: str, token_data: AccessToken = Depends(get_tok
             "currency": intent["currency"],
             "idea_id": idea_id,
             "user_id": idea["user_id"],
-            "status": intent["status"]
+            "status": intent["status"],
+            "client_secret": intent["client_secret"]
         }
     )
 
     # Make the buyer_id -1 to stop it from appearing in the list of ideas for sale
     await database.execute(query="UPDATE ideas SET buyer_id=-1 WHERE id=:idea_id", values={"idea_id": idea_id})
+    await change_category_counts([idea_id], -1)
 
     # Delete cache so it disappears
-    invalidate_ideas()
+    await invalidate_ideas(idea_id)
+    await invalidate_account(token_data.user_id)
+    await publish_event(IDEA_RESERVED, idea_id)
 
     return ClientSecret(
         clientSecret=intent["client_secret"]
@@ -107,15 +133,19 @@ async def delete_payment(idea_id: str, _: AccessToken = Depends(get_token_data))
     if payment["status"] == "succeeded":
         raise PaymentCannotBeCanceledError
 
+    stripe = get_stripe()
     stripe.PaymentIntent.cancel(
         stripe.PaymentIntent(payment["id"])
     )
 
     await database.execute(query="DELETE FROM payments WHERE idea_id=:idea_id", values={"idea_id": idea_id})
     await database.execute(query="UPDATE ideas SET buyer_id=NULL WHERE id=:idea_id", values={"idea_id": idea_id})
+    await change_category_counts([idea_id], 1)
 
     # Delete cache so it disappears
-    invalidate_ideas()
+    await invalidate_ideas(idea_id)
+    await invalidate_account(payment["user_id"])
+    await publish_event(IDEA_RELEASED, idea_id)
 
     return {"status": "success"}
 
@@ -123,17 +153,15 @@ async def delete_payment(idea_id: str, _: AccessToken = Depends(get_token_data))
 @router.get("/get", response_model=ClientSecret)
 async def get_payment(token_data: AccessToken = Depends(get_token_data)):
     result = await database.fetch_one(
-        query="SELECT id FROM payments WHERE user_id=:user_id",
+        query="SELECT id, client_secret FROM payments WHERE user_id=:user_id",
         values={"user_id": token_data.user_id}
     )
 
     if result is None:
         raise PaymentNotFoundError
 
-    intent = stripe.PaymentIntent.retrieve(result["id"], )
-
     return ClientSecret(
-        clientSecret=intent["client_secret"]
+        clientSecret=await get_client_secret(result["id"], result["client_secret"])
     )
 
 
@@ -142,6 +170,7 @@ async def get_payment(token_data: AccessToken = Depends(get_token_data)):
 async def webhook_received(request: Request):
     sig_header = request.headers.get("stripe-signature")
     webhook_secret = str(STRIPE_WEBHOOK_SECRET)
+    stripe = get_stripe()
     try:
         event = stripe.Webhook.construct_event(await request.body(), sig_header, webhook_secret)
     except ValueError as ex:
@@ -180,10 +209,12 @@ async def webhook_received(request: Request):
         }
     )
 
-    # Delete cache so it disappears
-    invalidate_ideas()
-
     if intent["status"] == "succeeded":
+        # Reserved ideas already left the category counts, one released by the worker meanwhile is listed again
+        listed = await database.fetch_val(
+            query="SELECT buyer_id IS NULL AND date_archived IS NULL AS listed FROM ideas WHERE id=:idea_id",
+            values={"idea_id": intent["metadata"]["idea_id"]}, column="listed"
+        )
         await database.execute(
             query="UPDATE ideas SET buyer_id=:buyer_id, date_bought=CURRENT_TIMESTAMP() WHERE id=:idea_id",
             values={"buyer_id": intent["metadata"]["buyer_id"], "idea_id": intent["metadata"]["idea_id"]}
@@ -192,21 +223,52 @@ async def webhook_received(request: Request):
             query="INSERT INTO payouts(idea_id, user_id) VALUES(:idea_id, :user_id)",
             values={"idea_id": intent["metadata"]["idea_id"], "user_id": intent["metadata"]["seller_id"]}
         )
+        if listed:
+            await change_category_counts([intent["metadata"]["idea_id"]], -1)
 
-    return {'status': 'success'}
+    # Delete cache so it disappears, after the idea got its buyer, so it cannot be cached again without them
+    await invalidate_ideas(intent["metadata"]["idea_id"])
+    await invalidate_account(int(intent["metadata"]["buyer_id"]))
+    if intent["status"] == "succeeded":
+        await publish_event(IDEA_SOLD, intent["metadata"]["idea_id"])
+    # Requests waiting on /payment/status get the new status, after it is in the database
+    await publish_payment_status(intent["id"], intent["status"])
 
+    return {'status': 'success'}
 
-# Endpoint for checking status of payment, required to know what to show the user when redirected to their account
-@router.get("/status")
-async def order_status(payment_intent: str, redirect_status: str):
-    payment = await database.fetch_one(
-        query="SELECT * FROM payments WHERE id=:payment_id",
-        values={"payment_id": payment_intent}
-    )
 
-    if payment["status"] == "succeeded" and redirect_status == "succeeded":
+def status_response(payment_status: str, redirect_status: str) -> dict:
+    if payment_status == "succeeded" and redirect_status == "succeeded":
         return {"status": "succeeded", "message": None}
-    elif payment["status"] == "processing":
+    elif payment_status == "processing":
         return {"message": "Your payment is being processed. Your idea should arrive soon."}
     else:
         return {"message": "Your idea should arrive soon. If a problem occurs, contact us!"}
+
+
+# Endpoint for checking status of payment, required to know what to show the user when redirected to their account.
+# With wait, a payment that Stripe accepted but whose webhook has not arrived yet is answered as soon as it does,
+# instead of the client polling.
+@router.get("/status")
+async def order_status(payment_intent: str, redirect_status: str, wait: int = 0):
+    with watch_payment(payment_intent) as status_changed:
+        payment = await database.fetch_one(
+            query="SELECT status FROM payments WHERE id=:payment_id",
+            values={"payment_id": payment_intent}
+        )
+        if payment is None:
+            raise PaymentNotFoundError
+
+        payment_status = payment["status"]
+        if wait > 0 and payment_status != "succeeded" and redirect_status == "succeeded":
+            try:
+                payment_status = await asyncio.wait_for(status_changed, min(wait, PAYMENT_STATUS_MAX_WAIT))
+            except asyncio.TimeoutError:
+                # Webhook is late or its status was not published, the database has the last known one
+                payment_status = await database.fetch_val(
+                    query="SELECT status FROM payments WHERE id=:payment_id",
+                    values={"payment_id": payment_intent},
+                    column="status"
+                )
+
+    return status_response(payment_status, redirect_status)
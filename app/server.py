@@ -0,0 +1,142 @@
+import math
+import os
+import shutil
+import signal
+import time
+from typing import Optional
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from app.config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MAX_WORKERS, SERVER_PRELOAD, SERVER_BACKLOG, SERVER_KEEPALIVE,
+    SERVER_LIMIT_CONCURRENCY, SERVER_LOOP, SERVER_HTTP, SERVER_TIMEOUT, SERVER_GRACEFUL_TIMEOUT, SERVER_MAX_REQUESTS,
+    SERVER_PIDFILE
+)
+
+# Master started by an upgrade writes its pid here, until the old master stopped
+UPGRADE_PIDFILE = f"{SERVER_PIDFILE}.2"
+
+
+class Worker(UvicornWorker):
+    # Uvicorn settings gunicorn has no option for
+    CONFIG_KWARGS = {
+        "loop": SERVER_LOOP,
+        "http": SERVER_HTTP,
+        "limit_concurrency": SERVER_LIMIT_CONCURRENCY or None,
+        "root_path": "/api"
+    }
+
+
+def available_cpus() -> int:
+    # CPUs the process may run on, a container limited with --cpus gets fewer than the machine has
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    quota = read_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def read_cpu_quota() -> Optional[float]:
+    # CPU quota of the cgroup, v2 keeps quota and period in one file, v1 in two
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+            quota = int(file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+            period = int(file.read())
+        return None if quota < 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def worker_count() -> int:
+    # Workers are async, one per CPU keeps every CPU busy without them competing for it
+    if SERVER_WORKERS > 0:
+        return SERVER_WORKERS
+    return min(available_cpus(), SERVER_MAX_WORKERS)
+
+
+def on_starting(arbiter):
+    # Metrics of the workers of an earlier run would be added to the new ones. A master started by an upgrade keeps
+    # them, the workers of the old master are still running.
+    folder = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if folder is not None and arbiter.master_pid == 0:
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
+
+
+def child_exit(_, worker):
+    # Worker that crashed could not drop its own gauges, see app.metrics.shutdown_metrics
+    from app.metrics import MULTIPROCESS
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class Server(BaseApplication):
+    def load_config(self):
+        settings = {
+            "bind": f"{SERVER_HOST}:{SERVER_PORT}",
+            "workers": worker_count(),
+            "worker_class": "app.server.Worker",
+            "preload_app": SERVER_PRELOAD,
+            "backlog": SERVER_BACKLOG,
+            "keepalive": SERVER_KEEPALIVE,
+            "timeout": SERVER_TIMEOUT,
+            "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+            "max_requests": SERVER_MAX_REQUESTS,
+            "max_requests_jitter": SERVER_MAX_REQUESTS // 10,
+            "pidfile": SERVER_PIDFILE,
+            "accesslog": "-",
+            "errorlog": "-",
+            "on_starting": on_starting,
+            "child_exit": child_exit
+        }
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+        return app
+
+
+def read_pid(path: str = SERVER_PIDFILE) -> Optional[int]:
+    try:
+        with open(path) as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def reload_workers():
+    # Gunicorn starts new workers and stops the old ones once they finished their requests. With SERVER_PRELOAD the
+    # new workers run the code the master loaded, use upgrade for new code.
+    pid = read_pid()
+    if pid is None:
+        raise SystemExit(f"No server is running, {SERVER_PIDFILE} is missing")
+    os.kill(pid, signal.SIGHUP)
+
+
+def upgrade():
+    # New master is started with the new code and shares the listening socket, the old master stops gracefully once
+    # the new one loaded the app and wrote its pid. Connections wait in the backlog meanwhile, none is refused.
+    old_pid = read_pid()
+    if old_pid is None:
+        raise SystemExit(f"No server is running, {SERVER_PIDFILE} is missing")
+    os.kill(old_pid, signal.SIGUSR2)
+    deadline = time.time() + SERVER_TIMEOUT
+    while read_pid(UPGRADE_PIDFILE) is None:
+        if time.time() > deadline:
+            raise SystemExit("New server did not start, the old one keeps running")
+        time.sleep(0.2)
+    os.kill(old_pid, signal.SIGTERM)
+
+
+def run():
+    Server().run()
@@ -0,0 +1,227 @@
+import asyncio
+import mimetypes
+import os
+import time
+from datetime import datetime
+from typing import Optional, List, Iterator, Set
+
+import aiofiles as aiofiles
+
+from app.config import CDN_FILES_PATH, CDN_URL, CDN_BLOB_GRACE_PERIOD, CDN_IMAGE_DERIVATIVES, \
+    CDN_ORPHAN_GRACE_PERIOD, CDN_GC_BATCH_SIZE, CDN_GC_RATE
+from app.database import database, in_values
+
+# Every uploaded file is stored once, under a path built from the SHA-256 of its contents. Rows in the files table
+# point to the blob by its hash, so identical uploads share the same bytes on disk. The blobs table keeps a
+# reference counter for every blob, blobs that are not referenced anymore are removed by the worker.
+BLOBS_FOLDER = "blobs/"
+
+
+def get_blob_path(blob_hash: str, content_type: str, filename: Optional[str] = None) -> str:
+    # Extension is needed so the CDN serves the blob with the right content type
+    extension = mimetypes.guess_extension(content_type) or os.path.splitext(filename or "")[1].lower()
+    # Two levels of sub folders, so a single directory does not end up with too many entries
+    return f'{BLOBS_FOLDER}{blob_hash[:2]}/{blob_hash[2:4]}/{blob_hash}{extension}'
+
+
+def get_derivative_paths(absolute_path: str) -> List[str]:
+    # Image derivatives are stored next to the blob, e.g. blobs/ab/cd/<hash>.thumbnail.webp
+    return [f'{os.path.splitext(absolute_path)[0]}.{name}.webp' for name in CDN_IMAGE_DERIVATIVES]
+
+
+async def write_blob(absolute_path: str, data: bytes) -> bool:
+    # Identical content is already on disk, skip the write
+    if os.path.exists(absolute_path):
+        return False
+
+    os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+    # Write to a temporary file and move it in place, so a blob is never visible half written
+    temp_path = f'{absolute_path}.{os.getpid()}.tmp'
+    async with aiofiles.open(temp_path, "wb") as blob:
+        await blob.write(data)
+    os.replace(temp_path, absolute_path)
+    return True
+
+
+async def acquire_blob(blob_hash: str, data: bytes, content_type: str, filename: Optional[str] = None) -> dict:
+    # Must be called inside a transaction, the row lock on the blob keeps the garbage collector away until commit
+    filepath = get_blob_path(blob_hash, content_type, filename)
+    await database.execute(
+        query="INSERT INTO blobs(hash, size, refcount, absolute_path, public_path) "
+              "VALUES(:hash, :size, 1, :absolute_path, :public_path) "
+              "ON DUPLICATE KEY UPDATE refcount = refcount + 1",
+        values={
+            "hash": blob_hash,
+            "size": len(data),
+            "absolute_path": CDN_FILES_PATH + filepath,
+            "public_path": CDN_URL + filepath
+        }
+    )
+    # Existing blob may be stored under a different extension, so always use the path saved in the database
+    blob = await database.fetch_one(
+        query="SELECT hash, absolute_path, public_path FROM blobs WHERE hash=:hash",
+        values={"hash": blob_hash}
+    )
+    await write_blob(blob["absolute_path"], data)
+    return dict(blob)
+
+
+async def release_blob(blob_hash: Optional[str]):
+    # Files saved before the blob store was introduced have no blob
+    if blob_hash is None:
+        return
+    await database.execute(
+        query="UPDATE blobs SET refcount = refcount - 1 WHERE hash=:hash",
+        values={"hash": blob_hash}
+    )
+
+
+async def delete_file(file_id: Optional[str]):
+    if file_id is None:
+        return
+    async with database.transaction():
+        blob_hash = await database.fetch_val(
+            query="SELECT blob_hash FROM files WHERE id=:id", values={"id": file_id}, column="blob_hash"
+        )
+        await database.execute(query="DELETE FROM files WHERE id=:id", values={"id": file_id})
+        await release_blob(blob_hash)
+
+
+async def release_idea_blobs(idea_ids: List[str]):
+    # A single blob can be used by more than one file of the ideas, so references are counted per blob first
+    placeholders, values = in_values("idea_id", idea_ids)
+    await database.execute(
+        query="UPDATE blobs "
+              "INNER JOIN (SELECT blob_hash, COUNT(*) AS count FROM files "
+              f"WHERE idea_id IN ({placeholders}) AND blob_hash IS NOT NULL GROUP BY blob_hash) AS released "
+              "ON released.blob_hash=blobs.hash "
+              "SET blobs.refcount = blobs.refcount - released.count",
+        values=values
+    )
+
+
+async def collect_unreferenced_blobs(limit: int = 500, hashes: Optional[List[str]] = None) -> int:
+    # Blobs are removed only after the grace period, so one that is released and uploaded again is not rewritten,
+    # unless specific blobs are collected right after their files were deleted
+    if hashes is not None and len(hashes) == 0:
+        return 0
+    if hashes is None:
+        condition, values = "date_modified < :older_than", {"older_than": datetime.now() - CDN_BLOB_GRACE_PERIOD}
+    else:
+        placeholders, values = in_values("hash", hashes)
+        condition = f"hash IN ({placeholders})"
+    async with database.transaction():
+        blobs = await database.fetch_all(
+            query="SELECT hash, absolute_path FROM blobs "
+                  f"WHERE refcount <= 0 AND {condition} "
+                  "AND NOT EXISTS (SELECT 1 FROM files WHERE files.blob_hash=blobs.hash) "
+                  "LIMIT :limit FOR UPDATE",
+            values={**values, "limit": limit}
+        )
+        for blob in blobs:
+            await database.execute(query="DELETE FROM blobs WHERE hash=:hash", values={"hash": blob["hash"]})
+            # Bytes are removed while the row is still locked, an upload of the same content waits for the commit
+            # and then writes the blob again
+            for path in [blob["absolute_path"]] + get_derivative_paths(blob["absolute_path"]):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    return len(blobs)
+
+
+def iter_cdn_files(path: str = CDN_FILES_PATH) -> Iterator[os.DirEntry]:
+    # Walks the tree one directory at a time, so even huge trees are never listed in memory at once
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_cdn_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def stored_path_variants(path: str) -> List[str]:
+    # Idea files stored before the blob store have their folder and name joined by "//", e.g. ideas-files/<id>/docs//a
+    return [path, f"{os.path.dirname(path)}//{os.path.basename(path)}"]
+
+
+async def find_referenced_paths(paths: List[str]) -> Set[str]:
+    # Paths of one scanned batch that a row in files or blobs points to. Paths are compared normalized, the rows may
+    # spell the same file differently than the filesystem does.
+    placeholders, values = in_values("path", [variant for path in paths for variant in stored_path_variants(path)])
+    files = await database.fetch_all(
+        query=f"SELECT absolute_path FROM files WHERE absolute_path IN ({placeholders})", values=values
+    )
+    referenced = {os.path.normpath(file["absolute_path"]) for file in files}
+
+    # Blobs and their derivatives are named after the hash of the blob
+    hashes = {os.path.basename(path).split(".")[0] for path in paths}
+    hashes = [blob_hash for blob_hash in hashes if len(blob_hash) == 64]
+    if len(hashes) > 0:
+        placeholders, values = in_values("hash", hashes)
+        blobs = await database.fetch_all(
+            query=f"SELECT absolute_path FROM blobs WHERE hash IN ({placeholders})", values=values
+        )
+        for blob in blobs:
+            # Blobs waiting for the blob collector are still referenced, so are their derivatives
+            referenced.update(
+                os.path.normpath(path) for path in [blob["absolute_path"]] + get_derivative_paths(blob["absolute_path"])
+            )
+    return {path for path in paths if os.path.normpath(path) in referenced}
+
+
+async def collect_orphaned_files(
+        dry_run: bool = True, batch_size: int = CDN_GC_BATCH_SIZE, rate: int = CDN_GC_RATE, report_limit: int = 1000,
+        path: str = CDN_FILES_PATH
+) -> dict:
+    # Removes files in the CDN folder that no row in files or blobs points to. The tree is checked against the
+    # database one batch of files at a time, so neither of them is ever held in memory at once.
+    older_than = time.time() - CDN_ORPHAN_GRACE_PERIOD.total_seconds()
+    report = {
+        "dryRun": dry_run,
+        "scanned": 0,
+        "referenced": 0,
+        "recent": 0,
+        "orphaned": 0,
+        "orphanedBytes": 0,
+        "deleted": 0,
+        "orphans": []
+    }
+
+    async def collect(entries: List[os.DirEntry]):
+        referenced = await find_referenced_paths([entry.path for entry in entries])
+        for entry in entries:
+            report["scanned"] += 1
+            if entry.path in referenced:
+                report["referenced"] += 1
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            # Files that are being uploaded right now are not in the database yet
+            if stat.st_mtime > older_than:
+                report["recent"] += 1
+                continue
+            report["orphaned"] += 1
+            report["orphanedBytes"] += stat.st_size
+            if len(report["orphans"]) < report_limit:
+                report["orphans"].append(entry.path)
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                    report["deleted"] += 1
+                except FileNotFoundError:
+                    pass
+
+    batch = []
+    batch_started = time.monotonic()
+    for entry in iter_cdn_files(path):
+        batch.append(entry)
+        if len(batch) == batch_size:
+            await collect(batch)
+            batch = []
+            # Every batch of filesystem operations takes at least batch_size / rate seconds, so disk I/O stays limited
+            elapsed = time.monotonic() - batch_started
+            await asyncio.sleep(max(0.0, batch_size / rate - elapsed))
+            batch_started = time.monotonic()
+    if len(batch) > 0:
+        await collect(batch)
+    return report
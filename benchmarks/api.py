@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Callable, Awaitable
+
+from benchmarks.common import summarize, save_results, print_table
+from benchmarks.seed import BENCH_PASSWORD, BENCH_PREFIX
+
+# Drives the public API in process through ASGI, so the numbers show the cost of the app and the database only.
+# Run benchmarks.seed first, then e.g. python -m benchmarks.api --db-url sqlite:///bench.db
+
+
+async def run_case(
+        name: str, send: Callable[[int], Awaitable], requests: int, concurrency: int, warmup: int
+) -> dict:
+    for index in range(warmup):
+        try:
+            await send(index)
+        except Exception:
+            pass
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(index: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await send(index)
+            except Exception:
+                # App exceptions are raised through the ASGI transport, they count as failed requests
+                errors += 1
+                return
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*(timed(index) for index in range(requests)))
+    stats = summarize(latencies, errors, time.perf_counter() - started)
+    # Client runs in the same process, so this is an upper bound of the CPU the app spends per request
+    stats["cpu_ms"] = round((time.process_time() - cpu_started) / requests * 1000, 3)
+    print(f'{name}: {stats["rps"]} req/s, p50 {stats["p50_ms"]} ms, p99 {stats["p99_ms"]} ms, '
+          f'{stats["cpu_ms"]} ms of CPU')
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput of the public API")
+    parser.add_argument("--db-url", default=os.environ.get("DB_URL", "sqlite:///bench.db"))
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--cases", default=None, help="comma separated list of cases, all by default")
+    parser.add_argument("--no-cache", action="store_true", help="turn off the response cache of the listings")
+    parser.add_argument("--output", default=None, help="path of the JSON results, benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    # App reads the database location and the cache setting when it is imported
+    os.environ["DB_URL"] = args.db_url
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+    from httpx import AsyncClient
+    from app.main import app
+    from app.database import database
+    from app import authentication as auth
+    from app.models.token import AccessToken
+
+    await app.router.startup()
+    users = await database.fetch_all(
+        query=f"SELECT id, username FROM users WHERE username LIKE '{BENCH_PREFIX}%'"
+    )
+    ideas = [row["id"] for row in await database.fetch_all(
+        query="SELECT ideas.id FROM ideas INNER JOIN users ON ideas.seller_id=users.id "
+              f"WHERE users.username LIKE '{BENCH_PREFIX}%' AND ideas.buyer_id IS NULL"
+    )]
+    downloads = await database.fetch_all(
+        query="SELECT files.id AS file_id, ideas.buyer_id, users.username FROM files "
+              "INNER JOIN ideas ON files.idea_id=ideas.id INNER JOIN users ON ideas.buyer_id=users.id "
+              f"WHERE users.username LIKE '{BENCH_PREFIX}%' AND files.id!=files.idea_id"
+    )
+    if len(users) == 0 or len(ideas) == 0:
+        raise SystemExit("Database has no benchmark data, run python -m benchmarks.seed first")
+
+    tokens = [auth.create_access_token(AccessToken(user_id=user["id"], user=user["username"])) for user in users]
+    download_tokens = [
+        (row["file_id"], auth.create_access_token(AccessToken(user_id=row["buyer_id"], user=row["username"])))
+        for row in downloads
+    ]
+    generator = random.Random(42)
+
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        cases = {
+            "ideas_get_first_page": lambda index: client.get("/ideas/get"),
+            "ideas_get_pages": lambda index: client.get("/ideas/get", params={"page": index % 20}),
+            "ideas_get_category": lambda index: client.get(
+                "/ideas/get", params={"cat": "technology", "page": index % 5}
+            ),
+            "ideas_get_hottest": lambda index: client.get("/ideas/get-hottest"),
+            "ideas_like": lambda index: client.put(
+                "/ideas/like",
+                params={"idea_id": generator.choice(ideas)},
+                headers={"Token": generator.choice(tokens)}
+            ),
+            "auth_login": lambda index: client.post(
+                "/auth/login",
+                json={"username": generator.choice(users)["username"], "pass_hash": BENCH_PASSWORD}
+            ),
+            "files_download": lambda index: client.get(
+                "/files/download",
+                params=dict(zip(("file_id", "token"), download_tokens[index % len(download_tokens)]))
+            )
+        }
+        selected = cases.keys() if args.cases is None else args.cases.split(",")
+
+        results = {}
+        for name in selected:
+            results[name] = await run_case(name, cases[name], args.requests, args.concurrency, args.warmup)
+
+    await app.router.shutdown()
+
+    path = save_results("api", {
+        "settings": {
+            "database": args.db_url.split(":")[0],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "cache": not args.no_cache,
+            "users": len(users),
+            "ideas_for_sale": len(ideas)
+        },
+        "results": results
+    }, args.output)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_table(results, baseline)
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import json
+import math
+import os
+import subprocess
+import time
+from datetime import datetime
+from typing import List, Optional
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    # Nearest rank percentile, samples must be sorted
+    if len(samples) == 0:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, math.ceil(percent / 100 * len(samples)) - 1))
+    return samples[rank]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "rps": round((len(samples) + errors) / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3) if len(samples) != 0 else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3)
+    }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, results: dict, path: Optional[str] = None) -> str:
+    commit = get_commit()
+    results = {"benchmark": name, "commit": commit, "date": datetime.now().isoformat(), **results}
+    if path is None:
+        os.makedirs(RESULTS_PATH, exist_ok=True)
+        path = os.path.join(RESULTS_PATH, f'{name}-{int(time.time())}-{commit or "unknown"}.json')
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+    return path
+
+
+def print_table(results: dict, baseline: Optional[dict] = None):
+    print(f'{"case":<28}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>8}{"cpu ms":>10}')
+    for case, stats in results.items():
+        print(f'{case:<28}{stats["rps"]:>10}{stats["p50_ms"]:>10}{stats["p95_ms"]:>10}'
+              f'{stats["p99_ms"]:>10}{stats["errors"]:>8}{stats.get("cpu_ms", "-"):>10}')
+        if baseline is not None and case in baseline:
+            old = baseline[case]
+            # Positive change in latency and CPU is a regression, in throughput an improvement
+            cpu = change(old["cpu_ms"], stats["cpu_ms"]) if "cpu_ms" in old and "cpu_ms" in stats else "-"
+            print(f'{"  vs baseline":<28}{change(old["rps"], stats["rps"]):>10}{change(old["p50_ms"], stats["p50_ms"]):>10}'
+                  f'{change(old["p95_ms"], stats["p95_ms"]):>10}{change(old["p99_ms"], stats["p99_ms"]):>10}'
+                  f'{"":>8}{cpu:>10}')
+
+
+def change(old: float, new: float) -> str:
+    if old == 0:
+        return "-"
+    return f'{(new - old) / old * 100:+.1f}%'
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+import random
+
+from benchmarks.common import save_results, print_table
+from benchmarks.serialization import build_page, run_case
+
+# Bytes sent for one listing page with each encoding, and the CPU spent to compress it on every request, once when
+# the page is stored in the cache, and on a hit that sends the stored bytes.
+# Run e.g. python -m benchmarks.compression --pages 2000, --size 200 gives a page as large as the admin lists.
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bandwidth and CPU cost of compressing a listing page")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=10, help="ideas on a page")
+    parser.add_argument("--output", default=None, help="path of the JSON results, benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    from starlette.requests import Request
+    from app.cache import encode_page, compress_page, page_response
+    from app.compression import ENCODINGS, compress
+    from app.config import COMPRESSION_LEVELS, CACHE_COMPRESSION_LEVELS
+
+    page = compress_page(encode_page(build_page(random.Random(42), args.size)))
+    print(f"identity: {len(page.body)} bytes")
+
+    def request(encoding: str) -> Request:
+        return Request({"type": "http", "headers": [(b"accept-encoding", encoding.encode())]})
+
+    def case(render, pages: int, sent: int):
+        async def run(name: str) -> dict:
+            stats = await run_case(name, render, pages)
+            stats["bytes"] = sent
+            stats["ratio"] = round(sent / len(page.body), 3)
+            return stats
+        return run
+
+    async def identity_hit():
+        page_response(request("identity"), page, "Hit")
+
+    cases = {"identity_hit": case(identity_hit, args.pages, len(page.body))}
+    for encoding in ENCODINGS:
+        dynamic = compress(page.body, encoding, COMPRESSION_LEVELS[encoding])
+
+        async def per_request(encoding=encoding):
+            # Uncached response, the middleware compresses it for every client
+            compress(page.body, encoding, COMPRESSION_LEVELS[encoding])
+
+        async def stored(encoding=encoding):
+            # Paid once per refresh of the page, the higher level makes it a bit smaller
+            compress(page.body, encoding, CACHE_COMPRESSION_LEVELS[encoding])
+
+        async def hit(encoding=encoding):
+            page_response(request(encoding), page, "Hit")
+
+        # High levels are slow, a tenth of the pages is enough to see their cost
+        cases[f"{encoding}_per_request"] = case(per_request, args.pages, len(dynamic))
+        cases[f"{encoding}_stored"] = case(stored, max(1, args.pages // 10), len(page.encoded[encoding]))
+        cases[f"{encoding}_hit"] = case(hit, args.pages, len(page.encoded[encoding]))
+
+    results = {}
+    for name, run in cases.items():
+        results[name] = await run(name)
+        print(f'  {results[name]["bytes"]} bytes, {results[name]["ratio"]} of the JSON')
+
+    path = save_results("compression", {
+        "settings": {"pages": args.pages, "size": args.size, "bytes": len(page.body), "encodings": ENCODINGS},
+        "results": results
+    }, args.output)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_table(results, baseline)
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import summarize, save_results, print_table
+
+# Cost of one rate limit check, which every limited request pays before its handler runs.
+# Run e.g. python -m benchmarks.ratelimit --requests 10000, the Redis case needs REDIS_URL to point to a server.
+
+POLICY = "bench"
+
+
+async def run_case(name: str, check, requests: int, identities: int) -> dict:
+    latencies = []
+    limited = 0
+    started = time.perf_counter()
+    for index in range(requests):
+        begin = time.perf_counter()
+        wait = await check(f"client{index % identities}")
+        latencies.append(time.perf_counter() - begin)
+        if wait > 0:
+            limited += 1
+    stats = summarize(latencies, 0, time.perf_counter() - started)
+    # Refused requests are not errors here, the check did its job
+    stats["limited"] = limited
+    print(f'{name}: {stats["rps"]} checks/s, p50 {stats["p50_ms"]} ms, p99 {stats["p99_ms"]} ms, {limited} limited')
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Overhead of the rate limiter per request")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--identities", type=int, default=100, help="number of distinct clients")
+    parser.add_argument("--limit", type=int, default=50, help="requests allowed per client in the window")
+    parser.add_argument("--window", type=int, default=60)
+    parser.add_argument("--cases", default=None, help="comma separated list of cases, all by default")
+    parser.add_argument("--output", default=None, help="path of the JSON results, benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    from app import ratelimit
+    ratelimit.RATE_LIMITS[POLICY] = (args.limit, args.window)
+
+    async def local(identity: str) -> float:
+        return ratelimit.local_window.hit(
+            ratelimit.RATE_LIMIT_KEY.format(policy=POLICY, identity=identity), args.limit, args.window, time.time()
+        )
+
+    async def shared(identity: str) -> float:
+        return await ratelimit.hit(POLICY, identity)
+
+    cases = {"local": local, "redis": shared}
+    selected = cases.keys() if args.cases is None else args.cases.split(",")
+
+    results = {}
+    for name in selected:
+        if name == "redis":
+            # Without Redis the check would quietly measure the in-process fallback
+            try:
+                await ratelimit.get_script()(keys=[f"cc-ratelimit:{POLICY}:probe"], args=[0, 1, 1, "probe"])
+            except Exception as error:
+                print(f"Skipping redis, it is not available: {error}")
+                continue
+        results[name] = await run_case(name, cases[name], args.requests, args.identities)
+
+    path = save_results("ratelimit", {
+        "settings": {
+            "requests": args.requests,
+            "identities": args.identities,
+            "limit": args.limit,
+            "window": args.window
+        },
+        "results": results
+    }, args.output)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_table(results, baseline)
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
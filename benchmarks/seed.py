@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+from datetime import datetime, timedelta
+
+from databases import Database
+
+# Synthetic users, ideas, likes and files for the benchmarks. Every user has the same password, so logins can be
+# benchmarked with any of them, and all rows are recognised by the "bench" username prefix.
+BENCH_PASSWORD = hashlib.sha3_256("bench-password".encode('utf-8')).hexdigest()
+BENCH_PREFIX = "bench"
+CATEGORIES = ["technology", "business", "art", "music", "education", "health", "games", "food"]
+
+# Minimal schema for the SQLite stand-in, a MariaDB database gets schema.sql and migrations/ instead
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, verified INTEGER DEFAULT 0, "
+    "first_name TEXT NOT NULL, last_name TEXT NOT NULL, email TEXT NOT NULL UNIQUE, username TEXT NOT NULL UNIQUE, "
+    "salt TEXT NOT NULL, pass_hash TEXT NOT NULL, iban TEXT NOT NULL, "
+    "date_register DATETIME DEFAULT CURRENT_TIMESTAMP, date_login DATETIME, avatar_id TEXT)",
+    "CREATE TABLE IF NOT EXISTS ideas (id TEXT PRIMARY KEY, seller_id INTEGER NOT NULL, buyer_id INTEGER, "
+    "title TEXT NOT NULL, short_desc TEXT NOT NULL, long_desc TEXT NOT NULL, date_publish DATETIME NOT NULL, "
+    "date_expiry DATETIME NOT NULL, date_bought DATETIME, date_archived DATETIME, price REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ideas_listed ON ideas (buyer_id, date_archived, date_expiry)",
+    "CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, "
+    "ideas_count INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS ideas_categories (idea_id TEXT NOT NULL, category_id INTEGER NOT NULL, "
+    "PRIMARY KEY (idea_id, category_id))",
+    "CREATE INDEX IF NOT EXISTS ideas_categories_category_id ON ideas_categories (category_id)",
+    "CREATE TABLE IF NOT EXISTS ideas_likes (idea_id TEXT NOT NULL, user_id INTEGER NOT NULL, "
+    "PRIMARY KEY (idea_id, user_id))",
+    "CREATE TABLE IF NOT EXISTS files (id TEXT PRIMARY KEY, idea_id TEXT, blob_hash TEXT, name TEXT NOT NULL, "
+    "size INTEGER NOT NULL, absolute_path TEXT NOT NULL, public_path TEXT NOT NULL, content_type TEXT NOT NULL, "
+    "upload_date DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+    "refcount INTEGER NOT NULL DEFAULT 0, absolute_path TEXT NOT NULL, public_path TEXT NOT NULL, "
+    "thumbnail_url TEXT, webp_url TEXT, date_created DATETIME DEFAULT CURRENT_TIMESTAMP, "
+    "date_modified DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE IF NOT EXISTS payments (id TEXT NOT NULL, amount NUMERIC NOT NULL, currency TEXT NOT NULL, "
+    "idea_id TEXT NOT NULL UNIQUE, user_id INTEGER NOT NULL, country TEXT, last4 TEXT, network TEXT, "
+    "date DATETIME DEFAULT CURRENT_TIMESTAMP, status TEXT NOT NULL, client_secret TEXT, receipt_url TEXT, "
+    "PRIMARY KEY (id, idea_id))",
+    "CREATE TABLE IF NOT EXISTS payouts (user_id INTEGER NOT NULL, idea_id TEXT PRIMARY KEY, "
+    "date DATETIME DEFAULT CURRENT_TIMESTAMP, date_paid DATETIME, status TEXT NOT NULL DEFAULT 'created')"
+]
+
+
+def get_idea_id(index: int) -> str:
+    return hashlib.sha256(f"{BENCH_PREFIX}-idea-{index}".encode('utf-8')).hexdigest()
+
+
+async def reset(database: Database):
+    users = f"SELECT id FROM users WHERE username LIKE '{BENCH_PREFIX}%'"
+    ideas = f"SELECT id FROM ideas WHERE seller_id IN ({users})"
+    for table in ["ideas_categories", "ideas_likes", "files"]:
+        await database.execute(f"DELETE FROM {table} WHERE idea_id IN ({ideas})")
+    await database.execute(f"DELETE FROM ideas WHERE seller_id IN ({users})")
+    await database.execute(f"DELETE FROM users WHERE username LIKE '{BENCH_PREFIX}%'")
+
+
+async def seed(
+        database: Database, users: int, ideas: int, likes: int, files_path: str, seed_value: int, expired: int = 0
+) -> dict:
+    # Import is delayed, so the app configuration is only needed when data is actually seeded
+    from app import authentication as auth
+    from app.categories import RECOUNT_CATEGORIES_QUERY
+
+    generator = random.Random(seed_value)
+    now = datetime.now()
+
+    if database.url.dialect == "sqlite":
+        for statement in SQLITE_SCHEMA:
+            await database.execute(statement)
+    await reset(database)
+
+    # Hashing the password takes a while with bcrypt, it is done once and shared by all users
+    salt = auth.generate_salt()
+    pass_hash = auth.hash_password(BENCH_PASSWORD, salt)
+    await database.execute_many(
+        query="INSERT INTO users(verified, first_name, last_name, email, username, salt, pass_hash, iban) "
+              "VALUES(1, :first_name, :last_name, :email, :username, :salt, :pass_hash, :iban)",
+        values=[{
+            "first_name": "Bench",
+            "last_name": f"User{index}",
+            "email": f"{BENCH_PREFIX}{index}@example.com",
+            "username": f"{BENCH_PREFIX}{index}",
+            "salt": salt,
+            "pass_hash": pass_hash,
+            "iban": "BG80BNBG96611020345678"
+        } for index in range(users)]
+    )
+    user_ids = [row["id"] for row in await database.fetch_all(
+        query=f"SELECT id FROM users WHERE username LIKE '{BENCH_PREFIX}%' ORDER BY id"
+    )]
+
+    idea_rows = []
+    for index in range(ideas + expired):
+        date_publish = now - timedelta(minutes=generator.randint(0, 60 * 24 * 30))
+        # Ideas after the first ones are history, they expired up to two years ago and the worker archived them
+        archived = index >= ideas
+        if archived:
+            date_publish = now - timedelta(days=generator.randint(32, 730))
+        # Every tenth idea is sold, so it has a buyer and downloadable files
+        sold = index % 10 == 0
+        idea_rows.append({
+            "id": get_idea_id(index),
+            "seller_id": generator.choice(user_ids),
+            "buyer_id": generator.choice(user_ids) if sold else None,
+            "title": f"Benchmark idea number {index}",
+            "short_desc": "Short description of the idea, repeated to get a realistic size. " * 3,
+            "long_desc": "Long description of the idea, the part that is sold. " * 200,
+            "date_publish": date_publish,
+            "date_expiry": date_publish + timedelta(days=31),
+            "date_bought": now if sold else None,
+            "date_archived": date_publish + timedelta(days=31) if archived and not sold else None,
+            "price": round(generator.uniform(1, 500), 2)
+        })
+    await database.execute_many(
+        query="INSERT INTO ideas(id, seller_id, buyer_id, title, short_desc, long_desc, date_publish, date_expiry, "
+              "date_bought, date_archived, price) VALUES(:id, :seller_id, :buyer_id, :title, :short_desc, :long_desc, "
+              ":date_publish, :date_expiry, :date_bought, :date_archived, :price)",
+        values=idea_rows
+    )
+
+    # Categories are shared with earlier runs, only the missing ones are added
+    existing = {row["name"] for row in await database.fetch_all("SELECT name FROM categories")}
+    await database.execute_many(
+        query="INSERT INTO categories(name) VALUES(:name)",
+        values=[{"name": name} for name in CATEGORIES if name not in existing]
+    )
+    category_ids = {row["name"]: row["id"] for row in await database.fetch_all("SELECT id, name FROM categories")}
+    await database.execute_many(
+        query="INSERT INTO ideas_categories(idea_id, category_id) VALUES(:idea_id, :category_id)",
+        values=[
+            {"idea_id": idea["id"], "category_id": category_ids[category]}
+            for idea in idea_rows for category in generator.sample(CATEGORIES, generator.randint(1, 3))
+        ]
+    )
+    await database.execute(RECOUNT_CATEGORIES_QUERY)
+
+    like_pairs = set()
+    while len(like_pairs) < min(likes, users * ideas):
+        like_pairs.add((generator.choice(idea_rows)["id"], generator.choice(user_ids)))
+    await database.execute_many(
+        query="INSERT INTO ideas_likes(idea_id, user_id) VALUES(:idea_id, :user_id)",
+        values=[{"idea_id": idea_id, "user_id": user_id} for idea_id, user_id in like_pairs]
+    )
+
+    # Title image for every idea, one real file on disk for every sold idea
+    os.makedirs(files_path, exist_ok=True)
+    file_rows = []
+    downloads = []
+    for idea in idea_rows:
+        file_rows.append({
+            "id": idea["id"],
+            "idea_id": idea["id"],
+            "name": "title.png",
+            "size": 1024,
+            "absolute_path": os.path.join(files_path, "title.png"),
+            "public_path": f"https://cdn.example.com/{idea['id']}.png",
+            "content_type": "image/png"
+        })
+        if idea["buyer_id"] is not None:
+            file_id = hashlib.sha256(f"{idea['id']}-file".encode('utf-8')).hexdigest()
+            absolute_path = os.path.join(files_path, f"{file_id}.pdf")
+            with open(absolute_path, "wb") as file:
+                file.write(os.urandom(64 * 1024))
+            file_rows.append({
+                "id": file_id,
+                "idea_id": idea["id"],
+                "name": "idea.pdf",
+                "size": 64 * 1024,
+                "absolute_path": absolute_path,
+                "public_path": f"https://cdn.example.com/{file_id}.pdf",
+                "content_type": "application/pdf"
+            })
+            downloads.append({"file_id": file_id, "user_id": idea["buyer_id"]})
+    await database.execute_many(
+        query="INSERT INTO files(id, idea_id, name, size, absolute_path, public_path, content_type) "
+              "VALUES(:id, :idea_id, :name, :size, :absolute_path, :public_path, :content_type)",
+        values=file_rows
+    )
+
+    return {
+        "users": user_ids,
+        "ideas": [idea["id"] for idea in idea_rows if idea["buyer_id"] is None and idea["date_archived"] is None],
+        "downloads": downloads
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Seed a database with synthetic data for the benchmarks")
+    parser.add_argument("--db-url", default=os.environ.get("DB_URL", "sqlite:///bench.db"))
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ideas", type=int, default=2000)
+    parser.add_argument("--likes", type=int, default=20000)
+    parser.add_argument("--files-path", default="bench-files")
+    parser.add_argument("--expired", type=int, default=0, help="archived ideas in addition to the ones for sale")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    database = Database(args.db_url)
+    await database.connect()
+    seeded = await seed(database, args.users, args.ideas, args.likes, args.files_path, args.seed, args.expired)
+    await database.disconnect()
+    print(f'Seeded {len(seeded["users"])} users, {args.ideas} ideas, {args.expired} expired ideas, {args.likes} likes '
+          f'and {len(seeded["downloads"])} downloadable files')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
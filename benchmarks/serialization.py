@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import summarize, save_results, print_table
+
+# CPU spent turning one page of /ideas/get into the bytes that are sent, by the ways a response can be produced.
+# Run e.g. python -m benchmarks.serialization --pages 2000
+
+
+def build_page(generator: random.Random, size: int):
+    from app.models.idea import IdeaPartial
+    from app.responses.ideas import IdeasList
+
+    now = datetime.now()
+    return IdeasList(countLeft=1000, ideas=[IdeaPartial(
+        id=f"{index:064x}",
+        sellerID=generator.randint(1, 200),
+        title=f"Benchmark idea number {index}",
+        likes=generator.randint(0, 500),
+        imageURL=f"https://cdn.example.com/{index:064x}.png",
+        thumbnailURL=f"https://cdn.example.com/{index:064x}.thumbnail.webp",
+        imageWebpURL=f"https://cdn.example.com/{index:064x}.webp.webp",
+        shortDesc="Short description of the idea, repeated to get a realistic size. " * 3,
+        datePublish=now,
+        dateExpiry=now + timedelta(days=31),
+        categories=generator.sample(["technology", "business", "art", "music", "education"], 2),
+        price=round(generator.uniform(1, 500), 2)
+    ) for index in range(size)]).dict()
+
+
+async def run_case(name: str, render, pages: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for _ in range(pages):
+        begin = time.perf_counter()
+        await render()
+        latencies.append(time.perf_counter() - begin)
+    stats = summarize(latencies, 0, time.perf_counter() - started)
+    stats["cpu_ms"] = round((time.process_time() - cpu_started) / pages * 1000, 4)
+    print(f'{name}: {stats["rps"]} pages/s, {stats["cpu_ms"]} ms of CPU per page')
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="CPU cost of serializing a listing page")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=10, help="ideas on a page")
+    parser.add_argument("--output", default=None, help="path of the JSON results, benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from starlette.requests import Request
+    from app.cache import encode_page, page_response
+    from app.responses.ideas import IdeasList
+
+    content = build_page(random.Random(42), args.size)
+    field = create_response_field("Response_get_ideas", IdeasList)
+    page = encode_page(content)
+    request = Request({"type": "http", "headers": []})
+
+    async def response_model():
+        # Uncached route, the returned dict is validated against response_model and encoded by FastAPI
+        JSONResponse(content=await serialize_response(field=field, response_content=content))
+
+    async def json_dumps():
+        # Miss before the pages were serialized with orjson
+        json.dumps(jsonable_encoder(content)).encode()
+
+    async def orjson_miss():
+        encode_page(content)
+
+    async def cached_hit():
+        page_response(request, page, "Hit")
+
+    cases = {
+        "response_model": response_model,
+        "json_dumps": json_dumps,
+        "orjson_miss": orjson_miss,
+        "cached_hit": cached_hit
+    }
+    results = {name: await run_case(name, render, args.pages) for name, render in cases.items()}
+
+    path = save_results("serialization", {
+        "settings": {"pages": args.pages, "size": args.size, "bytes": len(page.body)},
+        "results": results
+    }, args.output)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_table(results, baseline)
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
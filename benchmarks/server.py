@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks.common import summarize, save_results, print_table
+
+# Starts the production server with each configuration and drives it over TCP, so the numbers include the workers,
+# the event loop and the HTTP parser. Memory is the proportional set size of the master and its workers, pages shared
+# by the preloaded app are split between them.
+# Run benchmarks.seed first, then e.g. python -m benchmarks.server --db-url sqlite:///bench.db
+# One client process can keep only a few workers busy, on a machine with many CPUs the client limits the throughput.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    "one_worker": {"SERVER_WORKERS": "1"},
+    "per_cpu": {},
+    "no_preload": {"SERVER_PRELOAD": "false"},
+    "asyncio_h11": {"SERVER_LOOP": "asyncio", "SERVER_HTTP": "h11"}
+}
+
+CASES = {
+    "pages": lambda index: ("/ideas/get", {"page": index % 20}),
+    "hottest": lambda index: ("/ideas/get-hottest", {})
+}
+
+
+def parse_config(value: str) -> Tuple[str, Dict[str, str]]:
+    # name:SERVER_WORKERS=4,SERVER_LOOP=asyncio
+    name, _, settings = value.partition(":")
+    return name, dict(setting.split("=", 1) for setting in settings.split(",") if setting != "")
+
+
+def server_processes(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            return [pid] + [int(child) for child in file.read().split()]
+    except OSError:
+        return [pid]
+
+
+def memory_mb(pids: List[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as file:
+                total += next(int(line.split()[1]) for line in file if line.startswith("Pss:"))
+        except (OSError, StopIteration):
+            pass
+    return round(total / 1024, 1)
+
+
+def cpu_seconds(pids: List[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as file:
+                # Fields after the command name, which may contain spaces, utime and stime are the 12th and 13th
+                fields = file.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError):
+            pass
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+async def wait_until_ready(client, process: subprocess.Popen, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with {process.returncode}")
+        try:
+            if (await client.get("/ideas/get-hottest")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("Server did not start")
+
+
+async def run_case(client, name: str, case, requests: int, concurrency: int, pids: List[int]) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(index: int):
+        nonlocal errors
+        path, params = case(index)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path, params=params)
+            except Exception:
+                errors += 1
+                return
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    cpu_started = cpu_seconds(pids)
+    await asyncio.gather(*(timed(index) for index in range(requests)))
+    stats = summarize(latencies, errors, time.perf_counter() - started)
+    stats["cpu_ms"] = round((cpu_seconds(pids) - cpu_started) / requests * 1000, 3)
+    print(f'{name}: {stats["rps"]} req/s, p50 {stats["p50_ms"]} ms, p99 {stats["p99_ms"]} ms, '
+          f'{stats["cpu_ms"]} ms of server CPU')
+    return stats
+
+
+async def run_config(name: str, settings: Dict[str, str], args) -> dict:
+    from httpx import AsyncClient, Limits
+
+    env = {
+        **os.environ,
+        "DB_URL": args.db_url,
+        "SERVER_PORT": str(args.port),
+        "SERVER_PIDFILE": os.path.join(tempfile.gettempdir(), f"creativitycrop-bench-{args.port}.pid"),
+        **settings
+    }
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    results = {}
+    try:
+        limits = Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits) as client:
+            await wait_until_ready(client, process, args.timeout)
+            # Workers finish booting after the first one answers
+            await asyncio.sleep(1)
+            pids = server_processes(process.pid)
+            for index in range(args.warmup):
+                path, params = CASES["pages"](index)
+                await client.get(path, params=params)
+            for case_name, case in CASES.items():
+                stats = await run_case(
+                    client, f"{name}/{case_name}", case, args.requests, args.concurrency, pids
+                )
+                stats["workers"] = len(pids) - 1
+                stats["memory_mb"] = memory_mb(pids)
+                results[f"{name}/{case_name}"] = stats
+            print(f"{name}: {len(pids) - 1} workers, {memory_mb(pids)} MB")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Throughput, latency and memory of server configurations")
+    parser.add_argument("--db-url", default=os.environ.get("DB_URL", "sqlite:///bench.db"))
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a server to start")
+    parser.add_argument("--configs", default=None, help="comma separated list of configurations, all by default")
+    parser.add_argument(
+        "--config", action="append", default=[], type=parse_config,
+        help="extra configuration, e.g. two_workers:SERVER_WORKERS=2,SERVER_LOOP=asyncio"
+    )
+    parser.add_argument("--output", default=None, help="path of the JSON results, benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    configs = dict(CONFIGS)
+    if args.configs is not None:
+        configs = {name: configs[name] for name in args.configs.split(",")}
+    configs.update(args.config)
+
+    results = {}
+    for name, settings in configs.items():
+        results.update(await run_config(name, settings, args))
+
+    path = save_results("server", {
+        "settings": {
+            "database": args.db_url.split(":")[0],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "cpus": len(os.sched_getaffinity(0)),
+            "configs": configs
+        },
+        "results": results
+    }, args.output)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_table(results, baseline)
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Dict
+
+from benchmarks.common import save_results, change
+
+# Time a new worker spends importing the app before it can answer, and the modules it is spent on. Every run is a
+# new interpreter, like a worker started by the server or one that replaces a crashed one.
+# Run e.g. python -m benchmarks.startup --runs 10 --top 30
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_start(module: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+    return time.perf_counter() - started
+
+
+def import_profile(module: str) -> List[Dict]:
+    # Lines of -X importtime are "import time: self | cumulative | name", nested imports are indented and come
+    # before the module that imported them
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, check=True, capture_output=True,
+        text=True
+    ).stderr
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(own) / 1000,
+            "cumulative_ms": int(cumulative) / 1000
+        })
+    return modules
+
+
+def by_package(modules: List[Dict]) -> Dict[str, float]:
+    # Own time of all modules of a top level package, e.g. everything fastapi brings in that is not imported elsewhere
+    packages = {}
+    for module in modules:
+        package = module["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + module["self_ms"]
+    return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of the app and the imports it is spent on")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=25, help="modules and packages listed in the report")
+    parser.add_argument("--budget", type=float, default=None, help="seconds, exits with 1 when the median is above")
+    parser.add_argument("--output", default=None, help="path of the JSON results, benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    # First run reads the files from disk and writes the bytecode, it is not a cold start of a deployed worker
+    cold_start(args.module)
+    samples = sorted(cold_start(args.module) for _ in range(args.runs))
+    modules = import_profile(args.module)
+    packages = by_package(modules)
+    results = {
+        "median_s": round(statistics.median(samples), 3),
+        "min_s": round(samples[0], 3),
+        "max_s": round(samples[-1], 3),
+        "imported_modules": len(modules)
+    }
+
+    print(f'{"module":<48}{"self ms":>10}{"total ms":>10}')
+    for module in sorted(modules, key=lambda module: -module["cumulative_ms"])[:args.top]:
+        name = "  " * module["depth"] + module["module"]
+        print(f'{name[:47]:<48}{module["self_ms"]:>10.1f}{module["cumulative_ms"]:>10.1f}')
+    print()
+    print(f'{"package":<48}{"self ms":>10}')
+    for package, own in list(packages.items())[:args.top]:
+        print(f'{package:<48}{own:>10.1f}')
+    print()
+    print(f'Cold start of {args.module}: median {results["median_s"]} s, min {results["min_s"]} s, '
+          f'max {results["max_s"]} s, {results["imported_modules"]} modules')
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        print(f'  vs baseline: median {change(baseline["median_s"], results["median_s"])}, '
+              f'{results["imported_modules"] - baseline["imported_modules"]:+} modules')
+
+    path = save_results("startup", {
+        "settings": {"module": args.module, "runs": args.runs, "python": sys.version.split()[0]},
+        "results": results,
+        "packages": {package: round(own, 3) for package, own in packages.items()}
+    }, args.output)
+    print(f"Results saved to {path}")
+
+    if args.budget is not None and results["median_s"] > args.budget:
+        raise SystemExit(f'Cold start of {results["median_s"]} s is over the budget of {args.budget} s')
+
+
+if __name__ == "__main__":
+    main()
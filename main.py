@@ -1,20 +1,28 @@
 import sys
-import logging
 import uvicorn
 from uvicorn.config import LOGGING_CONFIG
 
 
 if __name__ == "__main__":
-    LOGGING_CONFIG["formatters"]["default"]["fmt"] = "%(asctime)s %(levelprefix)s %(message)s"
-    LOGGING_CONFIG["formatters"]["access"][
-        "fmt"] = '%(asctime)s %(levelprefix)s %(client_addr)s - "%(request_line)s" %(status_code)s'
+    if "dev" in sys.argv:
+        # Single process that restarts on code changes, gunicorn does not run on Windows
+        LOGGING_CONFIG["formatters"]["default"]["fmt"] = "%(asctime)s %(levelprefix)s %(message)s"
+        LOGGING_CONFIG["formatters"]["access"][
+            "fmt"] = '%(asctime)s %(levelprefix)s %(client_addr)s - "%(request_line)s" %(status_code)s'
 
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True if "dev" in sys.argv else False,
-        root_path="/api",
-        workers=2
-    )
+        uvicorn.run(
+            "app.main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True,
+            root_path="/api"
+        )
+    else:
+        from app import server
 
+        if "reload" in sys.argv:
+            server.reload_workers()
+        elif "upgrade" in sys.argv:
+            server.upgrade()
+        else:
+            server.run()
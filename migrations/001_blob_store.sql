@@ -0,0 +1,17 @@
+-- Content addressed storage for uploaded files, every blob is stored once and referenced by files.blob_hash
+
+CREATE TABLE IF NOT EXISTS `blobs` (
+  `hash` char(64) NOT NULL,
+  `size` int(11) NOT NULL,
+  `refcount` int(11) NOT NULL DEFAULT 0,
+  `absolute_path` text NOT NULL,
+  `public_path` text NOT NULL,
+  `date_created` datetime DEFAULT current_timestamp(),
+  `date_modified` datetime DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`hash`),
+  KEY `refcount` (`refcount`, `date_modified`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+ALTER TABLE `files`
+  ADD COLUMN `blob_hash` char(64) DEFAULT NULL AFTER `idea_id`,
+  ADD KEY `blob_hash` (`blob_hash`);
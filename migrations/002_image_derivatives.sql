@@ -0,0 +1,5 @@
+-- Public URLs of the resized WebP variants rendered for title images and avatars
+
+ALTER TABLE `blobs`
+  ADD COLUMN `thumbnail_url` text DEFAULT NULL AFTER `public_path`,
+  ADD COLUMN `webp_url` text DEFAULT NULL AFTER `thumbnail_url`;
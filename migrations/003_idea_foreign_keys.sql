@@ -0,0 +1,16 @@
+-- Rows that belong to an idea are deleted together with it. Files are left out on purpose, their blobs are reference
+-- counted by the application (see app/internal/cascade.py), which deletes them explicitly.
+
+DELETE FROM `ideas_categories` WHERE `idea_id` NOT IN (SELECT `id` FROM `ideas`);
+DELETE FROM `ideas_likes` WHERE `idea_id` NOT IN (SELECT `id` FROM `ideas`);
+DELETE FROM `payments` WHERE `idea_id` NOT IN (SELECT `id` FROM `ideas`);
+DELETE FROM `payouts` WHERE `idea_id` NOT IN (SELECT `id` FROM `ideas`);
+
+ALTER TABLE `ideas_categories`
+  ADD CONSTRAINT `ideas_categories_idea` FOREIGN KEY (`idea_id`) REFERENCES `ideas` (`id`) ON DELETE CASCADE;
+ALTER TABLE `ideas_likes`
+  ADD CONSTRAINT `ideas_likes_idea` FOREIGN KEY (`idea_id`) REFERENCES `ideas` (`id`) ON DELETE CASCADE;
+ALTER TABLE `payments`
+  ADD CONSTRAINT `payments_idea` FOREIGN KEY (`idea_id`) REFERENCES `ideas` (`id`) ON DELETE CASCADE;
+ALTER TABLE `payouts`
+  ADD CONSTRAINT `payouts_idea` FOREIGN KEY (`idea_id`) REFERENCES `ideas` (`id`) ON DELETE CASCADE;
@@ -0,0 +1,5 @@
+-- Client secret of the Stripe payment intent is saved when the payment is created, so it can be shown without a
+-- request to Stripe
+
+ALTER TABLE `payments`
+  ADD COLUMN `client_secret` varchar(255) DEFAULT NULL AFTER `status`;
@@ -0,0 +1,37 @@
+-- Categories get their own table with integer ids and the number of ideas for sale in each. The listings filter on
+-- the exact category id through an index, and /ideas/categories reads the counts instead of counting.
+-- Names are stored trimmed and in lower case, the application does the same with new ones.
+
+CREATE TABLE IF NOT EXISTS `categories` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `name` varchar(100) NOT NULL,
+  `ideas_count` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `name` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT IGNORE INTO `categories` (`name`) SELECT DISTINCT LOWER(TRIM(`category`)) FROM `ideas_categories`;
+
+ALTER TABLE `ideas_categories`
+  ADD COLUMN `category_id` int(11) DEFAULT NULL AFTER `idea_id`;
+UPDATE `ideas_categories` JOIN `categories` ON `categories`.`name` = LOWER(TRIM(`ideas_categories`.`category`))
+  SET `ideas_categories`.`category_id` = `categories`.`id`;
+
+-- Same category written differently on one idea becomes one row
+DELETE `duplicate` FROM `ideas_categories` AS `duplicate`
+  JOIN `ideas_categories` AS `kept` ON `kept`.`idea_id` = `duplicate`.`idea_id`
+    AND `kept`.`category_id` = `duplicate`.`category_id` AND `kept`.`category` < `duplicate`.`category`;
+
+-- Secondary index on category_id also holds the primary key, so the filter reads the idea ids from it alone
+ALTER TABLE `ideas_categories`
+  DROP PRIMARY KEY,
+  DROP COLUMN `category`,
+  MODIFY `category_id` int(11) NOT NULL,
+  ADD PRIMARY KEY (`idea_id`, `category_id`),
+  ADD KEY `category_id` (`category_id`),
+  ADD CONSTRAINT `ideas_categories_category` FOREIGN KEY (`category_id`) REFERENCES `categories` (`id`);
+
+UPDATE `categories` SET `ideas_count` = (
+  SELECT COUNT(*) FROM `ideas_categories` JOIN `ideas` ON `ideas`.`id` = `ideas_categories`.`idea_id`
+  WHERE `ideas_categories`.`category_id` = `categories`.`id` AND `ideas`.`buyer_id` IS NULL
+);
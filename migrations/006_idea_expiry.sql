@@ -0,0 +1,7 @@
+-- Expired ideas leave the listings, the worker archives them later and takes them out of the category counts.
+-- The listings and the worker look up ideas for sale by their expiry date through the same index, so their cost
+-- depends on the ideas for sale, not on every idea ever posted.
+
+ALTER TABLE `ideas`
+  ADD COLUMN `date_archived` datetime DEFAULT NULL AFTER `date_bought`,
+  ADD KEY `listed` (`buyer_id`, `date_archived`, `date_expiry`);
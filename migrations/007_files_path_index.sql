@@ -0,0 +1,5 @@
+-- The collector of orphaned files looks up every batch of scanned files by its path, the prefix index keeps each
+-- lookup from reading the whole files table.
+
+ALTER TABLE `files`
+  ADD KEY `absolute_path` (`absolute_path`(255));
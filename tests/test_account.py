@@ -46,6 +46,22 @@ async def test_bought_ideas():
     await database.disconnect()
 
 
+@pytest.mark.asyncio
+async def test_bought_ideas_fields():
+    await database.connect()
+    async with AsyncClient(app=router, base_url="http://test") as ac:
+        response = await ac.get(
+            "/account/ideas/bought",
+            params={"fields": "categories"},
+            headers={"Token": token}
+        )
+        assert response.status_code == 200
+        ideas = BoughtIdeas.parse_obj(response.json()).ideas
+        # Heavy fields are not loaded unless asked for
+        assert all(idea.longDesc is None and idea.files is None for idea in ideas)
+    await database.disconnect()
+
+
 @pytest.mark.asyncio
 async def test_sold_ideas():
     await database.connect()
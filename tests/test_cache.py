@@ -0,0 +1,103 @@
+import glob
+from datetime import datetime
+from decimal import Decimal
+from fnmatch import fnmatch
+from typing import Optional
+
+from starlette.requests import Request
+
+from app.cache import (
+    get_cache_key, encode_page, compress_page, page_response, etag_matches, LISTING_KEYS, LocalCache, cached_response,
+    encode_call, decode_call
+)
+from app.compression import ENCODINGS
+
+
+async def get_ideas(page: Optional[int] = 0, cat: Optional[str] = None):
+    pass
+
+
+get_ideas.__module__ = "app.routers.ideas"
+
+
+@cached_response(expire=60)
+async def get_page(page: Optional[int] = 0, cat: Optional[str] = None):
+    pass
+
+
+def test_listing_cache_key():
+    key = get_cache_key(get_ideas, page=2)
+    # Defaults are part of the key, so the same page always maps to the same entry
+    assert key == get_cache_key(get_ideas, page=2, cat=None)
+    assert key.endswith("get_ideas(page=2,cat=None)")
+    assert any(fnmatch(key, pattern) for pattern in LISTING_KEYS)
+
+
+def test_counted_call():
+    member = encode_call(get_page.__wrapped__, (), {"cat": "art"})
+    # Defaults are filled in, so a page is counted once however it was requested
+    assert member == encode_call(get_page.__wrapped__, (), {"page": 0, "cat": "art"})
+    key, func, kwargs, expire = decode_call(member)
+    assert key == get_cache_key(get_page.__wrapped__, cat="art")
+    assert (func, kwargs, expire) == (get_page.__wrapped__, {"cat": "art", "page": 0}, 60)
+    # Routes removed since their pages were counted are not warmed
+    assert decode_call(b'{"func":"app.routers.ideas.removed","kwargs":{}}') is None
+
+
+def test_local_cache():
+    local = LocalCache(size=2)
+    local.set("a", encode_page({}), expires=10)
+    # Nothing is kept while the worker does not listen for invalidations
+    assert local.get("a", now=0) is None
+    local.active = True
+    for key in ("a", "b", "c"):
+        local.set(f"cc-page:{key}", encode_page({"key": key}), expires=10)
+    assert local.get("cc-page:a", now=0) is None
+    assert local.get("cc-page:b", now=0).body == b'{"key":"b"}'
+    assert local.get("cc-page:b", now=10) is None
+    local.invalidate("cc-page:*")
+    assert len(local.entries) == 0
+
+
+def test_local_cache_invalidate_key():
+    local = LocalCache(size=4)
+    local.active = True
+    keys = [get_cache_key(get_ideas, cat=cat) for cat in ("art", "[art]", "a*")]
+    for key in keys:
+        local.set(key, encode_page({}), expires=10)
+    # Escaped keys are published when single pages are invalidated, each matches only its own page
+    for key in keys[1:]:
+        local.invalidate(glob.escape(key))
+    assert list(local.entries) == keys[:1]
+
+
+def test_encode_page():
+    page = encode_page({"datePublish": datetime(2022, 5, 1, 12, 30), "price": Decimal("9.50")})
+    assert page.body == b'{"datePublish":"2022-05-01T12:30:00","price":9.5}'
+    # Same bytes always get the same ETag
+    assert page.etag == encode_page({"datePublish": datetime(2022, 5, 1, 12, 30), "price": 9.5}).etag
+
+
+def test_etag_matches():
+    def request(if_none_match: str) -> Request:
+        return Request({"type": "http", "headers": [(b"if-none-match", if_none_match.encode())]})
+
+    assert etag_matches(request('"a", "b"'), '"b"')
+    # Weak and strong tags of the same value match
+    assert etag_matches(request('W/"a"'), '"a"')
+    assert etag_matches(request("*"), '"a"')
+    assert not etag_matches(request('"a"'), '"b"')
+    assert not etag_matches(Request({"type": "http", "headers": []}), '"a"')
+
+
+def test_compressed_page_response():
+    page = compress_page(encode_page({"text": "repeated text " * 200}))
+    assert set(page.encoded) == set(ENCODINGS)
+    response = page_response(Request({"type": "http", "headers": [(b"accept-encoding", b"gzip")]}), page, "Hit")
+    # Stored bytes are sent as they are, with an ETag of their own
+    assert response.body == page.encoded["gzip"]
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == page.etag[:-1] + '-gzip"'
+    response = page_response(Request({"type": "http", "headers": []}), page, "Hit")
+    assert response.body == page.body
+    assert "content-encoding" not in response.headers
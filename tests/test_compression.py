@@ -0,0 +1,73 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
+
+from app.compression import CompressionMiddleware, choose_encoding, compress
+
+LARGE = {"ideas": [{"shortDesc": "Short description of the idea. " * 4} for _ in range(20)]}
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+
+@app.get("/large")
+async def get_large():
+    return LARGE
+
+
+@app.get("/small")
+async def get_small():
+    return {"ok": True}
+
+
+@app.get("/encoded")
+async def get_encoded():
+    return Response(content=gzip.compress(b"{}" * 1000), media_type="application/json", headers={
+        "Content-Encoding": "gzip"
+    })
+
+
+@app.get("/stream")
+async def get_stream():
+    async def lines():
+        for index in range(100):
+            yield f"{index},some text that repeats\n"
+    return StreamingResponse(lines(), media_type="text/csv")
+
+
+def test_choose_encoding():
+    available = ["br", "gzip"]
+    assert choose_encoding("gzip, deflate, br", available) == "br"
+    assert choose_encoding("gzip;q=1.0, br;q=0.5", available) == "gzip"
+    assert choose_encoding("br;q=0, gzip", available) == "gzip"
+    assert choose_encoding("*", available) == "br"
+    assert choose_encoding("identity", available) is None
+    assert choose_encoding("", available) is None
+
+
+def test_compress_gzip():
+    assert gzip.decompress(compress(b"abc" * 100, "gzip", 6)) == b"abc" * 100
+
+
+@pytest.mark.asyncio
+async def test_compression_middleware():
+    headers = {"Accept-Encoding": "gzip"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        large = await client.get("/large", headers=headers)
+        small = await client.get("/small", headers=headers)
+        encoded = await client.get("/encoded", headers=headers)
+        stream = await client.get("/stream", headers=headers)
+        plain = await client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert large.headers["content-encoding"] == "gzip"
+    assert int(large.headers["content-length"]) < len(plain.content)
+    assert large.json() == plain.json() == LARGE
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in plain.headers
+    # Response that is already compressed is not compressed again
+    assert encoded.headers["content-encoding"] == "gzip"
+    assert encoded.content == b"{}" * 1000
+    assert stream.headers["content-encoding"] == "gzip"
+    assert stream.text.startswith("0,some text")
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from app import cache
+from app.database import in_values, row_values, TimedDatabase, read_from_replica, _client
+from app.metrics import REGISTRY
+
+
+def test_in_values():
+    placeholders, values = in_values("idea_id", ["a", "b"])
+    assert placeholders == ":idea_id0, :idea_id1"
+    assert values == {"idea_id0": "a", "idea_id1": "b"}
+
+
+def test_row_values():
+    placeholders, values = row_values(("idea_id", "user_id"), [("a", 1), ("b", 2)])
+    assert placeholders == "(:idea_id0, :user_id0), (:idea_id1, :user_id1)"
+    assert values == {"idea_id0": "a", "user_id0": 1, "idea_id1": "b", "user_id1": 2}
+
+
+@pytest.mark.asyncio
+async def test_replica_routing(tmp_path):
+    # Two SQLite files stand in for the primary and a replica, each knows its own name
+    database = TimedDatabase(f"sqlite:///{tmp_path}/primary.db", [f"sqlite:///{tmp_path}/replica.db"])
+    replica = database.replicas[0]
+    for db, name in ((database, "primary"), (replica.database, "replica")):
+        await db.connect()
+        await db.execute("CREATE TABLE source (name TEXT)")
+        await db.execute(f"INSERT INTO source VALUES ('{name}')")
+
+    # Every request runs in its own task, so the route and client it sets do not leak into the next one
+    async def request(read_only: bool, client: str = None, write: bool = False) -> str:
+        if read_only:
+            await read_from_replica()
+        _client.set(client)
+        if write:
+            await database.execute("UPDATE source SET name = 'primary'")
+        return await database.fetch_val("SELECT name FROM source")
+
+    def replica_reads() -> float:
+        labels = {"operation": "fetch_val", "target": "replica"}
+        return REGISTRY.get_sample_value("db_query_duration_seconds_count", labels) or 0.0
+
+    # Pins are only kept in this process
+    cache.redis_failed()
+    try:
+        assert await asyncio.ensure_future(request(read_only=False)) == "primary"
+        # Lag of the replica is not known yet
+        assert await asyncio.ensure_future(request(read_only=True)) == "primary"
+        replica.lag = 0.0
+        timed = replica_reads()
+        assert await asyncio.ensure_future(request(read_only=True)) == "replica"
+        assert replica_reads() == timed + 1
+
+        async def in_transaction() -> str:
+            await read_from_replica()
+            async with database.transaction():
+                return await database.fetch_val("SELECT name FROM source")
+
+        # Reads inside a transaction have to see its writes
+        assert await asyncio.ensure_future(in_transaction()) == "primary"
+        # Client that wrote reads from the primary, the others still from the replica
+        assert await asyncio.ensure_future(request(read_only=True, client="a", write=True)) == "primary"
+        assert await asyncio.ensure_future(request(read_only=True, client="a")) == "primary"
+        assert await asyncio.ensure_future(request(read_only=True, client="b")) == "replica"
+        replica.lag = 3600.0
+        assert await asyncio.ensure_future(request(read_only=True, client="b")) == "primary"
+    finally:
+        cache._redis_failed_at = 0.0
+        await database.disconnect()
+        await replica.database.disconnect()
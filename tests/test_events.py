@@ -0,0 +1,33 @@
+import pytest
+
+from app.events import EventBroker, Subscriber, RESYNC, watch_payment, notify_payment, _payment_waiters
+
+
+@pytest.mark.asyncio
+async def test_broker_dispatch():
+    broker = EventBroker(max_subscribers=2)
+    first, second = broker.subscribe("sse"), broker.subscribe("websocket")
+    assert broker.is_full()
+    broker.dispatch(b'{"type":"idea-sold","id":"a"}')
+    assert await first.get() == await second.get() == b'{"type":"idea-sold","id":"a"}'
+    broker.unsubscribe(first, "sse")
+    assert not broker.is_full()
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_resyncs():
+    subscriber = Subscriber(size=3)
+    for index in range(4):
+        subscriber.put(str(index).encode())
+    # Backlog of a client that fell behind is replaced by one resync
+    assert subscriber.queue.qsize() == 1
+    assert await subscriber.get() == RESYNC
+
+
+@pytest.mark.asyncio
+async def test_watch_payment():
+    with watch_payment("pi_1") as first, watch_payment("pi_1") as second:
+        notify_payment("pi_1", "succeeded")
+        assert await first == await second == "succeeded"
+    # Waiters are dropped with the requests that made them
+    assert "pi_1" not in _payment_waiters
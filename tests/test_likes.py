@@ -0,0 +1,83 @@
+import time
+
+from app import likes, cache
+from app.cache import get_async_redis
+
+USER_ID = 987654321
+IDEA_ID = "f" * 64
+
+
+class LikesTable:
+    # Stands in for the database, the callback runs after the likes were read and before the liked set is loaded
+    def __init__(self, rows, while_reading):
+        self.rows = rows
+        self.while_reading = while_reading
+
+    async def fetch_all(self, query, values=None):
+        rows = self.rows
+        if self.while_reading is not None:
+            callback, self.while_reading = self.while_reading, None
+            await callback()
+            # Likers of the idea are read by toggle_like, nobody else likes it
+            self.rows = []
+        return rows
+
+
+async def clear():
+    r = get_async_redis()
+    await r.delete(
+        likes.LIKED_KEY.format(user_id=USER_ID), likes.LIKERS_KEY.format(idea_id=IDEA_ID),
+        likes.LIKE_COUNT_KEY.format(idea_id=IDEA_ID)
+    )
+    await r.hdel(likes.PENDING_LIKES_KEY, f"{IDEA_ID}:{USER_ID}")
+
+
+async def test_like_toggled_while_liked_set_loads(monkeypatch):
+    await clear()
+
+    async def like():
+        assert await likes.toggle_like(IDEA_ID, USER_ID) == (True, 1)
+
+    monkeypatch.setattr(likes, "database", LikesTable([], like))
+    # Like is not in the rows that were read, the set is loaded with it all the same
+    assert await likes.get_liked(USER_ID, [IDEA_ID]) == [IDEA_ID]
+    assert await likes.get_liked(USER_ID, [IDEA_ID]) == [IDEA_ID]
+    await clear()
+
+
+async def test_liked_set_loaded_meanwhile(monkeypatch):
+    await clear()
+
+    async def load_and_unlike():
+        # Another request loaded the set after the user removed the like
+        await get_async_redis().sadd(likes.LIKED_KEY.format(user_id=USER_ID), "")
+
+    monkeypatch.setattr(likes, "database", LikesTable([{"idea_id": IDEA_ID}], load_and_unlike))
+    assert await likes.get_liked(USER_ID, [IDEA_ID]) == []
+    assert await likes.get_liked(USER_ID, [IDEA_ID]) == []
+    await clear()
+
+
+async def test_likers_loaded_with_changes_not_written(monkeypatch):
+    await clear()
+    # Another user liked the idea, the like is not in the database yet
+    await get_async_redis().hset(likes.PENDING_LIKES_KEY, f"{IDEA_ID}:1", 1)
+    monkeypatch.setattr(likes, "database", LikesTable([], None))
+    assert await likes.toggle_like(IDEA_ID, USER_ID) == (True, 2)
+    await get_async_redis().hdel(likes.PENDING_LIKES_KEY, f"{IDEA_ID}:1")
+    await clear()
+
+
+async def test_like_written_directly(monkeypatch):
+    await clear()
+    monkeypatch.setattr(likes, "database", LikesTable([], None))
+    assert await likes.toggle_like(IDEA_ID, USER_ID) == (True, 1)
+    # Removed in the database while Redis was not available, the like left in Redis must not be written back
+    monkeypatch.setattr(cache, "_redis_failed_at", time.time())
+    await likes.like_written_directly(IDEA_ID, USER_ID)
+    monkeypatch.setattr(cache, "_redis_failed_at", 0.0)
+    await likes.drop_likes_written_directly()
+    r = get_async_redis()
+    assert await r.hget(likes.PENDING_LIKES_KEY, f"{IDEA_ID}:{USER_ID}") is None
+    assert await r.exists(likes.LIKERS_KEY.format(idea_id=IDEA_ID)) == 0
+    await clear()
@@ -0,0 +1,32 @@
+import pytest
+from fastapi import FastAPI, Response
+from httpx import AsyncClient
+
+from app.metrics import MetricsMiddleware, REGISTRY, UNMATCHED_ROUTE
+
+app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/items/{item_id}")
+async def get_item(item_id: int):
+    return Response(content=str(item_id), headers={"X-MyAPI-Cache": "Hit"})
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_route_template_label():
+    labels = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    before = sample("http_requests_total", labels)
+    hits = sample("cache_requests_total", {"route": "/items/{item_id}", "result": "hit"})
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+        await client.get("/missing")
+    # Both items are counted under the path template, not under their own paths
+    assert sample("http_requests_total", labels) == before + 2
+    assert sample("cache_requests_total", {"route": "/items/{item_id}", "result": "hit"}) == hits + 2
+    assert sample("http_requests_total", {"method": "GET", "route": UNMATCHED_ROUTE, "status": "404"}) >= 1
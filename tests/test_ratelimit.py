@@ -0,0 +1,24 @@
+from app.ratelimit import LocalSlidingWindow
+
+
+def test_local_sliding_window():
+    window = LocalSlidingWindow()
+    assert [window.hit("client", 2, 60, now) for now in (0, 10, 20)] == [0, 0, 40]
+    # First request leaves the window after 60 seconds and frees one place
+    assert window.hit("client", 2, 60, 61) == 0
+    assert window.hit("other", 2, 60, 61) == 0
+
+
+def test_local_sliding_window_check_only():
+    window = LocalSlidingWindow()
+    # Checks do not count, only the failures do
+    assert [window.hit("client", 1, 60, now, count=False) for now in (0, 1)] == [0, 0]
+    assert window.hit("client", 1, 60, 2) == 0
+    assert window.hit("client", 1, 60, 3, count=False) == 59
+
+
+def test_local_sliding_window_forgets_old_clients():
+    window = LocalSlidingWindow(max_keys=2)
+    for client in ("a", "b", "c"):
+        window.hit(client, 1, 60, 0)
+    assert list(window.hits) == ["b", "c"]
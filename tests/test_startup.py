@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import time
+
+# Seconds a new interpreter may take to import the app, with room for slow CI machines. STARTUP_BUDGET tightens it,
+# python -m benchmarks.startup shows where the time goes.
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", 4.0))
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code: str) -> str:
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+
+
+def test_sdks_load_lazily():
+    modules = run("import sys, app.main; print(' '.join(sys.modules))").split()
+    for sdk in ("stripe", "passlib"):
+        assert sdk not in modules
+
+
+def test_startup_budget():
+    # Best of three, the first one may write the bytecode
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        run("import app.main")
+        timings.append(time.perf_counter() - started)
+    assert min(timings) < STARTUP_BUDGET
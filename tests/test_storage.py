@@ -0,0 +1,76 @@
+import os
+import time
+
+import pytest
+import hashlib
+from databases import Database
+
+from app import storage
+from app.storage import get_blob_path, write_blob, iter_cdn_files, collect_orphaned_files, BLOBS_FOLDER
+
+
+def test_blob_path():
+    blob_hash = hashlib.sha256(b"creativitycrop").hexdigest()
+    path = get_blob_path(blob_hash, "image/png", "Title Image.PNG")
+    assert path == f"{BLOBS_FOLDER}{blob_hash[:2]}/{blob_hash[2:4]}/{blob_hash}.png"
+    # Same contents always end up under the same path, no matter the filename
+    assert get_blob_path(blob_hash, "image/png", "other.png") == path
+
+
+@pytest.mark.asyncio
+async def test_write_blob_once(tmp_path):
+    path = str(tmp_path / "blob.bin")
+    assert await write_blob(path, b"data")
+    # Second write of the same blob is skipped
+    assert not await write_blob(path, b"data")
+    with open(path, "rb") as blob:
+        assert blob.read() == b"data"
+
+
+def test_iter_cdn_files(tmp_path):
+    (tmp_path / "blobs" / "ab").mkdir(parents=True)
+    (tmp_path / "blobs" / "ab" / "one.png").write_bytes(b"1")
+    (tmp_path / "avatars").mkdir()
+    (tmp_path / "avatars" / "two.png").write_bytes(b"2")
+    # Only files are listed, folders are walked into
+    assert sorted(entry.name for entry in iter_cdn_files(str(tmp_path))) == ["one.png", "two.png"]
+
+
+@pytest.mark.asyncio
+async def test_collect_orphaned_files(tmp_path, monkeypatch):
+    blob_hash = hashlib.sha256(b"blob").hexdigest()
+    cdn = f"{tmp_path}/cdn/"
+    paths = {
+        "legacy": f"{cdn}ideas-files/abc/docs/plan.pdf",
+        "blob": f"{cdn}{get_blob_path(blob_hash, 'image/png')}",
+        "derivative": f"{cdn}{BLOBS_FOLDER}{blob_hash[:2]}/{blob_hash[2:4]}/{blob_hash}.thumbnail.webp",
+        "orphan": f"{cdn}ideas-files/abc/docs/old.pdf"
+    }
+    old = time.time() - 7 * 24 * 3600
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(b"data")
+        os.utime(path, (old, old))
+
+    database = Database(f"sqlite:///{tmp_path}/gc.db")
+    await database.connect()
+    try:
+        await database.execute("CREATE TABLE files (id TEXT, absolute_path TEXT)")
+        await database.execute("CREATE TABLE blobs (hash TEXT, absolute_path TEXT)")
+        # Idea file stored before the blob store, its row has "//" between the folder and the name
+        await database.execute(
+            "INSERT INTO files VALUES ('a', :path)", values={"path": f"{cdn}ideas-files/abc/docs//plan.pdf"}
+        )
+        await database.execute(
+            "INSERT INTO blobs VALUES (:hash, :path)", values={"hash": blob_hash, "path": paths["blob"]}
+        )
+        monkeypatch.setattr(storage, "database", database)
+        # Batches smaller than the tree, so files are checked in more than one of them
+        report = await collect_orphaned_files(dry_run=False, batch_size=3, rate=1000000, path=cdn)
+    finally:
+        await database.disconnect()
+
+    assert report["scanned"] == 4 and report["referenced"] == 3
+    assert report["orphans"] == [paths["orphan"]]
+    assert [name for name, path in paths.items() if os.path.exists(path)] == ["legacy", "blob", "derivative"]
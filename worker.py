@@ -1,14 +1,17 @@
+import sys
 import asyncmy
 import asyncio
-import stripe
-import requests
 import json
-from datetime import datetime
 
-from app.config import DB_HOST, DB_USER, DB_PASS, DB_NAME, STRIPE_API_KEY, MAILGUN_API_KEY
+from app.config import DB_HOST, DB_USER, DB_PASS, DB_NAME
 from app.cache import invalidate_ideas
-
-stripe.api_key = str(STRIPE_API_KEY)
+from app.events import publish_event, IDEA_RELEASED
+from app.database import database as app_database
+from app.categories import change_category_counts, recount_categories
+from app.expiry import archive_expired_ideas
+from app.mail import send_mail
+from app.payments import get_stripe
+from app.storage import collect_unreferenced_blobs, collect_orphaned_files
 
 
 async def cleanup_database():
@@ -24,14 +27,17 @@ async def cleanup_database():
     payments = await cursor.fetchall()
 
     # Remove buy lock from ideas and allow them to be on the marketplace
+    stripe = get_stripe()
     for payment in payments:
         stripe.PaymentIntent.cancel(
             stripe.PaymentIntent(payment["id"])
         )
         await cursor.execute("DELETE FROM payments WHERE id = %s", (payment["id"],))
         await cursor.execute("UPDATE ideas SET buyer_id = NULL WHERE id=%s", (payment["idea_id"],))
-    if payments is not None:
-        invalidate_ideas()
+    if len(payments) != 0:
+        await invalidate_ideas(*[payment["idea_id"] for payment in payments])
+        for payment in payments:
+            await publish_event(IDEA_RELEASED, payment["idea_id"])
 
     # Delete old categories and likes from ideas that were deleted
     await cursor.execute("DELETE FROM ideas_categories WHERE idea_id NOT IN (SELECT id FROM ideas)")
@@ -45,27 +51,54 @@ async def cleanup_database():
     )
     users = await cursor.fetchall()
     for user in users:
-        requests.post(
-            "https://api.eu.mailgun.net/v3/app.creativitycrop.tech/messages",
-            auth=("api", str(MAILGUN_API_KEY)),
-            data={
-                "from": "Friendly Bot from CreativityCrop <no-reply@app.creativitycrop.tech>",
-                "to": user["email"],
-                "subject": "CreativityCrop - Account Deleted",
-                "template": "delete-user",
-                'h:X-Mailgun-Variables': json.dumps({
-                    "user_name": user["first_name"],
-                    "current_year": datetime.now().year
-                })
-            }
+        send_mail(
+            to=user["email"],
+            subject="CreativityCrop - Account Deleted",
+            template="delete-user",
+            variables={"user_name": user["first_name"]}
         )
         await cursor.execute("DELETE FROM users WHERE id=%s", (user["id"],))
 
     # Close cursor and db everything is complete!
     await cursor.close()
     database.close()
+
+    # Category counts, archiving and the storage layer work with the app database
+    await app_database.connect()
+    # Released ideas are for sale again
+    await change_category_counts([payment["idea_id"] for payment in payments], 1)
+    # Expired ideas leave the listings at once, archiving takes them out of the category counts and the cached pages
+    archived = await archive_expired_ideas()
+    print(f"Archived {archived} expired ideas")
+    # Delete stored files that are not referenced anymore
+    removed = await collect_unreferenced_blobs()
+    await app_database.disconnect()
+    print(f"Removed {removed} unreferenced blobs")
     print("DB cleaning process is completed!")
 
 
+async def cleanup_files(dry_run: bool):
+    print("Starting orphaned files cleanup process" + (" (dry run)" if dry_run else ""))
+    await app_database.connect()
+    report = await collect_orphaned_files(dry_run=dry_run)
+    await app_database.disconnect()
+    print(json.dumps(report, indent=2))
+
+
+async def recount_categories_command():
+    # Repairs the numbers of ideas per category, e.g. after ideas were changed by hand in the database
+    await app_database.connect()
+    await recount_categories()
+    await app_database.disconnect()
+    await invalidate_ideas()
+    print("Categories recounted")
+
+
 if __name__ == "__main__":
-    asyncio.run(cleanup_database())
+    # Orphaned files are collected on demand, a scan of the whole CDN folder is too heavy for every cron run
+    if "gc-files" in sys.argv:
+        asyncio.run(cleanup_files(dry_run="dry-run" in sys.argv))
+    elif "recount-categories" in sys.argv:
+        asyncio.run(recount_categories_command())
+    else:
+        asyncio.run(cleanup_database())